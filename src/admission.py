@@ -0,0 +1,386 @@
+"""
+Admission control for the expensive API endpoints.
+
+Every request to a governed path passes two gates before it reaches the app:
+
+1. A per-client token bucket. The client is the peer address or, behind
+   ADMISSION_TRUSTED_PROXIES proxies that append to the header named by
+   ADMISSION_CLIENT_HEADER (e.g. x-forwarded-for), the entry the outermost
+   trusted proxy added; entries left of it are whatever the client sent.
+   Uploads cost one token per MiB of Content-Length, everything else one per
+   request. An empty bucket is a 429 with Retry-After set to when the bucket
+   will have enough tokens again.
+2. A per-endpoint-group concurrency pool ("query", "upload", "metrics",
+   "export"). A full pool queues the request up to `max_queue` deep for at
+   most `queue_timeout` seconds; past that it is a 503 (the server, not the
+   client, is over its limit) with a Retry-After estimated from the pool's
+   recent service times.
+
+Pool slots are held until the response body has been sent, so streaming
+responses count too. Buckets live in-process by default; set
+RATE_LIMIT_BACKEND=sqlite:/path/to/limits.db to share them between worker
+processes (a local stand-in for a networked store). Any object with the
+`RateLimitBackend.take` signature can be plugged in; backends that do I/O
+(`blocking = True`) are called from the threadpool, off the event loop.
+
+Limits are read from ADMISSION_<POOL>_<SETTING> environment variables, e.g.
+ADMISSION_QUERY_CONCURRENCY=8 or ADMISSION_UPLOAD_RATE_PER_MIN=100.
+"""
+
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "").lower()
+# Proxies in front of the app that each append their peer to that header.
+ADMISSION_TRUSTED_PROXIES = int(os.getenv("ADMISSION_TRUSTED_PROXIES", "1"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+
+class RateLimitBackend(Protocol):
+    # Whether `take` does I/O and must not run on the event loop.
+    blocking: bool
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Spend `cost` tokens from `key`'s bucket; 0 if admitted, else seconds to wait."""
+        ...
+
+
+def _refill(tokens: float, updated: float, now: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(now - updated, 0.0) * rate)
+
+
+def _spend(tokens: float, cost: float, rate: float) -> Tuple[float, float]:
+    """(tokens left, wait seconds) for spending `cost` from `tokens`."""
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate if rate > 0 else math.inf
+
+
+class InMemoryBackend:
+    """Token buckets in a dict; per-process."""
+
+    blocking = False
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait = _spend(_refill(tokens, updated, now, rate, burst), cost, rate)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+
+class SQLiteBackend:
+    """
+    Token buckets in a SQLite file shared by every worker on the host.
+
+    Each take is one short IMMEDIATE transaction, so concurrent workers
+    serialize on the bucket update rather than double-spending tokens.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            """
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Never reuse a connection inherited from a preforking parent.
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?;", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, wait = _spend(_refill(tokens, updated, now, rate, burst), cost, rate)
+            conn.execute(
+                """
+                INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated;
+                """,
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT;")
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+        return wait
+
+
+def backend_from_env(spec: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if spec.startswith("sqlite:"):
+        return SQLiteBackend(spec[len("sqlite:"):])
+    if spec != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {spec}")
+    return InMemoryBackend()
+
+
+@dataclass
+class PoolStats:
+    admitted: int = 0
+    rate_limited: int = 0
+    queue_full: int = 0
+    queue_timeout: int = 0
+
+
+class ConcurrencyPool:
+    """A bounded number of in-flight requests plus a bounded wait queue."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout: float) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = PoolStats()
+        # Exponentially weighted mean request duration, for Retry-After.
+        self.mean_service_seconds = 1.0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def retry_after(self) -> int:
+        backlog = (self.queued + 1) / max(self.concurrency, 1)
+        return max(1, math.ceil(self.mean_service_seconds * backlog))
+
+    async def acquire(self) -> Optional[str]:
+        """None once a slot is held, else the rejection reason."""
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.stats.queue_full += 1
+                return "queue_full"
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats.queue_timeout += 1
+                return "queue_timeout"
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.stats.admitted += 1
+        return None
+
+    def release(self, seconds: float) -> None:
+        self.in_flight -= 1
+        self.mean_service_seconds += 0.2 * (seconds - self.mean_service_seconds)
+        self._semaphore.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "mean_service_seconds": round(self.mean_service_seconds, 3),
+            **self.stats.__dict__,
+        }
+
+
+@dataclass
+class AdmissionPolicy:
+    pool: str
+    # Paths governed by this policy (exact match or prefix ending in "/").
+    paths: List[str]
+    rate_per_min: float
+    burst: float
+    concurrency: int
+    max_queue: int
+    queue_timeout: float
+    # Extra bucket tokens per MiB of request body, for uploads.
+    cost_per_mib: float = 0.0
+    methods: List[str] = field(default_factory=lambda: ["GET", "POST", "DELETE"])
+
+    def matches(self, method: str, path: str) -> bool:
+        if method not in self.methods:
+            return False
+        return any(path == p or (p.endswith("/") and path.startswith(p)) for p in self.paths)
+
+    def cost(self, content_length: int) -> float:
+        if self.cost_per_mib:
+            return max(1.0, content_length / 2**20 * self.cost_per_mib)
+        return 1.0
+
+
+def _env_policy(pool: str, paths: List[str], **defaults: float) -> AdmissionPolicy:
+    settings = {
+        name: type(value)(os.getenv(f"ADMISSION_{pool.upper()}_{name.upper()}", value))
+        for name, value in defaults.items()
+    }
+    return AdmissionPolicy(pool=pool, paths=paths, **settings)
+
+
+def default_policies() -> List[AdmissionPolicy]:
+    return [
+        _env_policy(
+            "query",
+            ["/api/query"],
+            rate_per_min=10.0, burst=5.0, concurrency=4, max_queue=16, queue_timeout=30.0,
+        ),
+        _env_policy(
+            "upload",
+            ["/api/upload"],
+            rate_per_min=50.0, burst=200.0, concurrency=2, max_queue=4, queue_timeout=60.0,
+            cost_per_mib=1.0,
+        ),
+        _env_policy(
+            "metrics",
+            [
+                "/api/metrics", "/api/search", "/api/databases", "/api/invoices",
+                "/api/quarantine", "/api/quarantine/",
+            ],
+            rate_per_min=120.0, burst=30.0, concurrency=8, max_queue=32, queue_timeout=5.0,
+        ),
+        _env_policy(
+            "export",
+            ["/api/invoices/export"],
+            rate_per_min=6.0, burst=3.0, concurrency=2, max_queue=4, queue_timeout=10.0,
+        ),
+    ]
+
+
+class AdmissionController:
+    """Buckets and pools for `policies`; shared by the middleware and /api/admission."""
+
+    def __init__(
+        self,
+        policies: Optional[List[AdmissionPolicy]] = None,
+        backend: Optional[RateLimitBackend] = None,
+    ) -> None:
+        self.policies = policies if policies is not None else default_policies()
+        self.backend = backend or backend_from_env()
+        self.pools = {
+            p.pool: ConcurrencyPool(p.pool, p.concurrency, p.max_queue, p.queue_timeout)
+            for p in self.policies
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.snapshot() for name, pool in self.pools.items()}
+
+    def policy_for(self, method: str, path: str) -> Optional[AdmissionPolicy]:
+        return next((p for p in self.policies if p.matches(method, path)), None)
+
+    def take(self, policy: AdmissionPolicy, client: str, content_length: int) -> float:
+        """Charge the client's bucket; 0 if admitted, else seconds to wait."""
+        # A request costing more than the bucket can ever hold would never
+        # be admitted; charge it a full bucket instead.
+        cost = min(policy.cost(content_length), policy.burst)
+        wait = self.backend.take(
+            f"{policy.pool}:{client}", cost, policy.rate_per_min / 60.0, policy.burst
+        )
+        if wait > 0:
+            self.pools[policy.pool].stats.rate_limited += 1
+        return wait
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to HTTP requests."""
+
+    def __init__(self, app: Callable, controller: AdmissionController) -> None:
+        self.app = app
+        self.controller = controller
+
+    @staticmethod
+    def _client(
+        scope: Dict[str, Any],
+        headers: Dict[bytes, bytes],
+        header: str = ADMISSION_CLIENT_HEADER,
+        trusted_proxies: int = ADMISSION_TRUSTED_PROXIES,
+    ) -> str:
+        if header and trusted_proxies > 0:
+            value = headers.get(header.encode("latin-1"))
+            entries = [e.strip() for e in value.decode("latin-1").split(",")] if value else []
+            entries = [e for e in entries if e]
+            if entries:
+                # Fewer entries than proxies: the leftmost is still one a
+                # trusted proxy wrote.
+                return entries[-min(trusted_proxies, len(entries))]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    async def _reject(send: Callable, status: int, reason: str, retry_after: float) -> None:
+        seconds = max(1, math.ceil(retry_after)) if math.isfinite(retry_after) else 3600
+        detail = "Too many requests" if status == 429 else "Server busy"
+        body = json.dumps({"detail": f"{detail} ({reason})", "retry_after": seconds}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(seconds).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        policy = None
+        if scope["type"] == "http":
+            policy = self.controller.policy_for(scope["method"], scope["path"])
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        try:
+            content_length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            content_length = 0
+        client = self._client(scope, headers)
+        if getattr(self.controller.backend, "blocking", True):
+            wait = await run_in_threadpool(self.controller.take, policy, client, content_length)
+        else:
+            wait = self.controller.take(policy, client, content_length)
+        if wait > 0:
+            await self._reject(send, 429, "rate_limited", wait)
+            return
+
+        pool = self.controller.pools[policy.pool]
+        rejected = await pool.acquire()
+        if rejected is not None:
+            await self._reject(send, 503, rejected, pool.retry_after())
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release(time.monotonic() - started)
@@ -0,0 +1,366 @@
+"""
+LangGraph SQL agent over the registered databases (see databases.py).
+
+Shared by the web app and the CLI. Each question is first routed to one
+database; its tools, connection pool and schema summary come from the shared
+registry. Conversations are checkpointed per `thread_id` (a session id), so a
+follow-up question continues the previous messages instead of rediscovering
+tables and schema. To keep prompt size and
+therefore latency bounded, every run starts by compacting the history: query
+results from earlier turns are trimmed, and only the first turn (which holds
+the schema) plus the last MAX_HISTORY_TURNS turns are kept. Query results
+themselves enter the conversation already capped and summarized (see
+query_results.py). Databases with a vector index (see vector_index.py) also
+get an `invoice_semantic_search` tool for loosely worded lookups.
+"""
+
+import json
+import os
+import sqlite3
+from typing import Any, Dict, List, Literal, Optional
+
+from langchain.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain.tools import tool
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.utilities import SQLDatabase
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+from sqlalchemy import text
+
+from databases import DatabaseRegistry
+from query_results import RESULT_MAX_ROWS, ShapedResult, shape_rows
+from vector_index import VectorIndex
+
+
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "checkpoints.db")
+MAX_HISTORY_TURNS = int(os.getenv("AGENT_MAX_HISTORY_TURNS", "4"))
+COMPACT_TOOL_CHARS = int(os.getenv("AGENT_COMPACT_TOOL_CHARS", "400"))
+
+_TRIM_MARKER = "[trimmed from an earlier answer]"
+
+SEMANTIC_SEARCH_TOOL = "invoice_semantic_search"
+# Tool results trimmed in earlier turns by compact_history.
+_COMPACTED_TOOLS = ("sql_db_query", SEMANTIC_SEARCH_TOOL)
+
+
+generate_query_system_prompt = """
+You are an agent designed to interact with a SQL database: {description}
+Given an input question, create a syntactically correct {dialect} query to run,
+then look at the results of the query and return the answer in clear,
+user-friendly language. Unless the user specifies a specific number of examples
+they wish to obtain, always limit your query to at most {top_k} results.
+
+You can order the results by a relevant column to return the most interesting
+examples in the database. Never query for all the columns from a specific table,
+only ask for the relevant columns given the question.
+
+The database has these tables:
+{schema_summary}
+{notes}
+Query results show at most {max_rows} rows; when rows are left out, a column
+summary (count/min/max/sum over all rows) follows. Prefer aggregate queries
+(SUM, COUNT, GROUP BY) over fetching rows to add up yourself.
+
+Earlier questions and answers in this conversation are context for follow-ups.
+
+DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
+"""
+
+
+semantic_search_prompt_note = f"""
+When the question describes invoices loosely (a kind of purchase, a vague or
+misspelled seller or place, e.g. "that coffee place in Philly", "my cloud
+bills"), first call `{SEMANTIC_SEARCH_TOOL}` to find candidate invoice ids,
+then query `invoices` by id for exact figures. Call it on its own, not
+together with a query.
+"""
+
+
+check_query_system_prompt = """
+You are a SQL expert with a strong attention to detail.
+Double check the {dialect} query for common mistakes, including:
+- Using NOT IN with NULL values
+- Using UNION when UNION ALL should have been used
+- Using BETWEEN for exclusive ranges
+- Data type mismatch in predicates
+- Properly quoting identifiers
+- Using the correct number of arguments for functions
+- Casting to the correct data type
+- Using the proper columns for joins
+
+If there are any of the above mistakes, rewrite the query. If there are no mistakes,
+just reproduce the original query.
+
+You will call the appropriate tool to execute the query after running this check.
+"""
+
+
+class AgentState(MessagesState):
+    # Database the conversation is currently about, chosen by route_database.
+    database: Optional[str]
+    # Set per request to bypass routing.
+    requested_database: Optional[str]
+
+
+def open_checkpointer(path: str = CHECKPOINT_DB_PATH) -> SqliteSaver:
+    """A SQLite checkpointer usable from FastAPI's worker threads."""
+    saver = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    saver.setup()
+    return saver
+
+
+def compact_history(state: MessagesState) -> Dict[str, List[Any]]:
+    """
+    Bound the conversation carried into the next LLM calls.
+
+    Drops whole turns between the first one (list_tables/get_schema context)
+    and the last MAX_HISTORY_TURNS, and trims query and semantic search
+    results of every earlier turn to COMPACT_TOOL_CHARS. The current question
+    is untouched.
+    """
+    messages = state["messages"]
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(turn_starts) <= 1:
+        return {"messages": []}
+
+    current = turn_starts[-1]
+    first_kept = turn_starts[max(1, len(turn_starts) - 1 - MAX_HISTORY_TURNS)]
+    updates: List[Any] = [RemoveMessage(id=m.id) for m in messages[turn_starts[1] : first_kept]]
+
+    for message in messages[:turn_starts[1]] + messages[first_kept:current]:
+        if not isinstance(message, ToolMessage) or message.name not in _COMPACTED_TOOLS:
+            continue
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if len(content) <= COMPACT_TOOL_CHARS or content.endswith(_TRIM_MARKER):
+            continue
+        trimmed = f"{content[:COMPACT_TOOL_CHARS]}… {_TRIM_MARKER}"
+        updates.append(message.model_copy(update={"content": trimmed}))
+    return {"messages": updates}
+
+
+def _list_tables_call_id(database: str) -> str:
+    return f"list_tables:{database}"
+
+
+def has_schema(state: AgentState) -> Literal["list_tables", "generate_query"]:
+    """Skip table/schema discovery when the conversation already has it."""
+    call_id = _list_tables_call_id(state["database"])
+    for message in state["messages"]:
+        if isinstance(message, ToolMessage) and message.tool_call_id == call_id:
+            return "generate_query"
+    return "list_tables"
+
+
+def run_sql(db: SQLDatabase, query: str) -> ShapedResult:
+    """Execute `query` and shape its rows for the prompt (errors as text)."""
+    try:
+        # Rows are consumed while this checkout holds the connection;
+        # `db.run(..., fetch="cursor")` returns after handing it back to the
+        # pool, where another thread could take it mid-fetch.
+        with db._engine.connect() as conn:
+            result = conn.execute(text(query))
+            if not result.returns_rows:
+                conn.commit()
+                return shape_rows([], [])
+            return shape_rows(list(result.keys()), result)
+    except Exception as exc:
+        message = f"Error: {exc}"
+        return ShapedResult(text=message, row_count=0, raw_tokens=0, shaped_tokens=0)
+
+
+def result_savings(messages: List[Any]) -> Dict[str, int]:
+    """Prompt tokens of the latest question's query results, raw vs shaped."""
+    totals = {"raw_tokens": 0, "shaped_tokens": 0, "tokens_saved": 0}
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and isinstance(message.artifact, dict):
+            for key in totals:
+                totals[key] += message.artifact.get(key, 0)
+    return totals
+
+
+def semantic_search_tool(index: VectorIndex):
+    """The agent tool over one database's vector index."""
+
+    @tool(SEMANTIC_SEARCH_TOOL)
+    def invoice_semantic_search(query: str, k: int = 5) -> str:
+        """
+        Find the invoices closest in meaning to a loose description such as
+        "coffee place in Philly" or "cloud bills". Returns JSON with each
+        invoice's id, date, seller, products, total and a similarity score.
+        """
+        hits = index.search(query, max(1, min(k, 20)))
+        return json.dumps(hits, default=str) if hits else "No similar invoices found."
+
+    return invoice_semantic_search
+
+
+def build_agent(
+    registry: DatabaseRegistry,
+    llm: Any,
+    checkpointer: Any = None,
+    semantic_indexes: Optional[Dict[str, VectorIndex]] = None,
+):
+    """Compile the route → list-tables → schema → generate/check/run query graph."""
+    toolkits: Dict[str, Dict[str, Any]] = {}
+    prompts: Dict[str, str] = {}
+    semantic_indexes = semantic_indexes or {}
+
+    def tools_for(database: str) -> Dict[str, Any]:
+        if database not in toolkits:
+            toolkit = SQLDatabaseToolkit(db=registry.database(database), llm=llm)
+            toolkits[database] = {tool.name: tool for tool in toolkit.get_tools()}
+            if database in semantic_indexes:
+                toolkits[database][SEMANTIC_SEARCH_TOOL] = semantic_search_tool(semantic_indexes[database])
+        return toolkits[database]
+
+    def generate_prompt_for(database: str) -> str:
+        if database not in prompts:
+            spec = registry.specs[database]
+            prompts[database] = generate_query_system_prompt.format(
+                description=spec.description,
+                dialect=registry.database(database).dialect,
+                top_k=5,
+                schema_summary=registry.schema_summary(database),
+                notes=spec.prompt_notes,
+                max_rows=RESULT_MAX_ROWS,
+            )
+            if database in semantic_indexes:
+                prompts[database] += semantic_search_prompt_note
+        return prompts[database]
+
+    # Tool schemas are the same for every database, so one set is bound to
+    # the LLM; calls execute against the routed database's tools.
+    default_tools = tools_for(registry.default)
+    get_schema_tool = default_tools["sql_db_schema"]
+    run_query_tool = default_tools["sql_db_query"]
+    check_prompt = check_query_system_prompt.format(dialect=registry.database(registry.default).dialect)
+
+    def route_database(state: AgentState):
+        requested = state.get("requested_database")
+        if requested:
+            return {"database": requested}
+        question = state["messages"][-1].content
+        return {"database": registry.route(str(question), state.get("database"))}
+
+    def list_tables(state: AgentState):
+        database = state["database"]
+        tool_call = {
+            "name": "sql_db_list_tables",
+            "args": {},
+            "id": _list_tables_call_id(database),
+            "type": "tool_call",
+        }
+        tool_call_message = AIMessage(content="", tool_calls=[tool_call])
+
+        tool_message = tools_for(database)["sql_db_list_tables"].invoke(tool_call)
+        response = AIMessage(f"Available tables in {database}: {tool_message.content}")
+
+        return {"messages": [tool_call_message, tool_message, response]}
+
+    def call_get_schema(state: AgentState):
+        llm_with_tools = llm.bind_tools([get_schema_tool], tool_choice="any")
+        response = llm_with_tools.invoke(state["messages"])
+        return {"messages": [response]}
+
+    def get_schema(state: AgentState):
+        schema_tool = tools_for(state["database"])["sql_db_schema"]
+        calls = state["messages"][-1].tool_calls
+        return {"messages": [schema_tool.invoke({**call, "type": "tool_call"}) for call in calls]}
+
+    def generate_query(state: AgentState):
+        system_message = {
+            "role": "system",
+            "content": generate_prompt_for(state["database"]),
+        }
+        tools = [run_query_tool]
+        if state["database"] in semantic_indexes:
+            tools.append(tools_for(state["database"])[SEMANTIC_SEARCH_TOOL])
+        llm_with_tools = llm.bind_tools(tools)
+        response = llm_with_tools.invoke([system_message] + state["messages"])
+        return {"messages": [response]}
+
+    def semantic_search(state: AgentState):
+        search_tool = tools_for(state["database"])[SEMANTIC_SEARCH_TOOL]
+        messages = []
+        for call in state["messages"][-1].tool_calls:
+            if call["name"] == SEMANTIC_SEARCH_TOOL:
+                messages.append(search_tool.invoke({**call, "type": "tool_call"}))
+            else:
+                # Every tool call needs a reply; the query is asked again later.
+                messages.append(
+                    ToolMessage(
+                        content=f"Not run: call {call['name']} on its own after reading the search results.",
+                        name=call["name"],
+                        tool_call_id=call["id"],
+                    )
+                )
+        return {"messages": messages}
+
+    def check_query(state: AgentState):
+        system_message = {
+            "role": "system",
+            "content": check_prompt,
+        }
+
+        tool_call = state["messages"][-1].tool_calls[0]
+        user_message = {"role": "user", "content": tool_call["args"]["query"]}
+        llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
+        response = llm_with_tools.invoke([system_message, user_message])
+        response.id = state["messages"][-1].id
+
+        return {"messages": [response]}
+
+    def run_query(state: AgentState):
+        tool_call = state["messages"][-1].tool_calls[0]
+        shaped = run_sql(registry.database(state["database"]), tool_call["args"]["query"])
+        tool_message = ToolMessage(
+            content=shaped.text,
+            name=run_query_tool.name,
+            tool_call_id=tool_call["id"],
+            artifact={
+                "row_count": shaped.row_count,
+                "raw_tokens": shaped.raw_tokens,
+                "shaped_tokens": shaped.shaped_tokens,
+                "tokens_saved": shaped.tokens_saved,
+            },
+        )
+        return {"messages": [tool_message]}
+
+    def should_continue(state: AgentState) -> Literal[END, "check_query", "semantic_search"]:
+        messages = state["messages"]
+        last_message = messages[-1]
+        if not last_message.tool_calls:
+            return END
+        elif any(call["name"] == SEMANTIC_SEARCH_TOOL for call in last_message.tool_calls):
+            return "semantic_search"
+        else:
+            return "check_query"
+
+    builder = StateGraph(AgentState)
+    builder.add_node(compact_history)
+    builder.add_node(route_database)
+    builder.add_node(list_tables)
+    builder.add_node(call_get_schema)
+    builder.add_node(get_schema)
+    builder.add_node(generate_query)
+    builder.add_node(check_query)
+    builder.add_node(run_query)
+    builder.add_node(semantic_search)
+
+    builder.add_edge(START, "compact_history")
+    builder.add_edge("compact_history", "route_database")
+    builder.add_conditional_edges("route_database", has_schema)
+    builder.add_edge("list_tables", "call_get_schema")
+    builder.add_edge("call_get_schema", "get_schema")
+    builder.add_edge("get_schema", "generate_query")
+    builder.add_conditional_edges(
+        "generate_query",
+        should_continue,
+    )
+    builder.add_edge("check_query", "run_query")
+    builder.add_edge("run_query", "generate_query")
+    builder.add_edge("semantic_search", "generate_query")
+
+    return builder.compile(checkpointer=checkpointer)
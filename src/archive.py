@@ -0,0 +1,333 @@
+"""
+Year-partitioned archives of closed years of invoices.
+
+The hot `invoices` table in invoices.db keeps the last ARCHIVE_KEEP_YEARS
+calendar years; `archive_closed_years` moves everything older into one SQLite
+file per year under ARCHIVE_DIR (`invoices_2021.db`, ...), each holding an
+`invoices` table with the same columns and its own date and vendor indexes.
+Rows are copied and deleted in one multi-file transaction, so an invoice is
+always in exactly one place; ingestion checks `archived_numbers` so that an
+archived invoice_number is not stored again in the hot table. The delete triggers keep the FTS index (which
+therefore covers hot years only) and the change feed in step; to feed
+consumers, archiving looks like deletion.
+
+Read paths call `attach_archives(conn)`, which ATTACHes the archive files and
+creates a TEMP view named `invoices` over `main.invoices UNION ALL` each
+archive. Temp objects shadow main ones for unqualified names, so existing SQL
+(the agent's, the metrics', reports') reads one logical table unchanged. With
+`since`/`until`, only the years overlapping that range are attached at all;
+otherwise a date predicate is pushed into every arm, where it costs one
+index probe on archives outside the range. Write paths must not attach: the
+view is not writable.
+
+The FTS index covers hot rows only. A second TEMP view, `archived_invoices`,
+holds just the attached archives (and no rows when there are none), so a
+text lookup can use the index on the hot table and LIKE on the rest.
+
+`compact_archive` rewrites one archive file in date order and swaps it in. It
+never touches invoices.db, so the app's writers are never blocked, and readers
+of the archive keep reading the old file until they reattach.
+
+    python archive.py list
+    python archive.py archive [--keep-years 2]
+    python archive.py compact [--year 2021]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from seed_invoices import INVOICE_DB_PATH
+
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_KEEP_YEARS = int(os.getenv("ARCHIVE_KEEP_YEARS", "2"))
+
+_ARCHIVE_FILE = re.compile(r"^invoices_(\d{4})\.db$")
+_CREATE_TABLE = re.compile(r"^CREATE TABLE\s+(?:\"invoices\"|invoices)", re.IGNORECASE)
+
+ARCHIVED_VIEW = "archived_invoices"
+
+_ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_date ON invoices (invoice_date);",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_vendor_date ON invoices (vendor_id, invoice_date);",
+    # The keyset order of listing.py.
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_listing ON invoices (IFNULL(invoice_date, ''), id);",
+)
+
+
+def archive_path(year: int, directory: str = ARCHIVE_DIR) -> str:
+    return os.path.join(directory, f"invoices_{year}.db")
+
+
+def archived_years(directory: str = ARCHIVE_DIR) -> List[int]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(m.group(1)) for m in map(_ARCHIVE_FILE.match, os.listdir(directory)) if m)
+
+
+def _schema(year: int) -> str:
+    return f"archive_{year}"
+
+
+def _attached(conn: sqlite3.Connection) -> Dict[str, str]:
+    return {row[1]: row[2] for row in conn.execute("PRAGMA database_list;")}
+
+
+def _columns(conn: sqlite3.Connection, schema: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA "{schema}".table_info(invoices);')]
+
+
+def _overlaps(year: int, since: Optional[str], until: Optional[str]) -> bool:
+    return (since is None or f"{year}-12-31" >= since[:10]) and (until is None or f"{year}-01-01" <= until[:10])
+
+
+def attach_archives(
+    conn: sqlite3.Connection,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    directory: str = ARCHIVE_DIR,
+    read_only: bool = False,
+) -> List[int]:
+    """
+    Make unqualified `invoices` on `conn` include the archived years that
+    overlap [since, until] (all of them by default), and `archived_invoices`
+    hold only those; returns those years.
+
+    Cheap to call again, e.g. on every pool checkout: nothing changes unless
+    the set of years does. `read_only` attaches with a `mode=ro` URI, for
+    connections opened with URI filenames enabled.
+    """
+    years = [y for y in archived_years(directory) if _overlaps(y, since, until)]
+    attached = _attached(conn)
+    wanted = {_schema(y) for y in years}
+    views = {
+        row[0] for row in conn.execute("SELECT name FROM temp.sqlite_master WHERE type = 'view';")
+    }
+    current = {s for s in attached if s.startswith("archive_")}
+    if current == wanted and ("invoices" in views) == bool(years) and ARCHIVED_VIEW in views:
+        return years
+
+    conn.execute("DROP VIEW IF EXISTS temp.invoices;")
+    conn.execute(f"DROP VIEW IF EXISTS temp.{ARCHIVED_VIEW};")
+    for schema in current - wanted:
+        conn.execute(f"DETACH DATABASE {schema};")
+    for year in years:
+        if _schema(year) not in attached:
+            path = os.path.abspath(archive_path(year, directory))
+            target = f"file:{path}?mode=ro" if read_only else path
+            conn.execute(f"ATTACH DATABASE ? AS {_schema(year)};", (target,))
+
+    columns = _columns(conn, "main")
+    hot = f"SELECT {', '.join(columns)} FROM main.invoices"
+    arms = []
+    for year in years:
+        present = set(_columns(conn, _schema(year)))
+        # Columns added to the hot table after a year was archived read as NULL.
+        select = ", ".join(c if c in present else f"NULL AS {c}" for c in columns)
+        arms.append(f"SELECT {select} FROM {_schema(year)}.invoices")
+    archived = " UNION ALL ".join(arms) if arms else f"{hot} WHERE 0"
+    conn.execute(f"CREATE TEMP VIEW {ARCHIVED_VIEW} AS {archived};")
+    if years:
+        conn.execute(f"CREATE TEMP VIEW invoices AS {' UNION ALL '.join([hot] + arms)};")
+    return years
+
+
+def archived_numbers(numbers: Iterable[Optional[str]], directory: str = ARCHIVE_DIR) -> Set[str]:
+    """
+    Those of `numbers` already stored in an archive file, which the hot
+    table's UNIQUE constraint cannot see.
+    """
+    wanted = json.dumps(sorted({n for n in numbers if n}))
+    found: Set[str] = set()
+    if wanted == "[]":
+        return found
+    for year in archived_years(directory):
+        path = os.path.abspath(archive_path(year, directory))
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            found.update(
+                number
+                for (number,) in conn.execute(
+                    "SELECT invoice_number FROM invoices WHERE invoice_number IN (SELECT value FROM json_each(?));",
+                    (wanted,),
+                )
+            )
+        finally:
+            conn.close()
+    return found
+
+
+def _ensure_archive_table(conn: sqlite3.Connection, schema: str) -> None:
+    (create_sql,) = conn.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'invoices';"
+    ).fetchone()
+    conn.execute(_CREATE_TABLE.sub(f"CREATE TABLE IF NOT EXISTS {schema}.invoices", create_sql, count=1))
+    present = set(_columns(conn, schema))
+    for row in conn.execute("PRAGMA main.table_info(invoices);").fetchall():
+        name, declared = row[1], row[2]
+        if name not in present:
+            conn.execute(f"ALTER TABLE {schema}.invoices ADD COLUMN {name} {declared};")
+    for statement in _ARCHIVE_INDEXES:
+        conn.execute(statement.format(schema=schema))
+
+
+def archive_year(conn: sqlite3.Connection, year: int, directory: str = ARCHIVE_DIR) -> int:
+    """
+    Move the hot table's invoices dated in `year` to that year's archive file
+    and return how many moved. `conn` must be a plain, writable connection to
+    invoices.db without archives attached.
+    """
+    os.makedirs(directory, exist_ok=True)
+    schema = _schema(year)
+    conn.commit()
+    conn.execute(f"ATTACH DATABASE ? AS {schema};", (archive_path(year, directory),))
+    try:
+        _ensure_archive_table(conn, schema)
+        conn.commit()
+        columns = ", ".join(_columns(conn, "main"))
+        bounds = (f"{year}-01-01", f"{year + 1}-01-01")
+        # One transaction over both files: the copy and the delete commit
+        # together or not at all.
+        conn.execute(
+            f"""
+            INSERT INTO {schema}.invoices ({columns})
+            SELECT {columns} FROM main.invoices
+            WHERE invoice_date >= ? AND invoice_date < ?
+            ORDER BY invoice_date, id;
+            """,
+            bounds,
+        )
+        moved = conn.execute(
+            "DELETE FROM main.invoices WHERE invoice_date >= ? AND invoice_date < ?;", bounds
+        ).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"DETACH DATABASE {schema};")
+    return moved
+
+
+def archive_closed_years(
+    conn: sqlite3.Connection,
+    keep_years: int = ARCHIVE_KEEP_YEARS,
+    today: Optional[date] = None,
+    directory: str = ARCHIVE_DIR,
+) -> Dict[int, int]:
+    """Archive every year before the last `keep_years`; returns moved rows per year."""
+    cutoff = f"{(today or date.today()).year - keep_years + 1}-01-01"
+    years = [
+        int(row[0])
+        for row in conn.execute(
+            """
+            SELECT DISTINCT substr(invoice_date, 1, 4) FROM invoices
+            WHERE invoice_date < ? AND invoice_date GLOB '[0-9][0-9][0-9][0-9]-*';
+            """,
+            (cutoff,),
+        )
+    ]
+    return {year: archive_year(conn, year, directory) for year in years}
+
+
+def compact_archive(year: int, directory: str = ARCHIVE_DIR) -> Tuple[int, int]:
+    """
+    Rewrite one archive file in (invoice_date, id) order without free pages
+    and swap it in; returns (bytes before, bytes after).
+
+    The source is read under a RESERVED lock: readers carry on, and only a
+    concurrent `archive_year` for the same year waits until the swap is done,
+    so no late row can land in the old file after it was copied.
+    """
+    path = archive_path(year, directory)
+    tmp_path = f"{path}.compact"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    before = os.path.getsize(path)
+
+    source = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    try:
+        source.execute("BEGIN IMMEDIATE;")
+        target = sqlite3.connect(tmp_path)
+        try:
+            objects = source.execute(
+                "SELECT type, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%';"
+            ).fetchall()
+            for kind, sql in objects:
+                if kind == "table":
+                    target.execute(sql)
+            columns = _columns(source, "main")
+            placeholders = ", ".join("?" * len(columns))
+            rows = source.execute(
+                f"SELECT {', '.join(columns)} FROM invoices ORDER BY invoice_date, id;"
+            )
+            while True:
+                batch = rows.fetchmany(5000)
+                if not batch:
+                    break
+                target.executemany(
+                    f"INSERT INTO invoices ({', '.join(columns)}) VALUES ({placeholders});", batch
+                )
+            for kind, sql in objects:
+                if kind != "table":
+                    target.execute(sql)
+            # Archives written before an index was added get it here.
+            for statement in _ARCHIVE_INDEXES:
+                target.execute(statement.format(schema="main"))
+            target.execute("ANALYZE;")
+            target.commit()
+        finally:
+            target.close()
+        os.replace(tmp_path, path)
+        source.execute("ROLLBACK;")
+    finally:
+        source.close()
+    return before, os.path.getsize(path)
+
+
+def archive_summary(directory: str = ARCHIVE_DIR) -> List[Dict[str, object]]:
+    summary = []
+    for year in archived_years(directory):
+        path = archive_path(year, directory)
+        conn = sqlite3.connect(path)
+        try:
+            (count,) = conn.execute("SELECT COUNT(*) FROM invoices;").fetchone()
+        finally:
+            conn.close()
+        summary.append({"year": year, "invoices": count, "bytes": os.path.getsize(path)})
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Year-partitioned invoice archives")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Show archived years, row counts and file sizes.")
+    archive = sub.add_parser("archive", help="Move closed years out of the hot table.")
+    archive.add_argument("--keep-years", type=int, default=ARCHIVE_KEEP_YEARS)
+    compact = sub.add_parser("compact", help="Rewrite archive files without free pages.")
+    compact.add_argument("--year", type=int, help="Only this year (default: all).")
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        conn = sqlite3.connect(INVOICE_DB_PATH)
+        try:
+            moved = archive_closed_years(conn, args.keep_years)
+        finally:
+            conn.close()
+        print(json.dumps({"moved": moved}, indent=2))
+    elif args.command == "compact":
+        years = [args.year] if args.year else archived_years()
+        for year in years:
+            before, after = compact_archive(year)
+            print(f"{year}: {before} -> {after} bytes")
+    else:
+        print(json.dumps(archive_summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
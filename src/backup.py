@@ -0,0 +1,392 @@
+"""
+Online backups of invoices.db with SQLite's backup API.
+
+`backup_database` copies the live database page by page, BACKUP_PAGES_PER_STEP
+pages at a time. In the default rollback-journal mode each step holds a shared
+lock only while it runs, and the copy sleeps BACKUP_STEP_SLEEP between steps,
+so uploads can commit and dashboard reads run while a backup is in progress.
+A commit from another connection makes SQLite restart the copy from the first
+page (the result is always a consistent snapshot), so a copy only completes
+stepwise during a write-free stretch as long as the copy itself; after
+BACKUP_MAX_RESTARTS restarts it is finished in one step, which holds the read
+lock (and makes writers wait) for the length of one copy. A database in WAL
+mode is always copied in one step: its readers never block writers, so that
+copy is both consistent and non-blocking.
+
+The copy goes to a `.partial` file, is checked with `PRAGMA quick_check`, and
+only then renamed into place.
+
+Backups are named `invoices-<UTC timestamp>.db` under BACKUP_DIR.
+`prune_backups` keeps the newest BACKUP_KEEP_LAST, plus the newest of each
+day for the last BACKUP_KEEP_DAILY days. `BackupScheduler` runs backup +
+prune every BACKUP_INTERVAL_SECONDS on a background thread (web_app starts
+one from its lifespan when the interval is set, so after any fork; with
+several workers, one of them takes each backup). `restore_backup` writes a backup back over the
+live database, again through the backup API, so open connections see either
+the old or the restored database and never a torn file; it first takes a
+backup of the current state.
+
+Archive files (archive.py) are not included; they are only written by
+`archive.py` and can be copied as plain files. A restore therefore keeps the
+current archives, and drops from the restored hot table the rows an archive
+file already holds (see `restore_backup`).
+
+    python backup.py backup
+    python backup.py list
+    python backup.py prune
+    python backup.py schedule --every 3600
+    python backup.py restore backups/invoices-20240101T000000Z.db
+
+See `python benchmarks.py backup` for throughput and the latency seen by
+concurrent readers and writers.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from archive import ARCHIVE_DIR, archive_path, archived_years
+from coordination import SHARED_CACHE_PATH, SharedCache, file_lock
+from seed_invoices import INVOICE_DB_PATH
+
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+BACKUP_KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", "7"))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "30"))
+# 0 disables the scheduler.
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", "0"))
+
+_TIMESTAMP = "%Y%m%dT%H%M%SZ"
+_BACKUP_FILE = re.compile(r"^invoices-(\d{8}T\d{6}Z)\.db$")
+
+
+@dataclass
+class BackupResult:
+    path: str
+    bytes: int
+    pages: int
+    steps: int
+    restarts: int
+    seconds: float
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 2**20 / self.seconds if self.seconds else 0.0
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _backup_name(at: datetime) -> str:
+    return f"invoices-{at.strftime(_TIMESTAMP)}.db"
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[str]:
+    """Backup paths, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if _BACKUP_FILE.match(name))
+    return [os.path.join(directory, name) for name in names]
+
+
+def _backup_time(path: str) -> datetime:
+    stamp = _BACKUP_FILE.match(os.path.basename(path)).group(1)
+    return datetime.strptime(stamp, _TIMESTAMP).replace(tzinfo=timezone.utc)
+
+
+def _check(path: str) -> None:
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        (result,) = conn.execute("PRAGMA quick_check;").fetchone()
+    finally:
+        conn.close()
+    if result != "ok":
+        raise RuntimeError(f"{path} failed quick_check: {result}")
+
+
+def _copy(
+    source: sqlite3.Connection,
+    target: sqlite3.Connection,
+    pages_per_step: int,
+    step_sleep: float,
+    max_restarts: int,
+) -> BackupResult:
+    state = {"steps": 0, "restarts": 0, "remaining": None, "pages": 0}
+
+    def progress(_status: int, remaining: int, total: int) -> None:
+        state["steps"] += 1
+        state["pages"] = total
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+        state["remaining"] = remaining
+        if remaining and step_sleep:
+            # The source lock is not held between steps; let writers in.
+            time.sleep(step_sleep)
+
+    started = time.perf_counter()
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress)
+    except _TooManyRestarts:
+        source.backup(target)
+        state["steps"] += 1
+    return BackupResult(
+        path="",
+        bytes=0,
+        pages=state["pages"],
+        steps=state["steps"],
+        restarts=state["restarts"],
+        seconds=time.perf_counter() - started,
+    )
+
+
+def backup_database(
+    db_path: str = INVOICE_DB_PATH,
+    directory: str = BACKUP_DIR,
+    pages_per_step: int = BACKUP_PAGES_PER_STEP,
+    step_sleep: float = BACKUP_STEP_SLEEP,
+    max_restarts: int = BACKUP_MAX_RESTARTS,
+) -> BackupResult:
+    """Write a consistent, checked copy of `db_path` into `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    at = datetime.now(timezone.utc)
+    path = os.path.join(directory, _backup_name(at))
+    while os.path.exists(path):
+        at += timedelta(seconds=1)
+        path = os.path.join(directory, _backup_name(at))
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30.0)
+    target = sqlite3.connect(partial)
+    try:
+        (journal_mode,) = source.execute("PRAGMA journal_mode;").fetchone()
+        if journal_mode.lower() == "wal":
+            pages_per_step = -1
+        result = _copy(source, target, pages_per_step, step_sleep, max_restarts)
+    finally:
+        target.close()
+        source.close()
+    _check(partial)
+    os.replace(partial, path)
+    result.path = path
+    result.bytes = os.path.getsize(path)
+    return result
+
+
+def prune_backups(
+    directory: str = BACKUP_DIR,
+    keep_last: int = BACKUP_KEEP_LAST,
+    keep_daily: int = BACKUP_KEEP_DAILY,
+    now: Optional[datetime] = None,
+) -> List[str]:
+    """Delete backups outside the retention policy; returns the removed paths."""
+    backups = list_backups(directory)
+    keep = set(backups[-keep_last:]) if keep_last > 0 else set()
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=keep_daily)
+    newest_per_day = {}
+    for path in backups:
+        at = _backup_time(path)
+        if at >= cutoff:
+            newest_per_day[at.date()] = path
+    keep.update(newest_per_day.values())
+    removed = [path for path in backups if path not in keep]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _drop_archived_rows(conn: sqlite3.Connection, archive_directory: str) -> int:
+    """
+    Delete hot rows that an archive file also holds, and move the invoice id
+    sequence past every archived id; returns how many rows were deleted.
+    """
+    removed = 0
+    for year in archived_years(archive_directory):
+        conn.execute("ATTACH DATABASE ? AS restored_archive;", (os.path.abspath(archive_path(year, archive_directory)),))
+        try:
+            # rowcount, unlike total_changes, leaves out the FTS and change-feed
+            # trigger writes.
+            removed += conn.execute(
+                "DELETE FROM main.invoices WHERE id IN (SELECT id FROM restored_archive.invoices);"
+            ).rowcount
+            conn.execute(
+                """
+                UPDATE main.sqlite_sequence
+                SET seq = MAX(seq, (SELECT IFNULL(MAX(id), 0) FROM restored_archive.invoices))
+                WHERE name = 'invoices';
+                """
+            )
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE restored_archive;")
+    return removed
+
+
+def restore_backup(
+    backup_path: str,
+    db_path: str = INVOICE_DB_PATH,
+    directory: str = BACKUP_DIR,
+    keep_current: bool = True,
+    archive_directory: str = ARCHIVE_DIR,
+) -> Optional[BackupResult]:
+    """
+    Replace the contents of `db_path` with `backup_path`; returns the backup
+    of the replaced state when `keep_current`.
+
+    Archives are left as they are. A backup taken before a year was archived
+    still has that year's rows in its hot table, and the `invoices` view
+    would count them twice, so the backup is first copied to a staging file
+    where the rows an archive file holds are deleted (matched by id) and the
+    id sequence is moved past the archived ids; the staged copy is what
+    replaces the live database.
+
+    The vector index notices that its change-feed position no longer matches
+    and rebuilds on its next open; the shared cache is cleared.
+    """
+    _check(backup_path)
+    saved = backup_database(db_path, directory) if keep_current and os.path.exists(db_path) else None
+    os.makedirs(directory, exist_ok=True)
+    staged_path = os.path.join(directory, ".restore.partial")
+    if os.path.exists(staged_path):
+        os.remove(staged_path)
+    source = sqlite3.connect(f"file:{os.path.abspath(backup_path)}?mode=ro", uri=True)
+    staged = sqlite3.connect(staged_path)
+    try:
+        source.backup(staged)
+        _drop_archived_rows(staged, archive_directory)
+        target = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            # One step: the live file changes in a single write transaction.
+            staged.backup(target)
+        finally:
+            target.close()
+    finally:
+        staged.close()
+        source.close()
+        os.remove(staged_path)
+    # Cached results may have been computed from data newer than the backup,
+    # at data versions the restored change feed will reach again.
+    if os.path.exists(SHARED_CACHE_PATH):
+        SharedCache().clear()
+    return saved
+
+
+class BackupScheduler:
+    """Backup + prune every `interval` seconds on a daemon thread."""
+
+    def __init__(
+        self,
+        interval: float = BACKUP_INTERVAL_SECONDS,
+        db_path: str = INVOICE_DB_PATH,
+        directory: str = BACKUP_DIR,
+    ) -> None:
+        self.interval = interval
+        self.db_path = db_path
+        self.directory = directory
+        self.last_result: Optional[BackupResult] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> None:
+        """
+        Back up unless another worker process is doing so or did within the
+        last half interval; every worker can run a scheduler.
+        """
+        try:
+            with file_lock(os.path.join(self.directory, ".lock"), blocking=False) as held:
+                if not held:
+                    return
+                backups = list_backups(self.directory)
+                if backups and time.time() - os.path.getmtime(backups[-1]) < self.interval / 2:
+                    return
+                self.last_result = backup_database(self.db_path, self.directory)
+                prune_backups(self.directory)
+            self.last_error = None
+        except Exception as exc:
+            self.last_error = str(exc)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> "BackupScheduler":
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="invoice-backup", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _print_result(result: BackupResult) -> None:
+    print(
+        f"{result.path}: {result.bytes / 2**20:.1f} MiB, {result.pages} pages in "
+        f"{result.steps} steps ({result.restarts} restarts), {result.seconds:.2f}s, "
+        f"{result.mb_per_second:.1f} MiB/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Online backups of the invoice database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backup", help="Take one backup now, then prune.")
+    sub.add_parser("list", help="Show existing backups.")
+    sub.add_parser("prune", help="Apply the retention policy.")
+    schedule = sub.add_parser("schedule", help="Take backups periodically until interrupted.")
+    schedule.add_argument("--every", type=float, default=BACKUP_INTERVAL_SECONDS or 3600)
+    restore = sub.add_parser("restore", help="Restore a backup over the live database.")
+    restore.add_argument("path")
+    restore.add_argument(
+        "--no-safety-copy", action="store_true", help="Do not back up the current state first."
+    )
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        _print_result(backup_database())
+        for path in prune_backups():
+            print(f"pruned {path}")
+    elif args.command == "list":
+        for path in list_backups():
+            print(f"{path}\t{os.path.getsize(path)}")
+    elif args.command == "prune":
+        for path in prune_backups():
+            print(f"pruned {path}")
+    elif args.command == "schedule":
+        scheduler = BackupScheduler(args.every)
+        try:
+            while True:
+                scheduler.run_once()
+                if scheduler.last_error:
+                    print(f"backup failed: {scheduler.last_error}")
+                else:
+                    _print_result(scheduler.last_result)
+                time.sleep(args.every)
+        except KeyboardInterrupt:
+            pass
+    else:
+        saved = restore_backup(args.path, keep_current=not args.no_safety_copy)
+        if saved is not None:
+            print(f"previous state saved to {saved.path}")
+        print(f"restored {args.path} into {INVOICE_DB_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Bulk, resumable OCR import of archived invoices through a batch endpoint.
+
+Instead of one synchronous vision call per file, every file in a directory is
+written as a request line of a JSONL batch, submitted through a `BatchClient`
+and polled until the batch finishes. Parsed results are ingested with the bulk
+insert path. Progress is checkpointed per file, so an interrupted run picks up
+where it stopped: ingested files are skipped and in-flight batches are polled
+rather than resubmitted. Fields that fail to parse are re-asked in a follow-up
+batch that only requests those fields.
+
+Usage:
+
+    python batch_import.py /path/to/archive            # OpenAI Batch API
+    python batch_import.py /path/to/archive --local    # synchronous stand-in
+"""
+
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol, Tuple
+
+import requests
+
+from ocr import (
+    OPENAI_API_KEY,
+    OPENAI_URL,
+    SkippedInvoice,
+    build_extraction_payload,
+    encode_invoice_file,
+    ingest_invoices,
+    is_duplicate_page,
+    load_page_hashes,
+    record_page_hashes,
+    screen_and_encode,
+)
+from ocr_parser import (
+    FIELDS_BY_NAME,
+    INVOICE_FIELDS,
+    InvoiceExtraction,
+    InvoiceField,
+    parse_invoice_json,
+)
+from seed_invoices import ensure_invoice_db
+
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+CHECKPOINT_FILENAME = ".batch_import_checkpoint.json"
+# The Batch API rejects input files over 200 MB; a page image is a few MB of
+# base64, so a batch of `batch_size` files is split into several inputs.
+BATCH_MAX_INPUT_BYTES = int(os.getenv("BATCH_MAX_INPUT_BYTES", str(190 * 10**6)))
+SUPPORTED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg")
+
+_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchClient(Protocol):
+    """The subset of a batch API the importer relies on."""
+
+    def submit(self, jsonl_path: str) -> str:
+        """Submit a JSONL file of requests and return the batch id."""
+
+    def status(self, batch_id: str) -> str:
+        """Return the batch status (`completed`, `failed`, `in_progress`, ...)."""
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield one output record per request of a completed batch."""
+
+
+class OpenAIBatchClient:
+    """`BatchClient` backed by the OpenAI Files and Batches APIs."""
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY) -> None:
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+
+    def submit(self, jsonl_path: str) -> str:
+        with open(jsonl_path, "rb") as fh:
+            upload = requests.post(
+                f"{OPENAI_API_BASE}/files",
+                headers=self._headers,
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(jsonl_path), fh)},
+                timeout=600,
+            )
+        upload.raise_for_status()
+        batch = requests.post(
+            f"{OPENAI_API_BASE}/batches",
+            headers=self._headers,
+            json={
+                "input_file_id": upload.json()["id"],
+                "endpoint": CHAT_COMPLETIONS_ENDPOINT,
+                "completion_window": "24h",
+            },
+            timeout=60,
+        )
+        batch.raise_for_status()
+        return batch.json()["id"]
+
+    def _batch(self, batch_id: str) -> Dict[str, Any]:
+        response = requests.get(
+            f"{OPENAI_API_BASE}/batches/{batch_id}", headers=self._headers, timeout=60
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def status(self, batch_id: str) -> str:
+        return self._batch(batch_id)["status"]
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        batch = self._batch(batch_id)
+        for key in ("output_file_id", "error_file_id"):
+            file_id = batch.get(key)
+            if not file_id:
+                continue
+            response = requests.get(
+                f"{OPENAI_API_BASE}/files/{file_id}/content",
+                headers=self._headers,
+                timeout=600,
+                stream=True,
+            )
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+
+def _post_chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    response = requests.post(
+        OPENAI_URL,
+        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+        json=body,
+        timeout=90,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+class LocalBatchClient:
+    """
+    In-process stand-in for the batch endpoint.
+
+    Each request line is answered by `responder` (a synchronous chat
+    completion by default) and written to an output JSONL in the same record
+    format the Batch API produces. Pass a fake responder to exercise the
+    importer without network access.
+    """
+
+    def __init__(
+        self,
+        workdir: str,
+        responder: Callable[[Dict[str, Any]], Dict[str, Any]] = _post_chat_completion,
+    ) -> None:
+        self._workdir = workdir
+        self._responder = responder
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self._workdir, f"{batch_id}.output.jsonl")
+
+    def submit(self, jsonl_path: str) -> str:
+        batch_id = "local-" + os.path.splitext(os.path.basename(jsonl_path))[0]
+        with open(jsonl_path, encoding="utf-8") as src, open(
+            self._output_path(batch_id), "w", encoding="utf-8"
+        ) as out:
+            for line in src:
+                request = json.loads(line)
+                record: Dict[str, Any] = {"custom_id": request["custom_id"]}
+                try:
+                    body = self._responder(request["body"])
+                    record["response"] = {"status_code": 200, "body": body}
+                except Exception as exc:
+                    record["error"] = {"message": str(exc)}
+                out.write(json.dumps(record) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return "completed" if os.path.exists(self._output_path(batch_id)) else "failed"
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        with open(self._output_path(batch_id), encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _load_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_checkpoint(path: str, state: Dict[str, Dict[str, Any]]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _discover(directory: str) -> List[str]:
+    found = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(found)
+
+
+def _requested_fields(entry: Dict[str, Any]) -> List[InvoiceField]:
+    """All fields on the first attempt; only the failed ones afterwards."""
+    if entry.get("fields") and entry.get("failed"):
+        return [FIELDS_BY_NAME[name] for name in entry["failed"]]
+    return INVOICE_FIELDS
+
+
+def _write_requests(
+    directory: str,
+    work_dir: str,
+    names: List[str],
+    state,
+    tag: str,
+    known_hashes: Dict[int, Optional[str]],
+    max_bytes: int = BATCH_MAX_INPUT_BYTES,
+) -> List[Tuple[str, List[str]]]:
+    """
+    Stream one request line per file to JSONL batch input files of at most
+    `max_bytes` each; returns each file's path and the names queued in it.
+
+    Files are screened on their first attempt; blank pages and photos are
+    marked `skipped` and never reach the batch. A page that looks like a
+    stored one keeps that invoice's number as `duplicate_of` for `_ingest`.
+    """
+    inputs: List[Tuple[str, List[str]]] = []
+    out = None
+    size = 0
+    try:
+        for name in names:
+            entry = state[name]
+            fields = _requested_fields(entry)
+            entry["requested"] = [f.name for f in fields]
+            path = os.path.join(directory, name)
+            try:
+                if "phash" in entry:
+                    base64_image = encode_invoice_file(path)
+                else:
+                    base64_image, entry["phash"], entry["duplicate_of"] = screen_and_encode(
+                        path, name, known_hashes
+                    )
+            except SkippedInvoice as skipped:
+                entry.update(status="skipped", reason=skipped.reason)
+                continue
+            except Exception as exc:
+                entry.update(status="error", error=f"could not read file: {exc}")
+                continue
+            request = {
+                "custom_id": name,
+                "method": "POST",
+                "url": CHAT_COMPLETIONS_ENDPOINT,
+                "body": build_extraction_payload(base64_image, fields),
+            }
+            line = (json.dumps(request) + "\n").encode("utf-8")
+            if out is None or (inputs[-1][1] and size + len(line) > max_bytes):
+                if out is not None:
+                    out.close()
+                jsonl_path = os.path.join(work_dir, f"batch-{tag}-{len(inputs)}.jsonl")
+                out = open(jsonl_path, "wb")
+                inputs.append((jsonl_path, []))
+                size = 0
+            out.write(line)
+            size += len(line)
+            inputs[-1][1].append(name)
+    finally:
+        if out is not None:
+            out.close()
+    return inputs
+
+
+def _apply_result(entry: Dict[str, Any], record: Dict[str, Any], max_attempts: int) -> None:
+    entry["attempts"] = entry.get("attempts", 0) + 1
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        message = (record.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+        retry = entry["attempts"] < max_attempts
+        entry.update(status="pending" if retry else "error", error=message)
+        return
+
+    content = response["body"]["choices"][0]["message"]["content"]
+    fields = [FIELDS_BY_NAME[name] for name in entry.get("requested") or FIELDS_BY_NAME]
+    extraction = parse_invoice_json(content, fields)
+    if entry.get("fields"):
+        previous = InvoiceExtraction(
+            fields=entry["fields"],
+            confidence=entry["confidence"],
+            missing=entry["missing"],
+            failed=entry["failed"],
+        )
+        previous.merge(extraction)
+        extraction = previous
+    entry.update(asdict(extraction))
+    entry.pop("error", None)
+    if extraction.failed and entry["attempts"] < max_attempts:
+        entry["status"] = "pending"
+    else:
+        entry["status"] = "extracted"
+
+
+def _collect(client: BatchClient, batch_id: str, state, poll_interval: float, max_attempts: int) -> None:
+    status = client.status(batch_id)
+    while status not in _TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        status = client.status(batch_id)
+
+    members = {
+        name
+        for name, entry in state.items()
+        if entry.get("batch_id") == batch_id and entry["status"] == "submitted"
+    }
+    if status == "completed":
+        for record in client.results(batch_id):
+            name = record.get("custom_id")
+            if name in members:
+                _apply_result(state[name], record, max_attempts)
+                members.discard(name)
+    # Anything the batch did not answer goes back into the queue.
+    for name in members:
+        entry = state[name]
+        entry["attempts"] = entry.get("attempts", 0) + 1
+        retry = entry["attempts"] < max_attempts
+        entry.update(status="pending" if retry else "error", error=f"batch {status}")
+
+
+def _ingest(state: Dict[str, Dict[str, Any]], known_hashes: Dict[int, Optional[str]]) -> int:
+    ready = [name for name, entry in state.items() if entry["status"] == "extracted"]
+    rows = []
+    names = []
+    for name in ready:
+        entry = state[name]
+        if not entry["fields"].get("invoice_number"):
+            entry.update(status="error", error="no invoice_number extracted")
+            continue
+        if is_duplicate_page(entry.get("duplicate_of"), entry["fields"]):
+            entry.update(status="skipped", reason=f"duplicate of stored invoice {entry['duplicate_of']}")
+            continue
+        rows.append(entry["fields"])
+        names.append(name)
+        entry["status"] = "ingested"
+    if not rows:
+        return 0
+    result = ingest_invoices(rows, ignore_duplicates=True)
+    reasons = dict(result.quarantined)
+    ignored = set(result.ignored)
+    hashes = []
+    for position, (name, fields) in enumerate(zip(names, rows)):
+        entry = state[name]
+        if fields["invoice_number"] in reasons:
+            entry.update(status="quarantined", reasons=reasons[fields["invoice_number"]])
+        elif position in ignored:
+            entry.update(status="skipped", reason=f"invoice {fields['invoice_number']} already stored")
+        elif entry.get("phash") is not None:
+            hashes.append((entry["phash"], fields["invoice_number"], name))
+            known_hashes[entry["phash"]] = fields["invoice_number"]
+    record_page_hashes(hashes)
+    return result.written
+
+
+def run_batch_import(
+    directory: str,
+    client: BatchClient,
+    checkpoint_path: Optional[str] = None,
+    batch_size: int = 500,
+    poll_interval: float = 30.0,
+    max_attempts: int = 2,
+    max_input_bytes: int = BATCH_MAX_INPUT_BYTES,
+) -> Dict[str, int]:
+    """
+    Import every invoice file under `directory` through `client`.
+
+    Safe to re-run: the checkpoint records each file's status (`pending`,
+    `submitted`, `extracted`, `ingested`, `quarantined` or `error`) and the
+    batch it belongs to. Returns a count of files per final status (`skipped`
+    files were rejected by pre-OCR screening or duplicate a stored invoice,
+    and carry a `reason`; `quarantined` ones failed ingestion validation and
+    carry `reasons`).
+    """
+    checkpoint_path = checkpoint_path or os.path.join(directory, CHECKPOINT_FILENAME)
+    work_dir = os.path.dirname(os.path.abspath(checkpoint_path))
+    state = _load_checkpoint(checkpoint_path)
+    for name in _discover(directory):
+        state.setdefault(name, {"status": "pending", "attempts": 0})
+    _save_checkpoint(checkpoint_path, state)
+    known_hashes = load_page_hashes()
+
+    while True:
+        in_flight = sorted(
+            {e["batch_id"] for e in state.values() if e["status"] == "submitted"}
+        )
+        for batch_id in in_flight:
+            _collect(client, batch_id, state, poll_interval, max_attempts)
+            _ingest(state, known_hashes)
+            _save_checkpoint(checkpoint_path, state)
+
+        pending = [name for name, entry in state.items() if entry["status"] == "pending"]
+        if not pending:
+            break
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start : start + batch_size]
+            # Unique per round: a re-ask round can start within the same second.
+            tag = f"{time.time_ns()}-{start // batch_size}"
+            for jsonl_path, queued in _write_requests(
+                directory, work_dir, chunk, state, tag, known_hashes, max_input_bytes
+            ):
+                batch_id = client.submit(jsonl_path)
+                for name in queued:
+                    state[name].update(status="submitted", batch_id=batch_id)
+                _save_checkpoint(checkpoint_path, state)
+            _save_checkpoint(checkpoint_path, state)
+
+    counts: Dict[str, int] = {}
+    for entry in state.values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="Directory of invoice PDFs/images to import.")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: inside the directory).")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--max-attempts", type=int, default=2)
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Answer requests synchronously in-process instead of using the Batch API.",
+    )
+    args = parser.parse_args()
+
+    ensure_invoice_db()
+    checkpoint = args.checkpoint or os.path.join(args.directory, CHECKPOINT_FILENAME)
+    if args.local:
+        client: BatchClient = LocalBatchClient(os.path.dirname(os.path.abspath(checkpoint)))
+    else:
+        client = OpenAIBatchClient()
+    counts = run_batch_import(
+        args.directory,
+        client,
+        checkpoint_path=checkpoint,
+        batch_size=args.batch_size,
+        poll_interval=args.poll_interval,
+        max_attempts=args.max_attempts,
+    )
+    print(", ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    main()
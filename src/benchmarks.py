@@ -0,0 +1,477 @@
+"""
+Ad-hoc performance benchmarks for FiscalFlow.
+
+Each benchmark is a subcommand and prints a small comparison table:
+
+    python benchmarks.py upload-memory --size-mb 200
+    python benchmarks.py fts-search --rows 1000000
+    python benchmarks.py reporting --rows 1000000
+    python benchmarks.py result-shaping --rows 10000
+    python benchmarks.py validation --rows 1000000 --batch 5000
+    python benchmarks.py backup --rows 1000000
+"""
+
+import argparse
+import base64
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+def _measure(fn: Callable[[], object]) -> Tuple[float, int]:
+    """Run `fn` and return (seconds, peak traced Python allocation in bytes)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def _print_rows(title: str, rows: List[Tuple[str, float, int]]) -> None:
+    print(title)
+    print(f"  {'variant':<28}{'seconds':>10}{'peak MiB':>12}")
+    for name, seconds, peak in rows:
+        print(f"  {name:<28}{seconds:>10.3f}{peak / 2**20:>12.1f}")
+
+
+def bench_upload_memory(size_mb: int) -> None:
+    """
+    Peak memory of encoding an uploaded image: whole-bytes vs spooled path,
+    and of the vision request body that is finally sent.
+    """
+    import json
+
+    from ocr import build_extraction_payload, encode_invoice_file
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "scan.png")
+        with open(path, "wb") as fh:
+            for _ in range(size_mb):
+                fh.write(os.urandom(2**20))
+
+        def whole_bytes() -> str:
+            # The pre-spooling upload path: read everything, then encode.
+            with open(path, "rb") as fh:
+                content = fh.read()
+            return base64.b64encode(content).decode("utf-8")
+
+        rows = []
+        for name, fn in (
+            ("read + b64encode", whole_bytes),
+            ("spooled chunked encode", lambda: encode_invoice_file(path)),
+            (
+                "encode + request body",
+                lambda: json.dumps(build_extraction_payload(encode_invoice_file(path))).encode("utf-8"),
+            ),
+        ):
+            seconds, peak = _measure(fn)
+            rows.append((name, seconds, peak))
+        _print_rows(f"upload-memory ({size_mb} MiB image)", rows)
+
+
+_SELLERS = [
+    "Amazon.com, Seattle, WA, USA",
+    "Uber Eats",
+    "Zomato, Bengaluru, KA, India",
+    "Office Depot",
+    "ACME Corp Consulting",
+    "Google Cloud Platform",
+    "Joe's Coffee, Philadelphia, PA, USA",
+    "DHL Express",
+]
+_PRODUCTS = [
+    "Laptop", "USB-C Dock", "Wireless Mouse", "Pizza", "Soda", "Burger Meal",
+    "Biryani", "Office Chair", "Standing Desk", "Consulting", "AWS EC2",
+    "Latte", "Espresso", "International shipping", "Mechanical Keyboard",
+]
+
+
+def _synthetic_invoices(rows: int, seed: int = 7) -> Iterator[Tuple]:
+    """Invoice rows (a subset of columns) with realistic text for benchmarks."""
+    rng = random.Random(seed)
+    for i in range(rows):
+        year = 2015 + i % 10
+        products = ",".join(rng.sample(_PRODUCTS, rng.randint(1, 4)))
+        total = round(rng.uniform(5, 3000), 2)
+        yield (
+            f"BENCH-{i:08d}",
+            f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            rng.choice(_SELLERS),
+            products,
+            total,
+            rng.choice(("USD", "USD", "USD", "INR", "EUR")),
+            "Synthetic benchmark invoice.",
+            "123 Personal St, Philadelphia, PA, USA",
+            "123 Personal St, Philadelphia, PA, USA",
+        )
+
+
+def _bench_db(path: str, rows: int) -> sqlite3.Connection:
+    """A migrated invoices DB at `path` filled with `rows` synthetic invoices."""
+    from fx import recompute_base_totals
+    from seed_invoices import ensure_invoice_db
+    from vendors import assign_missing_vendor_ids
+
+    ensure_invoice_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        """
+        INSERT INTO invoices (
+            invoice_number, invoice_date, seller_information, products_services,
+            grand_total, currency, invoice_notes, shipping_address, billing_address
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        _synthetic_invoices(rows),
+    )
+    assign_missing_vendor_ids(conn)
+    recompute_base_totals(conn)
+    conn.commit()
+    return conn
+
+
+def _timed_query(conn: sqlite3.Connection, sql: str, params: Tuple = (), repeat: int = 3) -> float:
+    """Best-of-`repeat` wall time for fully fetching `sql`."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_fts_search(rows: int) -> None:
+    """
+    Text lookup latency, LIKE scan vs the invoices_fts MATCH index, for the
+    query shapes the index replaced: every match (the agent's lookups and
+    /api/search), a SUM over the matches (the spend_on template), and the
+    dashboard's newest-food-invoice metric.
+    """
+    from search import fts_query
+
+    fts_join = "invoices_fts JOIN invoices ON invoices.id = invoices_fts.rowid"
+    shapes = {
+        "all matches": (
+            """
+            SELECT invoice_date, seller_information FROM invoices
+            WHERE products_services LIKE ? OR seller_information LIKE ?;
+            """,
+            f"SELECT invoices.invoice_date, invoices.seller_information FROM {fts_join} WHERE invoices_fts MATCH ?;",
+        ),
+        "sum": (
+            """
+            SELECT COUNT(*), SUM(grand_total_base) FROM invoices
+            WHERE products_services LIKE ? OR seller_information LIKE ?;
+            """,
+            f"SELECT COUNT(*), SUM(invoices.grand_total_base) FROM {fts_join} WHERE invoices_fts MATCH ?;",
+        ),
+    }
+    food_like = """
+        SELECT invoice_date, seller_information FROM invoices
+        WHERE products_services LIKE '%pizza%' OR products_services LIKE '%burger%'
+           OR products_services LIKE '%biryani%' OR products_services LIKE '%food%'
+        ORDER BY invoice_date DESC LIMIT 1;
+    """
+    food_terms = "products_services: (pizza OR burger OR biryani OR food)"
+    food_match = f"""
+        SELECT invoices.invoice_date, invoices.seller_information FROM {fts_join}
+        WHERE invoices_fts MATCH ?
+        ORDER BY invoices.invoice_date DESC LIMIT 1;
+    """
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        started = time.perf_counter()
+        conn = _bench_db(os.path.join(tmp_dir, "bench.db"), rows)
+        print(f"fts-search ({rows} invoices, built in {time.perf_counter() - started:.1f}s)")
+        print(f"  {'query':<14}{'term':<14}{'matches':>9}{'LIKE ms':>10}{'MATCH ms':>10}{'speedup':>10}")
+
+        def report(shape: str, term: str, matches: int, like: float, match: float) -> None:
+            print(
+                f"  {shape:<14}{term:<14}{matches:>9}{like * 1000:>10.2f}{match * 1000:>10.2f}"
+                f"{like / match:>9.1f}x"
+            )
+
+        for shape, (like_sql, match_sql) in shapes.items():
+            for term in ("pizza", "espresso", "philadelphia"):
+                pattern = f"%{term}%"
+                query = f"{{products_services seller_information}}: {fts_query(term)}"
+                (matches,) = conn.execute(
+                    "SELECT COUNT(*) FROM invoices_fts WHERE invoices_fts MATCH ?;", (query,)
+                ).fetchone()
+                like = _timed_query(conn, like_sql, (pattern, pattern))
+                match = _timed_query(conn, match_sql, (query,))
+                report(shape, term, matches, like, match)
+        # Newest first, the LIKE scan can stop at the first hit on the date
+        # index; the index has to find and sort every match first.
+        (food,) = conn.execute(
+            "SELECT COUNT(*) FROM invoices_fts WHERE invoices_fts MATCH ?;", (food_terms,)
+        ).fetchone()
+        like = _timed_query(conn, food_like)
+        report("last_food", "(metric)", food, like, _timed_query(conn, food_match, (food_terms,)))
+        conn.close()
+
+
+def bench_reporting(rows: int) -> None:
+    """Yearly report: per-report SQL GROUP BYs vs NumPy columns + bincount."""
+    import reporting
+
+    year = 2024
+    queries = {
+        "by_month": (
+            """
+            SELECT substr(invoice_date, 1, 7) AS month, SUM(grand_total_base)
+            FROM invoices WHERE invoice_date >= ? AND invoice_date < ?
+            GROUP BY month;
+            """,
+            (f"{year}-01-01", f"{year + 1}-01-01"),
+        ),
+        "by_vendor": (
+            """
+            SELECT vendors.display_name, SUM(grand_total_base) AS total
+            FROM invoices JOIN vendors ON vendors.id = invoices.vendor_id
+            WHERE invoice_date >= ? AND invoice_date < ?
+            GROUP BY invoices.vendor_id ORDER BY total DESC LIMIT 10;
+            """,
+            (f"{year}-01-01", f"{year + 1}-01-01"),
+        ),
+        "year_over_year": (
+            """
+            SELECT substr(invoice_date, 1, 4) AS year, SUM(grand_total_base)
+            FROM invoices GROUP BY year ORDER BY year;
+            """,
+            (),
+        ),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = _bench_db(os.path.join(tmp_dir, "bench.db"), rows)
+        names = reporting.vendor_names(conn)
+
+        started = time.perf_counter()
+        cols = reporting.load_columns(conn)
+        load_seconds = time.perf_counter() - started
+
+        vectorized = {
+            "by_month": lambda: reporting.spend_by_month(cols, year),
+            "by_vendor": lambda: reporting.spend_by_vendor(cols, names, year),
+            "by_category": lambda: reporting.spend_by_category(cols, year),
+            "year_over_year": lambda: reporting.year_over_year(cols),
+        }
+        print(f"reporting ({rows} invoices; column load {load_seconds * 1000:.0f} ms, once)")
+        print(f"  {'report':<16}{'SQL ms':>10}{'NumPy ms':>10}")
+        for name, fn in vectorized.items():
+            started = time.perf_counter()
+            fn()
+            numpy_ms = (time.perf_counter() - started) * 1000
+            if name in queries:
+                sql, params = queries[name]
+                sql_ms = f"{_timed_query(conn, sql, params, repeat=1) * 1000:.1f}"
+            else:
+                sql_ms = "n/a"  # categories are derived in Python, no SQL equivalent
+            print(f"  {name:<16}{sql_ms:>10}{numpy_ms:>10.1f}")
+        conn.close()
+
+
+def bench_result_shaping(rows: int) -> None:
+    """Prompt tokens per agent query result: stock str(rows) vs shaped table."""
+    from langchain_community.utilities import SQLDatabase
+
+    from agent import run_sql
+
+    queries = {
+        "wide select": (
+            "SELECT invoice_date, seller_information, products_services, "
+            "shipping_address, billing_address, grand_total FROM invoices;"
+        ),
+        "one vendor": (
+            "SELECT invoice_date, grand_total, currency FROM invoices "
+            "WHERE seller_information LIKE 'Uber%';"
+        ),
+        "by year": (
+            "SELECT substr(invoice_date, 1, 4) AS year, SUM(grand_total_base) "
+            "FROM invoices GROUP BY year;"
+        ),
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        _bench_db(path, rows).close()
+        db = SQLDatabase.from_uri(f"sqlite:///{path}", include_tables=["invoices"])
+        print(f"result-shaping ({rows} invoices)")
+        print(f"  {'query':<14}{'rows':>8}{'raw tok':>10}{'shaped tok':>12}{'ms':>8}")
+        for name, sql in queries.items():
+            started = time.perf_counter()
+            shaped = run_sql(db, sql)
+            ms = (time.perf_counter() - started) * 1000
+            print(
+                f"  {name:<14}{shaped.row_count:>8}{shaped.raw_tokens:>10}"
+                f"{shaped.shaped_tokens:>12}{ms:>8.0f}"
+            )
+
+
+def bench_validation(rows: int, batch: int) -> None:
+    """Ingestion validation time for a batch checked against `rows` stored invoices."""
+    from validation import arithmetic_flags, duplicate_flags
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        conn = _bench_db(path, rows)
+        conn.row_factory = sqlite3.Row
+        # Re-sent copies of last month's invoices under new numbers (half of
+        # them with a different total), like a bulk upload of recent receipts.
+        recent = """
+            SELECT * FROM invoices
+            WHERE invoice_date >= (SELECT date(MAX(invoice_date), '-90 day') FROM invoices)
+            ORDER BY random() LIMIT ?;
+        """
+        invoices = []
+        for i, row in enumerate(conn.execute(recent, (batch,))):
+            invoice = dict(row)
+            invoice["invoice_number"] = f"RESENT-{i:08d}"
+            if i % 2:
+                invoice["grand_total_base"] = (invoice["grand_total_base"] or 0) * 1.5
+            invoice.update(subtotal=invoice["grand_total"], quantities="1", unit_prices=str(invoice["grand_total"]))
+            invoices.append(invoice)
+        conn.row_factory = None
+
+        started = time.perf_counter()
+        arithmetic = arithmetic_flags(invoices)
+        arithmetic_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        duplicates = duplicate_flags(conn, invoices)
+        duplicate_ms = (time.perf_counter() - started) * 1000
+        conn.close()
+    batch = len(invoices)
+    print(f"validation ({batch} invoices against {rows} stored)")
+    print(f"  {'check':<16}{'flagged':>10}{'ms':>10}{'us/invoice':>12}")
+    for name, flags, ms in (("arithmetic", arithmetic, arithmetic_ms), ("duplicates", duplicates, duplicate_ms)):
+        print(f"  {name:<16}{sum(bool(f) for f in flags):>10}{ms:>10.1f}{ms * 1000 / batch:>12.1f}")
+
+
+def _latencies_during(path: str, work: Callable[[], object], write_interval: float) -> Dict[str, object]:
+    """
+    Run `work` while one thread repeats a dashboard-style read and another
+    commits an insert every `write_interval` seconds; per-thread latencies.
+    """
+    stop = threading.Event()
+    latencies: Dict[str, List[float]] = {"read": [], "write": []}
+
+    def reader() -> None:
+        conn = sqlite3.connect(path, timeout=30.0)
+        while not stop.is_set():
+            started = time.perf_counter()
+            conn.execute(
+                "SELECT SUM(grand_total_base) FROM invoices WHERE invoice_date >= '2024-01-01';"
+            ).fetchone()
+            latencies["read"].append(time.perf_counter() - started)
+        conn.close()
+
+    def writer() -> None:
+        conn = sqlite3.connect(path, timeout=30.0)
+        while not stop.wait(write_interval):
+            started = time.perf_counter()
+            conn.execute(
+                "INSERT INTO invoices (invoice_number, invoice_date, grand_total) VALUES (?, '2024-06-01', 1.0);",
+                (f"WRITE-{time.perf_counter_ns()}",),
+            )
+            conn.commit()
+            latencies["write"].append(time.perf_counter() - started)
+        conn.close()
+
+    threads = [threading.Thread(target=reader), threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    result = work()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {"seconds": elapsed, "result": result, **latencies}
+
+
+def bench_backup(rows: int, write_interval_ms: float) -> None:
+    """Backup throughput and reader/writer latency: no backup, one-step, stepped, and WAL mode."""
+    from backup import backup_database
+
+    def ms(values: List[float], q: float) -> float:
+        return sorted(values)[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        _bench_db(path, rows).close()
+        out_dir = os.path.join(tmp_dir, "backups")
+        write_interval = write_interval_ms / 1000
+        stepped = _latencies_during(path, lambda: backup_database(path, out_dir), write_interval)
+        runs = [
+            ("no backup", _latencies_during(path, lambda: time.sleep(stepped["seconds"]), write_interval)),
+            ("one step", _latencies_during(path, lambda: backup_database(path, out_dir, pages_per_step=-1), write_interval)),
+            ("stepped", stepped),
+        ]
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.close()
+        runs.append(("WAL", _latencies_during(path, lambda: backup_database(path, out_dir), write_interval)))
+    print(f"backup ({rows} invoices, a write every {write_interval_ms:g} ms)")
+    print(
+        f"  {'variant':<12}{'seconds':>9}{'MiB/s':>8}{'restarts':>10}"
+        f"{'read p50':>10}{'read p99':>10}{'write p50':>11}{'write max':>11}"
+    )
+    for name, run in runs:
+        result = run["result"]
+        rate = f"{result.mb_per_second:.0f}" if result is not None else "-"
+        restarts = result.restarts if result is not None else "-"
+        print(
+            f"  {name:<12}{run['seconds']:>9.2f}{rate:>8}{restarts:>10}"
+            f"{ms(run['read'], 0.5):>10.2f}{ms(run['read'], 0.99):>10.2f}"
+            f"{ms(run['write'], 0.5):>11.2f}{ms(run['write'], 1.0):>11.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FiscalFlow benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    upload = sub.add_parser("upload-memory", help=bench_upload_memory.__doc__)
+    upload.add_argument("--size-mb", type=int, default=100)
+
+    fts = sub.add_parser("fts-search", help=bench_fts_search.__doc__)
+    fts.add_argument("--rows", type=int, default=1_000_000)
+
+    report = sub.add_parser("reporting", help=bench_reporting.__doc__)
+    report.add_argument("--rows", type=int, default=1_000_000)
+
+    shaping = sub.add_parser("result-shaping", help=bench_result_shaping.__doc__)
+    shaping.add_argument("--rows", type=int, default=10_000)
+
+    validation = sub.add_parser("validation", help=bench_validation.__doc__)
+    validation.add_argument("--rows", type=int, default=1_000_000)
+    validation.add_argument("--batch", type=int, default=5_000)
+
+    backup = sub.add_parser("backup", help=bench_backup.__doc__)
+    backup.add_argument("--rows", type=int, default=1_000_000)
+    backup.add_argument("--write-interval-ms", type=float, default=50.0)
+
+    args = parser.parse_args()
+    if args.benchmark == "upload-memory":
+        bench_upload_memory(args.size_mb)
+    elif args.benchmark == "fts-search":
+        bench_fts_search(args.rows)
+    elif args.benchmark == "reporting":
+        bench_reporting(args.rows)
+    elif args.benchmark == "result-shaping":
+        bench_result_shaping(args.rows)
+    elif args.benchmark == "validation":
+        bench_validation(args.rows, args.batch)
+    elif args.benchmark == "backup":
+        bench_backup(args.rows, args.write_interval_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Change feed over the `invoices` table.
+
+Triggers append one row per inserted, updated or deleted invoice to
+`invoice_changes`, under an AUTOINCREMENT sequence that never goes backwards
+or reuses a value. Anything derived from invoices (rollups, search indexes,
+caches, exports) can keep a position in that sequence and apply only what
+changed since, instead of rescanning the table:
+
+    consumer = ChangeConsumer(conn, "monthly_rollup")
+    for batch in consumer.batches():
+        for invoice_id, op in net_changes(batch).items():
+            ...                      # refresh or drop this invoice's rows
+        consumer.commit(batch[-1].seq)
+
+Positions are stored per consumer name in `change_feed_consumers`; commit in
+the same transaction as the derived writes when they live in this database,
+so the two cannot drift.
+"""
+
+import sqlite3
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from migrations import CHANGES_TABLE, CONSUMERS_TABLE
+
+
+class Change(NamedTuple):
+    seq: int
+    invoice_id: int
+    op: str
+    changed_at: str
+
+
+def latest_seq(conn: sqlite3.Connection) -> int:
+    """
+    The last sequence number handed out. Read from `sqlite_sequence`, which
+    keeps it after `prune_changes` has emptied the log (MAX(seq) would fall
+    back to 0 and look like every consumer is ahead of the data).
+    """
+    (seq,) = conn.execute(
+        f"""
+        SELECT MAX(
+            IFNULL((SELECT seq FROM sqlite_sequence WHERE name = '{CHANGES_TABLE}'), 0),
+            IFNULL((SELECT MAX(seq) FROM {CHANGES_TABLE}), 0)
+        );
+        """
+    ).fetchone()
+    return seq
+
+
+def iter_changes(
+    conn: sqlite3.Connection,
+    since_seq: int = 0,
+    batch_size: int = 1000,
+    until_seq: Optional[int] = None,
+) -> Iterator[Change]:
+    """Changes with `seq` > `since_seq` in order, read a page at a time."""
+    until = latest_seq(conn) if until_seq is None else until_seq
+    position = since_seq
+    while position < until:
+        rows = conn.execute(
+            f"""
+            SELECT seq, invoice_id, op, changed_at FROM {CHANGES_TABLE}
+            WHERE seq > ? AND seq <= ?
+            ORDER BY seq
+            LIMIT ?;
+            """,
+            (position, until, batch_size),
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield Change(*row)
+        position = rows[-1][0]
+
+
+def net_changes(changes: List[Change]) -> Dict[int, str]:
+    """
+    Collapse a run of changes to one action per invoice.
+
+    "delete" if the invoice is gone at the end of the run, else "upsert";
+    an invoice inserted and deleted within the run is dropped entirely.
+    """
+    first: Dict[int, str] = {}
+    last: Dict[int, str] = {}
+    for change in changes:
+        first.setdefault(change.invoice_id, change.op)
+        last[change.invoice_id] = change.op
+    actions = {}
+    for invoice_id, op in last.items():
+        if op != "delete":
+            actions[invoice_id] = "upsert"
+        elif first[invoice_id] != "insert":
+            actions[invoice_id] = "delete"
+    return actions
+
+
+class ChangeConsumer:
+    """A named, checkpointed reader of the change feed."""
+
+    def __init__(self, conn: sqlite3.Connection, name: str) -> None:
+        self.conn = conn
+        self.name = name
+        conn.execute(
+            f"INSERT OR IGNORE INTO {CONSUMERS_TABLE} (name) VALUES (?);", (name,)
+        )
+
+    @property
+    def position(self) -> int:
+        (seq,) = self.conn.execute(
+            f"SELECT last_seq FROM {CONSUMERS_TABLE} WHERE name = ?;", (self.name,)
+        ).fetchone()
+        return seq
+
+    def lag(self) -> int:
+        """Changes not yet committed by this consumer."""
+        return latest_seq(self.conn) - self.position
+
+    def batches(self, batch_size: int = 1000) -> Iterator[List[Change]]:
+        """Pending changes in lists of up to `batch_size`, oldest first."""
+        batch: List[Change] = []
+        for change in iter_changes(self.conn, self.position, batch_size):
+            batch.append(change)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def commit(self, seq: int) -> None:
+        """Record that everything up to `seq` has been applied (not committed)."""
+        self.conn.execute(
+            f"""
+            UPDATE {CONSUMERS_TABLE}
+            SET last_seq = MAX(last_seq, ?), updated_at = CURRENT_TIMESTAMP
+            WHERE name = ?;
+            """,
+            (seq, self.name),
+        )
+
+    def reset(self, seq: int = 0) -> None:
+        """Rewind (or fast-forward) to `seq`, e.g. to rebuild from scratch."""
+        self.conn.execute(
+            f"UPDATE {CONSUMERS_TABLE} SET last_seq = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ?;",
+            (seq, self.name),
+        )
+
+
+def prune_changes(conn: sqlite3.Connection) -> int:
+    """Delete log rows every registered consumer has already applied."""
+    (low_water,) = conn.execute(
+        f"SELECT IFNULL(MIN(last_seq), 0) FROM {CONSUMERS_TABLE};"
+    ).fetchone()
+    before = conn.total_changes
+    conn.execute(f"DELETE FROM {CHANGES_TABLE} WHERE seq <= ?;", (low_water,))
+    return conn.total_changes - before
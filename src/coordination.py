@@ -0,0 +1,164 @@
+"""
+Coordination between web worker processes on one host.
+
+With several workers (see workers.py) each process has its own memory, so
+anything cached in-process goes stale as soon as another worker ingests an
+upload. Three pieces keep them in step through files they all share:
+
+- `DataVersion`: the invoice data's version, the change feed's latest
+  sequence number (every insert, update and delete of an invoice, in any
+  process, advances it). Checking it is one `PRAGMA data_version` on a
+  long-lived connection, which only changes when some other connection has
+  committed; only then is the sequence re-read.
+- `SharedCache`: JSON values in a WAL-mode SQLite file (SHARED_CACHE_PATH),
+  each stored with the data version it was computed at. A read for a newer
+  version misses, so an upload in one worker invalidates every worker's
+  cached metrics and template answers at once, without messages between
+  them. Entries for older versions are deleted as newer ones are written.
+- `file_lock`: an advisory lock file, for work that must not run in two
+  workers at once (vector index updates, scheduled backups).
+
+Connections are per thread and per process: a connection inherited across
+`fork()` is never reused.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from changes import latest_seq
+from seed_invoices import INVOICE_DB_PATH
+
+
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.db")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "10000"))
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """
+    Hold an exclusive advisory lock on `path` for the block; yields False
+    (without waiting) when not `blocking` and another process holds it.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class _Connections:
+    """One SQLite connection per thread of the current process."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]) -> None:
+        self._connect = connect
+        # Per-thread state; reset along with the connection after a fork.
+        self.local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.__dict__.clear()
+            self.local.conn = self._connect()
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+
+class DataVersion:
+    """The invoice data's current version; see module docstring."""
+
+    def __init__(self, db_path: str = INVOICE_DB_PATH) -> None:
+        self.db_path = db_path
+        self._connections = _Connections(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True, timeout=5.0)
+
+    def current(self) -> int:
+        conn = self._connections.get()
+        (data_version,) = conn.execute("PRAGMA data_version;").fetchone()
+        local = self._connections.local
+        if getattr(local, "data_version", None) != data_version:
+            local.version = latest_seq(conn)
+            local.data_version = data_version
+        return local.version
+
+
+class SharedCache:
+    """Version-stamped JSON values shared by every worker; see module docstring."""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_entries: int = SHARED_CACHE_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._connections = _Connections(self._connect)
+        self.hits = 0
+        self.misses = 0
+        conn = self._connections.get()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shared_cache (
+                key TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_cache_version ON shared_cache (version);")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
+
+    def get(self, key: str, version: int) -> Optional[Any]:
+        """The value stored for `key` at exactly `version`, else None."""
+        row = self._connections.get().execute(
+            "SELECT value FROM shared_cache WHERE key = ? AND version = ?;", (key, version)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, version: int, value: Any) -> None:
+        conn = self._connections.get()
+        conn.execute(
+            """
+            INSERT INTO shared_cache (key, version, value) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET version = excluded.version, value = excluded.value
+            WHERE excluded.version >= shared_cache.version;
+            """,
+            (key, version, json.dumps(value, default=str)),
+        )
+        conn.execute("DELETE FROM shared_cache WHERE version < ?;", (version,))
+        (entries,) = conn.execute("SELECT COUNT(*) FROM shared_cache;").fetchone()
+        if entries > self.max_entries:
+            conn.execute(
+                "DELETE FROM shared_cache WHERE rowid IN (SELECT rowid FROM shared_cache ORDER BY rowid LIMIT ?);",
+                (entries - self.max_entries,),
+            )
+
+    def get_or_compute(self, key: str, version: int, compute: Callable[[], Any]) -> Any:
+        value = self.get(key, version)
+        if value is None:
+            value = compute()
+            self.set(key, version, value)
+        return value
+
+    def clear(self) -> None:
+        self._connections.get().execute("DELETE FROM shared_cache;")
+
+    def stats(self) -> Dict[str, int]:
+        (entries,) = self._connections.get().execute("SELECT COUNT(*) FROM shared_cache;").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,237 @@
+"""
+Registry of the SQLite databases the agent can answer questions about.
+
+Each registered database gets one `SQLDatabase` (so one SQLAlchemy engine and
+connection pool, and one reflection of its tables) for the life of the
+process, plus a compact schema summary (`table(column, ...)` per line) built
+once from PRAGMA table_info. The summary goes into the agent's prompt and
+feeds `route`, a keyword router that picks a database for a question without
+an LLM call. The invoices pool attaches the archived years (see archive.py) on
+every checkout, so the agent's `invoices` includes them.
+
+Besides the invoices DB, `Chinook.db` (a sample music store) is registered
+when present. More databases can be added with AGENT_EXTRA_DATABASES, e.g.
+`sales=/data/sales.db;hr=/data/hr.db`.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, event
+
+from archive import ARCHIVED_VIEW, attach_archives
+from fx import BASE_CURRENCY
+from migrations import CHANGES_TABLE, CONSUMERS_TABLE, FTS_COLUMNS, FTS_TABLE, QUARANTINE_TABLE
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+CHINOOK_DB_PATH = os.getenv("CHINOOK_DB_PATH", "Chinook.db")
+AGENT_DB_POOL_SIZE = int(os.getenv("AGENT_DB_POOL_SIZE", "4"))
+
+# Tables the agent should not list or reflect: FTS5 virtual/shadow tables
+# (described in the prompt instead) and ingestion bookkeeping.
+AGENT_IGNORED_TABLES = [
+    FTS_TABLE,
+    f"{FTS_TABLE}_config",
+    f"{FTS_TABLE}_data",
+    f"{FTS_TABLE}_docsize",
+    f"{FTS_TABLE}_idx",
+    "invoice_page_hashes",
+    "fx_rates",
+    CHANGES_TABLE,
+    CONSUMERS_TABLE,
+    QUARANTINE_TABLE,
+]
+
+INVOICE_PROMPT_NOTES = """
+For text lookups (products, sellers, notes, addresses) do not use LIKE on the
+invoices table. Use the full-text index `{fts_table}` instead; it is an FTS5
+table whose rowid is `invoices.id`, with columns {fts_columns}. The index only
+covers recent years; invoices of archived years are in the view
+`{archived_view}` (same columns as invoices, possibly empty), which has no
+index, so add them with LIKE. For example:
+
+    SELECT invoices.invoice_date, invoices.seller_information
+    FROM {fts_table} JOIN invoices ON invoices.id = {fts_table}.rowid
+    WHERE {fts_table} MATCH 'pizza'
+    UNION ALL
+    SELECT invoice_date, seller_information
+    FROM {archived_view}
+    WHERE products_services LIKE '%pizza%'
+    ORDER BY invoice_date DESC;
+
+Restrict to one column with `MATCH 'products_services: pizza'`, combine terms
+with OR, and use `pizz*` for prefixes. Leave out the `{archived_view}` part
+when the question only concerns recent dates.
+
+Amounts are in each invoice's own `currency`. `grand_total_base` is
+`grand_total` converted to {base_currency} at insert time; use
+SUM(grand_total_base) for any total that spans currencies and say the result
+is in {base_currency}.
+
+For per-vendor questions, group by `invoices.vendor_id` and join `vendors`
+(`vendors.id = invoices.vendor_id`) for the clean `display_name`, rather than
+grouping by the raw `seller_information` text.
+""".format(
+    fts_table=FTS_TABLE,
+    fts_columns=", ".join(FTS_COLUMNS),
+    archived_view=ARCHIVED_VIEW,
+    base_currency=BASE_CURRENCY,
+)
+
+
+@dataclass
+class DatabaseSpec:
+    name: str
+    path: str
+    description: str
+    # Words that point a question at this database, on top of its own
+    # table and column names.
+    keywords: Set[str] = field(default_factory=set)
+    ignore_tables: List[str] = field(default_factory=list)
+    prompt_notes: str = ""
+    prepare: Optional[Callable[[str], None]] = None
+    # Run on every DBAPI connection as it is checked out of the pool.
+    on_checkout: Optional[Callable[[sqlite3.Connection], None]] = None
+
+
+def _attach_invoice_archives(conn: sqlite3.Connection) -> None:
+    attach_archives(conn, read_only=True)
+
+
+def default_specs() -> List[DatabaseSpec]:
+    specs = [
+        DatabaseSpec(
+            name="invoices",
+            path=INVOICE_DB_PATH,
+            description="The user's personal invoices and receipts: vendors, spend, currencies.",
+            keywords={
+                "i", "my", "me", "spend", "spent", "bought", "paid", "receipt",
+                "vendor", "seller", "purchase", "tax", "ate", "eat", "order",
+            },
+            ignore_tables=AGENT_IGNORED_TABLES,
+            prompt_notes=INVOICE_PROMPT_NOTES,
+            prepare=ensure_invoice_db,
+            # Archived years read through the same `invoices` name.
+            on_checkout=_attach_invoice_archives,
+        )
+    ]
+    if os.path.exists(CHINOOK_DB_PATH):
+        specs.append(
+            DatabaseSpec(
+                name="chinook",
+                path=CHINOOK_DB_PATH,
+                description="Chinook, a sample digital music store: artists, albums, tracks, customers, sales.",
+                keywords={
+                    "music", "song", "songs", "band", "sales", "store", "composer",
+                    "rock", "jazz", "metal", "minutes", "milliseconds", "support",
+                },
+            )
+        )
+    for entry in filter(None, os.getenv("AGENT_EXTRA_DATABASES", "").split(";")):
+        name, _, path = entry.partition("=")
+        specs.append(DatabaseSpec(name=name.strip(), path=path.strip(), description=name.strip()))
+    return specs
+
+
+_WORD = re.compile(r"[A-Za-z]+")
+_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+def _words(text: str) -> Set[str]:
+    """Lower-cased words, splitting snake_case and CamelCase, plus singulars."""
+    words = set()
+    for token in _WORD.findall(_CAMEL.sub(" ", text)):
+        token = token.lower()
+        words.add(token)
+        if len(token) > 3 and token.endswith("s"):
+            words.add(token[:-1])
+    return words
+
+
+class DatabaseRegistry:
+    """Lazily opened, process-wide handles for the registered databases."""
+
+    def __init__(self, specs: List[DatabaseSpec]) -> None:
+        if not specs:
+            raise ValueError("At least one database must be registered")
+        self.specs: Dict[str, DatabaseSpec] = {spec.name: spec for spec in specs}
+        self.default = specs[0].name
+        self._databases: Dict[str, SQLDatabase] = {}
+        self._summaries: Dict[str, str] = {}
+        self._vocabularies: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.specs)
+
+    def database(self, name: str) -> SQLDatabase:
+        """The shared SQLDatabase (engine + pool) for `name`, opened once."""
+        with self._lock:
+            if name not in self._databases:
+                spec = self.specs[name]
+                if spec.prepare is not None:
+                    spec.prepare(spec.path)
+                # Read-only: the agent never writes, whatever SQL it generates.
+                engine = create_engine(
+                    f"sqlite:///file:{spec.path}?mode=ro&uri=true",
+                    pool_size=AGENT_DB_POOL_SIZE,
+                    max_overflow=AGENT_DB_POOL_SIZE,
+                )
+                if spec.on_checkout is not None:
+                    hook = spec.on_checkout
+                    event.listen(engine, "checkout", lambda dbapi_conn, *_: hook(dbapi_conn))
+                self._databases[name] = SQLDatabase(engine, ignore_tables=spec.ignore_tables or None)
+            return self._databases[name]
+
+    def after_fork(self) -> None:
+        """
+        In a forked child: drop pooled connections inherited from the parent
+        (without closing them under it); engines, reflected tables and schema
+        summaries stay shared.
+        """
+        self._lock = threading.Lock()
+        for database in self._databases.values():
+            database._engine.dispose(close=False)
+
+    def schema_summary(self, name: str) -> str:
+        """One `table(column, ...)` line per usable table, computed once."""
+        if name not in self._summaries:
+            tables = self.database(name).get_usable_table_names()
+            conn = sqlite3.connect(self.specs[name].path)
+            try:
+                lines = []
+                for table in tables:
+                    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}");')]
+                    lines.append(f"{table}({', '.join(columns)})")
+            finally:
+                conn.close()
+            self._summaries[name] = "\n".join(lines)
+        return self._summaries[name]
+
+    def _vocabulary(self, name: str) -> Set[str]:
+        if name not in self._vocabularies:
+            spec = self.specs[name]
+            self._vocabularies[name] = _words(self.schema_summary(name)) | spec.keywords
+        return self._vocabularies[name]
+
+    def route(self, question: str, current: Optional[str] = None) -> str:
+        """
+        Pick the database whose vocabulary the question overlaps most.
+
+        Ties and questions with no signal (typical for follow-ups such as
+        "and last year?") stay on `current`, else go to the default.
+        """
+        fallback = current if current in self.specs else self.default
+        words = _words(question)
+        scores = {name: len(words & self._vocabulary(name)) for name in self.specs}
+        best = max(scores.values())
+        if best == 0 or scores.get(fallback) == best:
+            return fallback
+        return max(scores, key=scores.get)
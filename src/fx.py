@@ -0,0 +1,150 @@
+"""
+Local FX rates and base-currency normalization of invoice totals.
+
+Rates are loaded from a CSV (`currency,effective_date,usd_per_unit`) into the
+`fx_rates` table. Each invoice's `grand_total_base` is `grand_total` converted
+to BASE_CURRENCY with the latest rate effective on its invoice date, computed
+once at insert time, so cross-currency totals are a plain SUM.
+
+Invoices without a currency (empty or the OCR placeholder "NULL") are assumed
+to be in BASE_CURRENCY; currencies with no rate keep a NULL `grand_total_base`
+and are reported by `unconverted_currencies` (and /api/metrics).
+
+Usage (after editing the rates file):
+
+    python fx.py          # reload rates and recompute every grand_total_base
+"""
+
+import bisect
+import csv
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+
+FX_RATES_PATH = os.getenv("FX_RATES_PATH", "fx_rates.csv")
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "USD").upper()
+
+
+def load_fx_rates(conn: sqlite3.Connection, path: str = FX_RATES_PATH) -> int:
+    """Upsert the rates file into `fx_rates`; returns rows read (0 if absent)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline="", encoding="utf-8") as fh:
+        rows = [
+            (row["currency"].strip().upper(), row["effective_date"].strip(), float(row["usd_per_unit"]))
+            for row in csv.DictReader(fh)
+        ]
+    conn.executemany(
+        """
+        INSERT INTO fx_rates (currency, effective_date, usd_per_unit) VALUES (?, ?, ?)
+        ON CONFLICT (currency, effective_date) DO UPDATE SET usd_per_unit = excluded.usd_per_unit;
+        """,
+        rows,
+    )
+    return len(rows)
+
+
+class FxConverter:
+    """In-memory snapshot of `fx_rates` for converting amounts to BASE_CURRENCY."""
+
+    def __init__(self, conn: sqlite3.Connection, base_currency: str = BASE_CURRENCY) -> None:
+        self.base_currency = base_currency
+        self._dates: Dict[str, List[str]] = {}
+        self._rates: Dict[str, List[float]] = {}
+        for currency, effective_date, rate in conn.execute(
+            "SELECT currency, effective_date, usd_per_unit FROM fx_rates "
+            "ORDER BY currency, effective_date;"
+        ):
+            self._dates.setdefault(currency, []).append(effective_date)
+            self._rates.setdefault(currency, []).append(rate)
+
+    def _usd_per_unit(self, currency: str, on_date: Optional[str]) -> Optional[float]:
+        if currency == "USD" and currency not in self._rates:
+            return 1.0
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        # Latest rate effective on the date; the earliest known rate otherwise.
+        index = bisect.bisect_right(dates, on_date or dates[-1]) - 1
+        return self._rates[currency][max(index, 0)]
+
+    def to_base(self, amount: Optional[float], currency: Optional[str], on_date: Optional[str]) -> Optional[float]:
+        if amount is None:
+            return None
+        code = (currency or "").strip().upper()
+        if code in ("", "NULL"):
+            code = self.base_currency
+        if code == self.base_currency:
+            return round(float(amount), 2)
+        source = self._usd_per_unit(code, on_date)
+        target = self._usd_per_unit(self.base_currency, on_date)
+        if source is None or not target:
+            return None
+        return round(float(amount) * source / target, 2)
+
+
+def recompute_base_totals(conn: sqlite3.Connection, only_missing: bool = True) -> int:
+    """Fill `grand_total_base` (only NULL ones unless `only_missing` is False)."""
+    converter = FxConverter(conn)
+    where = "WHERE grand_total_base IS NULL" if only_missing else ""
+    rows = conn.execute(
+        f"SELECT id, grand_total, currency, invoice_date FROM invoices {where};"
+    ).fetchall()
+    updates: List[Tuple[Optional[float], int, Optional[float]]] = []
+    for invoice_id, total, currency, invoice_date in rows:
+        base = converter.to_base(total, currency, invoice_date)
+        updates.append((base, invoice_id, base))
+    # Unchanged rows are skipped so a rate refresh does not flood the
+    # change feed with no-op updates.
+    conn.executemany(
+        "UPDATE invoices SET grand_total_base = ? WHERE id = ? AND grand_total_base IS NOT ?;",
+        updates,
+    )
+    return len(updates)
+
+
+def unconverted_currencies(conn: sqlite3.Connection) -> Dict[str, int]:
+    """
+    Invoices per currency that have a total but no `grand_total_base` (no
+    rate for the currency), most first. Every SUM over the base total leaves
+    them out.
+    """
+    return dict(
+        conn.execute(
+            """
+            SELECT IFNULL(currency, ''), COUNT(*)
+            FROM invoices
+            WHERE grand_total_base IS NULL AND grand_total IS NOT NULL
+            GROUP BY 1
+            ORDER BY 2 DESC, 1;
+            """
+        ).fetchall()
+    )
+
+
+def refresh_fx(db_path: str, rates_path: str = FX_RATES_PATH) -> Tuple[int, int]:
+    """Reload the rates file and recompute every invoice's base total."""
+    conn = sqlite3.connect(db_path)
+    try:
+        loaded = load_fx_rates(conn, rates_path)
+        updated = recompute_base_totals(conn, only_missing=False)
+        conn.commit()
+    finally:
+        conn.close()
+    return loaded, updated
+
+
+if __name__ == "__main__":
+    from seed_invoices import INVOICE_DB_PATH
+
+    loaded, updated = refresh_fx(INVOICE_DB_PATH)
+    print(f"Loaded {loaded} FX rates; recomputed {updated} invoices in {BASE_CURRENCY}.")
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        missing = unconverted_currencies(conn)
+    finally:
+        conn.close()
+    if missing:
+        listed = ", ".join(f"{code or '?'} ({count})" for code, count in missing.items())
+        print(f"No rate, left out of base totals: {listed}")
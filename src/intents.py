@@ -0,0 +1,326 @@
+"""
+Template fast path for common invoice questions.
+
+A few question shapes cover much of what the dashboard is asked, and each of
+them costs several sequential LLM calls through the agent. `match_intent`
+recognizes them with anchored patterns, and `answer` fills a fixed,
+parameterized SQL template against the invoices schema and phrases the
+result, in milliseconds:
+
+    last_purchase   "when was the last time I ate pizza"
+    spend_on        "how much did I spend on uber eats in 2024"
+    total_spend     "how much did I spend last month"
+    top_vendor      "who was my top vendor this year"
+
+Anything that does not match a whole pattern, or that matches but finds no
+invoices (often a wording the text index does not know), returns None so the
+caller falls back to the full agent. Text is matched through the FTS index,
+plus LIKE over archived years when the connection has archives attached
+(see search.py); callers attach them. `FastPathStats` records hits and
+latency per path.
+"""
+
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from archive import ARCHIVED_VIEW
+from fx import BASE_CURRENCY
+from migrations import FTS_TABLE
+from search import archives_attached, fts_query, like_filter
+
+
+_MONTHS = {
+    name: index
+    for index, name in enumerate(
+        ["january", "february", "march", "april", "may", "june", "july",
+         "august", "september", "october", "november", "december"],
+        start=1,
+    )
+}
+
+_PERIOD = (
+    r"(?:\s+(?P<period>"
+    r"(?:in|during)\s+(?:\d{4}|(?:" + "|".join(_MONTHS) + r")(?:\s+\d{4})?)"
+    r"|(?:this|last)\s+(?:year|month)"
+    r"|since\s+\d{4}"
+    r"|(?:in\s+)?total|overall|ever"
+    r"))?"
+)
+_END = r"\s*[?.!]*$"
+
+_PATTERNS: List[Tuple[str, "re.Pattern[str]"]] = [
+    (
+        "last_purchase",
+        re.compile(
+            r"^(?:when\s+(?:was|is)\s+(?:the\s+)?last\s+time\s+(?:that\s+)?i\s+"
+            r"|when\s+did\s+i\s+last\s+)"
+            r"(?:bought|buy|ate|eat|ordered|order|paid\s+for|pay\s+for|got|get|had|have)\s+"
+            r"(?P<item>.+?)" + _END
+        ),
+    ),
+    (
+        "top_vendor",
+        re.compile(
+            r"^(?:(?:who|which\s+vendor|what\s+vendor|which\s+seller)\s+(?:is|was)\s+)?"
+            r"(?:my\s+)?(?:top|biggest|largest)\s+(?:vendor|seller)" + _PERIOD + _END
+        ),
+    ),
+    (
+        "spend_on",
+        re.compile(
+            r"^(?:how\s+much\s+(?:did|have)\s+i\s+(?:spend|spent|pay|paid)"
+            r"|(?:what\s+is\s+|what's\s+)?(?:my\s+)?total\s+spend(?:ing)?)"
+            r"\s+(?:on|for|at)\s+(?P<item>.+?)" + _PERIOD + _END
+        ),
+    ),
+    (
+        "total_spend",
+        re.compile(
+            r"^(?:how\s+much\s+(?:did|have)\s+i\s+(?:spend|spent|pay|paid)"
+            r"|(?:what\s+is\s+|what's\s+)?(?:my\s+)?total\s+spend(?:ing)?)" + _PERIOD + _END
+        ),
+    ),
+]
+
+_LEADING_FILLER = re.compile(r"^(?:a|an|the|some|any|my)\s+")
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    item: Optional[str]
+    # Half-open [start, end) ISO dates; None means unbounded.
+    start: Optional[str]
+    end: Optional[str]
+    period_label: str
+
+
+def parse_period(text: Optional[str], today: date) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+    """(start, end, label) for a period phrase; None if it is not understood."""
+    if not text or text in ("total", "in total", "overall", "ever"):
+        return None, None, "in total"
+    words = text.split()
+    if words[0] == "since":
+        return f"{words[1]}-01-01", None, text
+    if words[0] in ("this", "last"):
+        if words[1] == "year":
+            year = today.year - (words[0] == "last")
+            return f"{year}-01-01", f"{year + 1}-01-01", text
+        month_index = today.year * 12 + today.month - 1 - (words[0] == "last")
+        year, month = divmod(month_index, 12)
+        start = date(year, month + 1, 1)
+        year, month = divmod(month_index + 1, 12)
+        return start.isoformat(), date(year, month + 1, 1).isoformat(), text
+    rest = words[1:]
+    if rest and rest[0].isdigit():
+        year = int(rest[0])
+        return f"{year}-01-01", f"{year + 1}-01-01", f"in {year}"
+    if rest and rest[0] in _MONTHS:
+        month = _MONTHS[rest[0]]
+        year = int(rest[1]) if len(rest) > 1 else today.year
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return date(year, month, 1).isoformat(), end.isoformat(), f"in {rest[0].title()} {year}"
+    return None
+
+
+def _clean_item(item: str) -> Optional[str]:
+    return _LEADING_FILLER.sub("", item.strip().lower()) or None
+
+
+def match_intent(question: str, today: Optional[date] = None) -> Optional[IntentMatch]:
+    """The template a question fits, or None to use the agent."""
+    text = " ".join(question.lower().split())
+    for intent, pattern in _PATTERNS:
+        m = pattern.match(text)
+        if not m:
+            continue
+        groups = m.groupdict()
+        period = parse_period(groups.get("period"), today or date.today())
+        if period is None:
+            return None
+        item = None
+        if "item" in groups and groups["item"] is not None:
+            item = _clean_item(groups["item"])
+            if not item or not fts_query(item):
+                return None
+        start, end, label = period
+        return IntentMatch(intent=intent, item=item, start=start, end=end, period_label=label)
+    return None
+
+
+def _date_filter(match: IntentMatch) -> Tuple[str, List[Any]]:
+    clauses, params = [], []
+    if match.start:
+        clauses.append("invoices.invoice_date >= ?")
+        params.append(match.start)
+    if match.end:
+        clauses.append("invoices.invoice_date < ?")
+        params.append(match.end)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+_TEXT_COLUMNS = ("products_services", "seller_information")
+
+
+def _item_words(item: str) -> str:
+    # "pizzas" should find "pizza"; the FTS terms are prefixes anyway.
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in item.split()]
+    return " ".join(words)
+
+
+def _text_match(item: str) -> str:
+    return f"{{{' '.join(_TEXT_COLUMNS)}}}: {fts_query(_item_words(item))}"
+
+
+def _matching(
+    conn: sqlite3.Connection, item: str, columns: str, dates: str, date_params: List[Any]
+) -> Tuple[str, List[Any]]:
+    """
+    SELECT `columns` from invoices whose text matches `item`: the FTS index
+    for the hot table, plus a LIKE scan of `archived_invoices` when archives
+    are attached (the index does not cover them).
+    """
+    sql = f"""
+        SELECT {columns}
+        FROM {FTS_TABLE} JOIN main.invoices AS invoices ON invoices.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?{dates}
+    """
+    params = [_text_match(item)] + date_params
+    if archives_attached(conn):
+        predicate, like_params = like_filter(_item_words(item), _TEXT_COLUMNS)
+        sql += f"""
+        UNION ALL
+        SELECT {columns}
+        FROM {ARCHIVED_VIEW} AS invoices
+        WHERE {predicate}{dates}
+        """
+        params += like_params + date_params
+    return sql, params
+
+
+def _money(amount: float) -> str:
+    return f"{amount:,.2f} {BASE_CURRENCY}"
+
+
+def answer(conn: sqlite3.Connection, match: IntentMatch) -> Optional[Dict[str, Any]]:
+    """Run the template for `match`; None when it finds nothing to report."""
+    dates, date_params = _date_filter(match)
+    if match.intent == "last_purchase":
+        matching, params = _matching(
+            conn,
+            match.item,
+            "invoices.invoice_date, invoices.seller_information, invoices.grand_total, invoices.currency",
+            "",
+            [],
+        )
+        sql = f"{matching} ORDER BY 1 DESC LIMIT 1;"
+        row = conn.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        invoice_date, seller, total, currency = row
+        seller = (seller or "an unknown seller").split(",")[0]
+        if not currency or currency == "NULL":
+            currency = BASE_CURRENCY
+        text = f"The last time was on {invoice_date}, from {seller} ({total} {currency})."
+    elif match.intent == "spend_on":
+        matching, params = _matching(conn, match.item, "invoices.grand_total_base", dates, date_params)
+        sql = f"SELECT COUNT(*), COUNT(grand_total_base), SUM(grand_total_base) FROM ({matching});"
+        count, converted, total = conn.execute(sql, params).fetchone()
+        # Invoices without a base-currency total would make the sum wrong.
+        if not count or converted < count:
+            return None
+        text = (
+            f"You spent {_money(total or 0)} on {match.item} {match.period_label}, "
+            f"across {count} invoice{'s' if count != 1 else ''}."
+        )
+    elif match.intent == "total_spend":
+        sql = f"""
+            SELECT COUNT(*), COUNT(invoices.grand_total_base), SUM(invoices.grand_total_base)
+            FROM invoices WHERE 1 = 1{dates};
+        """
+        params = date_params
+        count, converted, total = conn.execute(sql, params).fetchone()
+        if not count or converted < count:
+            return None
+        text = (
+            f"You spent {_money(total or 0)} {match.period_label}, "
+            f"across {count} invoice{'s' if count != 1 else ''}."
+        )
+    else:  # top_vendor
+        sql = f"""
+            SELECT vendors.display_name, SUM(invoices.grand_total_base) AS total, COUNT(*)
+            FROM invoices JOIN vendors ON vendors.id = invoices.vendor_id
+            WHERE invoices.grand_total_base IS NOT NULL{dates}
+            GROUP BY invoices.vendor_id
+            ORDER BY total DESC
+            LIMIT 1;
+        """
+        params = date_params
+        row = conn.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        name, total, count = row
+        text = (
+            f"Your top vendor {match.period_label} was {name}, with {_money(total)} "
+            f"across {count} invoice{'s' if count != 1 else ''}."
+        )
+    return {"answer": text, "intent": match.intent, "sql": " ".join(sql.split()), "params": params}
+
+
+@dataclass
+class PathStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    recent: List[float] = field(default_factory=list)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent = (self.recent + [seconds])[-200:]
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_seconds / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(recent[len(recent) // 2] * 1000, 2) if recent else 0.0,
+            "p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 2) if recent else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+        }
+
+
+class FastPathStats:
+    """Per-path (template intent or "agent") counts and latencies."""
+
+    def __init__(self) -> None:
+        self._paths: Dict[str, PathStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, path: str, seconds: float) -> None:
+        with self._lock:
+            self._paths.setdefault(path, PathStats()).add(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            paths = {name: stats.snapshot() for name, stats in self._paths.items()}
+        total = sum(p["count"] for p in paths.values())
+        hits = sum(p["count"] for name, p in paths.items() if name != "agent")
+        return {
+            "questions": total,
+            "template_hit_rate": round(hits / total, 3) if total else 0.0,
+            "paths": paths,
+        }
+
+
+def try_fast_path(conn: sqlite3.Connection, question: str) -> Optional[Dict[str, Any]]:
+    """Template answer for `question`, or None to fall back to the agent."""
+    match = match_intent(question)
+    if match is None:
+        return None
+    return answer(conn, match)
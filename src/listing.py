@@ -0,0 +1,203 @@
+"""
+Paged invoice listing and streaming export.
+
+Invoices are ordered by `(invoice_date, id)`, with undated invoices first
+(their date sorts as ''). Pages are keyset-paginated: the cursor returned with
+a page encodes the last row's sort key, and the next page starts strictly
+after it, so every page is one index range scan (`idx_invoices_listing`)
+however deep the client pages, and rows inserted meanwhile never shift or
+repeat a page the way OFFSET would.
+
+Exports walk the same order in EXPORT_PAGE_ROWS keyset pages and yield CSV or
+NDJSON bytes as rows are stepped off each page's cursor. Memory stays flat
+whatever the size of the table, the first bytes (the CSV header) go out
+before any row is read, and the read lock is released between pages so
+uploads are never held up behind a long export.
+
+Both read through `attach_archives`, so archived years are listed too; only
+the years overlapping `since`/`until` are attached.
+"""
+
+import base64
+import csv
+import io
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from archive import attach_archives
+from seed_invoices import INVOICE_DB_PATH
+
+
+EXPORT_PAGE_ROWS = int(os.getenv("EXPORT_PAGE_ROWS", "5000"))
+# Bytes buffered before an export chunk is yielded.
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+DEFAULT_COLUMNS = (
+    "id",
+    "invoice_number",
+    "invoice_date",
+    "seller_information",
+    "products_services",
+    "grand_total",
+    "currency",
+    "grand_total_base",
+    "vendor_id",
+)
+
+# Must match the expression of idx_invoices_listing for the index to be used.
+_SORT_KEY = "IFNULL(invoice_date, '')"
+
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def invoice_columns(conn: sqlite3.Connection) -> List[str]:
+    return [row[1] for row in conn.execute("PRAGMA table_info(invoices);")]
+
+
+def parse_columns(conn: sqlite3.Connection, requested: Optional[str]) -> List[str]:
+    """
+    The projection for a comma-separated `requested` list (default columns
+    when empty); `id` is always included. ValueError names unknown columns.
+    """
+    if not requested:
+        return list(DEFAULT_COLUMNS)
+    names = [name.strip() for name in requested.split(",") if name.strip()]
+    unknown = sorted(set(names) - set(invoice_columns(conn)))
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return ["id"] + [name for name in dict.fromkeys(names) if name != "id"]
+
+
+def encode_cursor(sort_key: str, invoice_id: int) -> str:
+    raw = json.dumps([sort_key, invoice_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(token: str) -> Tuple[str, int]:
+    """ValueError for anything `encode_cursor` did not produce."""
+    try:
+        sort_key, invoice_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(sort_key, str) or not isinstance(invoice_id, int):
+        raise ValueError("Invalid cursor")
+    return sort_key, invoice_id
+
+
+def _page_query(
+    columns: Sequence[str],
+    after: Optional[Tuple[str, int]],
+    descending: bool,
+    since: Optional[str],
+    until: Optional[str],
+    limit: int,
+) -> Tuple[str, List[Any]]:
+    clauses, params = [], []
+    if after is not None:
+        # Spelled out rather than as a row value `(key, id) > (?, ?)`, which
+        # SQLite does not turn into an index range seek on the expression.
+        op = "<" if descending else ">"
+        clauses.append(f"{_SORT_KEY} {op}= ? AND ({_SORT_KEY} {op} ? OR id {op} ?)")
+        params.extend([after[0], after[0], after[1]])
+    if since:
+        clauses.append(f"{_SORT_KEY} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{_SORT_KEY} <= ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    direction = "DESC" if descending else "ASC"
+    select = ", ".join(f'"{c}"' for c in columns)
+    sql = f"""
+        SELECT {select}, {_SORT_KEY}
+        FROM invoices
+        {where}
+        ORDER BY {_SORT_KEY} {direction}, id {direction}
+        LIMIT ?;
+    """
+    return sql, params + [limit]
+
+
+def list_invoices(
+    conn: sqlite3.Connection,
+    columns: Sequence[str],
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of invoices and the cursor of the next page (None at the end)."""
+    after = decode_cursor(cursor) if cursor else None
+    sql, params = _page_query(columns, after, descending, since, until, limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    page = [dict(zip(columns, row[:-1])) for row in rows]
+    next_cursor = None
+    if more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[-1], last[columns.index("id")])
+    return page, next_cursor
+
+
+def _rows(
+    db_path: str,
+    columns: Sequence[str],
+    descending: bool,
+    since: Optional[str],
+    until: Optional[str],
+) -> Iterator[Tuple[Any, ...]]:
+    after = None
+    id_index = list(columns).index("id")
+    while True:
+        # The response is iterated from worker threads, not always the same one.
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            attach_archives(conn, since, until)
+            sql, params = _page_query(columns, after, descending, since, until, EXPORT_PAGE_ROWS)
+            last = None
+            count = 0
+            for row in conn.execute(sql, params):
+                yield row[:-1]
+                last = row
+                count += 1
+        finally:
+            conn.close()
+        if count < EXPORT_PAGE_ROWS:
+            return
+        after = (last[-1], last[id_index])
+
+
+def export_invoices(
+    columns: Sequence[str],
+    fmt: str = "csv",
+    descending: bool = False,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    db_path: str = INVOICE_DB_PATH,
+) -> Iterator[bytes]:
+    """CSV (with a header row) or NDJSON bytes for every matching invoice."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(columns)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    for row in _rows(db_path, columns, descending, since, until):
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -1,174 +1,156 @@
-import os
-from langchain.chat_models import init_chat_model
-from dotenv import load_dotenv
-
-from seed_invoices import INVOICE_DB_PATH
-
-load_dotenv()
-
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-
-llm = init_chat_model("gpt-4.1-mini")
-
-from langchain_community.utilities import SQLDatabase
-
-db = SQLDatabase.from_uri(f"sqlite:///{INVOICE_DB_PATH}")
-
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
+"""
+Batch question runner for the SQL agent.
 
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+Runs every question in a file (one per line; blank lines and `#` comments are
+skipped) through the compiled agent with a thread pool, and writes one JSON
+line per question as it finishes: the answer, the SQL that was executed, the
+wall time, and prompt-token figures for the query results. Useful as a
+regression set for prompt changes and as a throughput check.
 
-tools = toolkit.get_tools()
+Usage:
 
-for tool in tools:
-    print(f"{tool.name}: {tool.description}\n")
+    python main.py questions.txt --out answers.jsonl --parallel 4
+    echo "when was the last time i ate pizza" | python main.py -
+    python main.py questions.txt --graph agent.png   # also render the graph
+"""
 
-from typing import Literal
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, TextIO
 
+from dotenv import load_dotenv
+from langchain.chat_models import init_chat_model
 from langchain.messages import AIMessage
-from langchain_core.runnables import RunnableConfig
-from langgraph.graph import END, START, MessagesState, StateGraph
-from langgraph.prebuilt import ToolNode
-
-
-get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
-get_schema_node = ToolNode([get_schema_tool], name="get_schema")
-
-run_query_tool = next(tool for tool in tools if tool.name == "sql_db_query")
-run_query_node = ToolNode([run_query_tool], name="run_query")
-
-
-# Example: create a predetermined tool call
-def list_tables(state: MessagesState):
-    tool_call = {
-        "name": "sql_db_list_tables",
-        "args": {},
-        "id": "abc123",
-        "type": "tool_call",
-    }
-    tool_call_message = AIMessage(content="", tool_calls=[tool_call])
 
-    list_tables_tool = next(tool for tool in tools if tool.name == "sql_db_list_tables")
-    tool_message = list_tables_tool.invoke(tool_call)
-    response = AIMessage(f"Available tables: {tool_message.content}")
-
-    return {"messages": [tool_call_message, tool_message, response]}
-
-
-# Example: force a model to create a tool call
-def call_get_schema(state: MessagesState):
-    # Note that LangChain enforces that all models accept `tool_choice="any"`
-    # as well as `tool_choice=<string name of tool>`.
-    llm_with_tools = llm.bind_tools([get_schema_tool], tool_choice="any")
-    response = llm_with_tools.invoke(state["messages"])
-
-    return {"messages": [response]}
-
-
-generate_query_system_prompt = """
-You are an agent designed to interact with a SQL database.
-Given an input question, create a syntactically correct {dialect} query to run,
-then look at the results of the query and return the answer. Unless the user
-specifies a specific number of examples they wish to obtain, always limit your
-query to at most {top_k} results.
-
-You can order the results by a relevant column to return the most interesting
-examples in the database. Never query for all the columns from a specific table,
-only ask for the relevant columns given the question.
-
-DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
-""".format(
-    dialect=db.dialect,
-    top_k=5,
-)
-
-
-def generate_query(state: MessagesState):
-    system_message = {
-        "role": "system",
-        "content": generate_query_system_prompt,
+from agent import build_agent, result_savings
+from databases import DatabaseRegistry, default_specs
+from vector_index import VectorIndex
+
+
+def read_questions(stream: TextIO) -> List[str]:
+    questions = []
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            questions.append(line)
+    return questions
+
+
+def executed_sql(messages: List[Any]) -> List[str]:
+    """The checked queries the agent ran, in order."""
+    return [
+        call["args"].get("query", "")
+        for message in messages
+        if isinstance(message, AIMessage)
+        for call in message.tool_calls
+        if call["name"] == "sql_db_query"
+    ]
+
+
+def answer_question(
+    agent: Any, index: int, question: str, database: Optional[str] = None
+) -> Dict[str, Any]:
+    """Run one question on its own thread id; errors are recorded, not raised."""
+    record: Dict[str, Any] = {"index": index, "question": question}
+    started = time.perf_counter()
+    try:
+        state = agent.invoke(
+            {
+                "messages": [{"role": "user", "content": question}],
+                "requested_database": database,
+            },
+            config={"configurable": {"thread_id": uuid.uuid4().hex}},
+        )
+        messages = state["messages"]
+        record["database"] = state["database"]
+        content = messages[-1].content
+        record["answer"] = content if isinstance(content, str) else str(content)
+        record["sql"] = executed_sql(messages)
+        record["result_tokens"] = result_savings(messages)
+    except Exception as exc:
+        record["error"] = f"{type(exc).__name__}: {exc}"
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_questions(
+    agent: Any,
+    questions: List[str],
+    out: TextIO,
+    parallel: int = 4,
+    database: Optional[str] = None,
+) -> Dict[str, float]:
+    """Answer `questions` concurrently, writing JSONL in completion order."""
+    started = time.perf_counter()
+    latencies: List[float] = []
+    errors = 0
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        futures = [
+            pool.submit(answer_question, agent, index, question, database)
+            for index, question in enumerate(questions)
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            latencies.append(record["seconds"])
+            errors += "error" in record
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "questions": len(questions),
+        "errors": errors,
+        "wall_seconds": round(elapsed, 3),
+        "questions_per_minute": round(len(questions) / elapsed * 60, 2) if elapsed else 0.0,
+        "p50_seconds": latencies[len(latencies) // 2] if latencies else 0.0,
+        "max_seconds": latencies[-1] if latencies else 0.0,
     }
-    # We do not force a tool call here, to allow the model to
-    # respond naturally when it obtains the solution.
-    llm_with_tools = llm.bind_tools([run_query_tool])
-    response = llm_with_tools.invoke([system_message] + state["messages"])
 
-    return {"messages": [response]}
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("questions", help="File with one question per line, or - for stdin.")
+    parser.add_argument("--out", default="-", help="JSONL output file (default: stdout).")
+    parser.add_argument("--parallel", type=int, default=4, help="Questions in flight at once.")
+    parser.add_argument(
+        "--database", help="Registered database to ask (default: route each question)."
+    )
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    parser.add_argument("--graph", metavar="PNG", help="Also write the agent graph as a Mermaid PNG.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+
+    registry = DatabaseRegistry(default_specs())
+    if args.database and args.database not in registry.specs:
+        parser.error(f"unknown database {args.database!r}; registered: {', '.join(registry.names)}")
+    agent = build_agent(
+        registry, init_chat_model(args.model), semantic_indexes={"invoices": VectorIndex().open()}
+    )
+    if args.graph:
+        with open(args.graph, "wb") as fh:
+            fh.write(agent.get_graph().draw_mermaid_png())
+
+    if args.questions == "-":
+        questions = read_questions(sys.stdin)
+    else:
+        with open(args.questions, encoding="utf-8") as fh:
+            questions = read_questions(fh)
 
-check_query_system_prompt = """
-You are a SQL expert with a strong attention to detail.
-Double check the {dialect} query for common mistakes, including:
-- Using NOT IN with NULL values
-- Using UNION when UNION ALL should have been used
-- Using BETWEEN for exclusive ranges
-- Data type mismatch in predicates
-- Properly quoting identifiers
-- Using the correct number of arguments for functions
-- Casting to the correct data type
-- Using the proper columns for joins
-
-If there are any of the above mistakes, rewrite the query. If there are no mistakes,
-just reproduce the original query.
-
-You will call the appropriate tool to execute the query after running this check.
-""".format(dialect=db.dialect)
-
-
-def check_query(state: MessagesState):
-    system_message = {
-        "role": "system",
-        "content": check_query_system_prompt,
-    }
-
-    # Generate an artificial user message to check
-    tool_call = state["messages"][-1].tool_calls[0]
-    user_message = {"role": "user", "content": tool_call["args"]["query"]}
-    llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
-    response = llm_with_tools.invoke([system_message, user_message])
-    response.id = state["messages"][-1].id
+    if args.out == "-":
+        summary = run_questions(agent, questions, sys.stdout, args.parallel, args.database)
+    else:
+        with open(args.out, "w", encoding="utf-8") as out:
+            summary = run_questions(agent, questions, out, args.parallel, args.database)
+    print(json.dumps(summary), file=sys.stderr)
 
-    return {"messages": [response]}
 
-def should_continue(state: MessagesState) -> Literal[END, "check_query"]:
-    messages = state["messages"]
-    last_message = messages[-1]
-    if not last_message.tool_calls:
-        return END
-    else:
-        return "check_query"
-
-
-builder = StateGraph(MessagesState)
-builder.add_node(list_tables)
-builder.add_node(call_get_schema)
-builder.add_node(get_schema_node, "get_schema")
-builder.add_node(generate_query)
-builder.add_node(check_query)
-builder.add_node(run_query_node, "run_query")
-
-builder.add_edge(START, "list_tables")
-builder.add_edge("list_tables", "call_get_schema")
-builder.add_edge("call_get_schema", "get_schema")
-builder.add_edge("get_schema", "generate_query")
-builder.add_conditional_edges(
-    "generate_query",
-    should_continue,
-)
-builder.add_edge("check_query", "run_query")
-builder.add_edge("run_query", "generate_query")
-
-agent = builder.compile()
-
-from IPython.display import Image, display
-from langchain_core.runnables.graph import CurveStyle, MermaidDrawMethod, NodeStyles
-
-display(Image(agent.get_graph().draw_mermaid_png()))
-
-question = "when was the last time i eat pizza"
-
-for step in agent.stream(
-    {"messages": [{"role": "user", "content": question}]},
-    stream_mode="values",
-):
-    step["messages"][-1].pretty_print()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
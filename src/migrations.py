@@ -0,0 +1,232 @@
+"""
+Ordered schema migrations for the invoices database.
+
+Each migration is a function taking an open connection. The index of the last
+applied migration is kept in `PRAGMA user_version`, so `apply_migrations` is
+cheap to call on every startup and only runs what a given file is missing.
+Migrations run after the base `invoices` table exists, must be idempotent (a
+crash can leave one applied but unrecorded) and must backfill any derived data
+they introduce.
+"""
+
+import sqlite3
+from typing import Callable, List
+
+from fx import load_fx_rates, recompute_base_totals
+from vendors import assign_missing_vendor_ids
+
+
+FTS_TABLE = "invoices_fts"
+FTS_COLUMNS = (
+    "products_services",
+    "seller_information",
+    "invoice_notes",
+    "shipping_address",
+    "billing_address",
+)
+
+CHANGES_TABLE = "invoice_changes"
+CONSUMERS_TABLE = "change_feed_consumers"
+QUARANTINE_TABLE = "invoice_quarantine"
+
+
+def _add_page_hash_table(conn: sqlite3.Connection) -> None:
+    """Perceptual hashes of ingested pages, used by pre-OCR duplicate screening."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS invoice_page_hashes (
+            phash TEXT NOT NULL,
+            invoice_number TEXT,
+            filename TEXT
+        );
+        """
+    )
+
+
+def _add_fts_index(conn: sqlite3.Connection) -> None:
+    """Full-text index over the free-text invoice columns, kept in sync by triggers."""
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {columns},
+            content='invoices',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_ai AFTER INSERT ON invoices BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_ad AFTER DELETE ON invoices BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_au AFTER UPDATE ON invoices BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});
+        END;
+
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild');
+        """
+    )
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table});")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration};")
+
+
+def _narrow_fts_update_trigger(conn: sqlite3.Connection) -> None:
+    """Only re-index an invoice when one of its indexed text columns changes."""
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    conn.executescript(
+        f"""
+        DROP TRIGGER IF EXISTS invoices_fts_au;
+        CREATE TRIGGER invoices_fts_au AFTER UPDATE OF {columns} ON invoices BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});
+        END;
+        """
+    )
+
+
+def _add_vendors(conn: sqlite3.Connection) -> None:
+    """`vendors` dimension plus an indexed `invoices.vendor_id`, backfilled."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS vendors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            canonical_key TEXT NOT NULL UNIQUE,
+            display_name TEXT NOT NULL
+        );
+        """
+    )
+    _add_column(conn, "invoices", "vendor_id", "INTEGER REFERENCES vendors(id)")
+    # grand_total is included so per-vendor totals are answered from the index.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invoices_vendor ON invoices (vendor_id, grand_total);"
+    )
+    assign_missing_vendor_ids(conn)
+
+
+def _add_base_currency_totals(conn: sqlite3.Connection) -> None:
+    """`fx_rates` table and a precomputed, indexed `invoices.grand_total_base`."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency TEXT NOT NULL,
+            effective_date DATE NOT NULL,
+            usd_per_unit NUMERIC NOT NULL,
+            PRIMARY KEY (currency, effective_date)
+        );
+        """
+    )
+    _add_column(conn, "invoices", "grand_total_base", "NUMERIC")
+    # Covering indexes for the date-ranged and per-vendor base-currency SUMs.
+    conn.executescript(
+        """
+        DROP INDEX IF EXISTS idx_invoices_vendor;
+        CREATE INDEX IF NOT EXISTS idx_invoices_vendor_base
+            ON invoices (vendor_id, grand_total_base);
+        CREATE INDEX IF NOT EXISTS idx_invoices_date_base
+            ON invoices (invoice_date, grand_total_base);
+        """
+    )
+    load_fx_rates(conn)
+    recompute_base_totals(conn, only_missing=False)
+
+
+def _add_change_feed(conn: sqlite3.Connection) -> None:
+    """Append-only `invoice_changes` log fed by triggers; see changes.py."""
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS {CONSUMERS_TABLE} (
+            name TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TRIGGER IF NOT EXISTS invoices_changes_ai AFTER INSERT ON invoices BEGIN
+            INSERT INTO {CHANGES_TABLE} (invoice_id, op) VALUES (new.id, 'insert');
+        END;
+        CREATE TRIGGER IF NOT EXISTS invoices_changes_au AFTER UPDATE ON invoices BEGIN
+            INSERT INTO {CHANGES_TABLE} (invoice_id, op) VALUES (new.id, 'update');
+        END;
+        CREATE TRIGGER IF NOT EXISTS invoices_changes_ad AFTER DELETE ON invoices BEGIN
+            INSERT INTO {CHANGES_TABLE} (invoice_id, op) VALUES (old.id, 'delete');
+        END;
+        """
+    )
+    # Existing rows enter the log as inserts, so a consumer starting from
+    # sequence 0 sees the whole table exactly once.
+    (logged,) = conn.execute(f"SELECT COUNT(*) FROM {CHANGES_TABLE};").fetchone()
+    if not logged:
+        conn.execute(
+            f"INSERT INTO {CHANGES_TABLE} (invoice_id, op) "
+            "SELECT id, 'insert' FROM invoices ORDER BY id;"
+        )
+
+
+def _add_quarantine(conn: sqlite3.Connection) -> None:
+    """
+    Invoices held back by ingestion validation, plus the (vendor, date) index
+    its duplicate check looks up; see validation.py.
+    """
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_number TEXT,
+            reasons TEXT NOT NULL,
+            invoice TEXT NOT NULL,
+            quarantined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_invoices_vendor_date
+            ON invoices (vendor_id, invoice_date);
+        """
+    )
+
+
+def _add_listing_index(conn: sqlite3.Connection) -> None:
+    """The (date, id) order of keyset-paginated listings; see listing.py."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invoices_listing ON invoices (IFNULL(invoice_date, ''), id);"
+    )
+
+
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _add_page_hash_table,
+    _add_fts_index,
+    _narrow_fts_update_trigger,
+    _add_vendors,
+    _add_base_currency_totals,
+    _add_change_feed,
+    _add_quarantine,
+    _add_listing_index,
+]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations in order and return how many ran."""
+    (version,) = conn.execute("PRAGMA user_version;").fetchone()
+    pending = MIGRATIONS[version:]
+    for offset, migration in enumerate(pending, start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {offset};")
+        conn.commit()
+    return len(pending)
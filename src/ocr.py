@@ -7,16 +7,33 @@ depends on boto3, Streamlit, or an external database helper module.
 """
 
 import base64
+import json
 import os
-from io import BytesIO
-from typing import Any, Dict
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 import sqlite3
 from dotenv import load_dotenv
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path
+from PIL import Image, ImageStat, UnidentifiedImageError
 
+from ocr_parser import (
+    INVOICE_FIELDS,
+    REQUIRED_FIELDS,
+    InvoiceExtraction,
+    InvoiceField,
+    InvoiceStreamParser,
+    build_prompt,
+    response_format,
+)
+from archive import archived_numbers
+from fx import FxConverter
 from seed_invoices import INVOICE_DB_PATH
+from validation import quarantine, required_flags, take_quarantined, validate_batch
+from vendors import VendorResolver
 
 
 load_dotenv()
@@ -25,71 +42,267 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_URL = "https://api.openai.com/v1/chat/completions"
 
 
+# Read size for chunked base64 encoding; a multiple of 3 so chunks concatenate
+# into one valid base64 string without padding in the middle.
+_BASE64_CHUNK_BYTES = 3 * 256 * 1024
+
+
+def _base64_file(path: str) -> str:
+    """
+    Base64-encode a file chunk by chunk, never holding its raw bytes whole.
+
+    This is not bounded memory: the result is 4/3 of the image, and the
+    chunks and the joined string coexist for a moment (about 2.7x the image
+    at peak, see `python benchmarks.py upload-memory`). The JSON request body
+    built from it for the vision call copies it again, about 4x the image in
+    all while a request is being sent. What bounds memory per
+    upload is the size of the page image, i.e. MAX_UPLOAD_FILE_BYTES for an
+    image or the rendered first page of a PDF.
+    """
+    parts: List[str] = []
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(_BASE64_CHUNK_BYTES)
+            if not chunk:
+                break
+            parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+
+@contextmanager
+def _rasterized(path: str, filename: str) -> Iterator[str]:
+    """
+    Yield the path of an image to send for OCR.
+
+    PDFs are rasterized by pdftoppm straight to a temporary PNG (first page
+    only), so neither the PDF nor the rendered page is loaded into Python.
+    Other files are yielded unchanged.
+    """
+    if not filename.lower().endswith(".pdf"):
+        yield path
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pages = convert_from_path(
+            path,
+            dpi=300,
+            first_page=1,
+            last_page=1,
+            fmt="png",
+            output_folder=tmp_dir,
+            paths_only=True,
+        )
+        if not pages:
+            raise ValueError(f"{filename} has no pages to rasterize")
+        yield pages[0]
+
+
+def _file_to_base64_image(path: str, filename: str) -> str:
+    """Convert a PDF/image on disk to a base64-encoded PNG/JPEG string."""
+    with _rasterized(path, filename) as image_path:
+        return _base64_file(image_path)
+
+
 def _file_bytes_to_base64_image(file_bytes: bytes, filename: str) -> str:
     """Convert PDF/image bytes to a base64-encoded PNG/JPEG string."""
-    lower = filename.lower()
-    if lower.endswith(".pdf"):
-        images = convert_from_bytes(file_bytes, dpi=300)
-        img_byte_arr = BytesIO()
-        images[0].save(img_byte_arr, format="PNG")
-        img_bytes = img_byte_arr.getvalue()
-    else:
-        img_bytes = file_bytes
-
-    return base64.b64encode(img_bytes).decode("utf-8")
-
-
-_PROMPT = """Perform OCR on the given image and extract the following key invoice attributes.
-Format your response as `[serial no.]. [key]: [value]`. If an attribute is not present, use `NULL`.
-Convert any percentages to numeric (Example: 20% = 0.2). Provide prices only as numerics, without currency.
-Do not provide any additional text or explanations.
-
-1. invoice_number: The unique identifier for this invoice. (TEXT)
-2. invoice_date: The date the invoice was issued (format: YYYY-MM-DD). (DATE)
-3. due_date: The date by which payment is expected (format: YYYY-MM-DD). (DATE)
-4. seller_information: Full name, address, and contact details of the seller. (TEXT)
-5. buyer_information: Full name, address, and contact details of the buyer. (TEXT)
-6. purchase_order_number: The buyer's purchase order number, if available. (TEXT)
-7. products_services: Comma-separated list of all items or services billed. Do not include services like shipping. (TEXT)
-8. quantities: Comma-separated list of quantities for each item, in the same order as the products/services. Do not include commas in each quantity itself. (INTEGER)
-9. unit_prices: Comma-separated list of unit prices for each item, in the same order as the products/services. Do not include commas in each unit price itself. (NUMERIC)
-10. subtotal: The sum of all line items before taxes and discounts. Do not include any commas in the subtotal. (NUMERIC)
-11. service_charges: Any additional charges that may be applied. Do not include shipping costs here. Do not include any commas in the service charge. (NUMERIC)
-12. net_total: Sum of subtotal and service charges. Do not include any commas in the net total. (NUMERIC)
-13. discount: Any discounts applied to the invoice. Do not include any commas in the discount. (TEXT)
-14. tax: The total amount of tax charged. Do not include any commas in the tax. (NUMERIC)
-15. tax_rate: The percentage rate at which tax is charged. Do not include any commas in the tax rate. (TEXT)
-16. shipping_costs: Any shipping or delivery charges. Do not include any commas in the shipping costs. (NUMERIC)
-17. grand_total: The final amount to be paid, including all taxes and fees. Do not include any commas in the grand total. (NUMERIC)
-18. currency: The currency in which the invoice is issued (INR, USD, SGD, AUD, etc). (TEXT)
-19. payment_terms: The terms of payment (e.g., "Net 30", "Due on Receipt"). (TEXT)
-20. payment_method: Accepted or preferred payment methods. (TEXT)
-21. bank_information: Seller's bank details for payment, if provided. (TEXT)
-22. invoice_notes: Any additional notes or terms on the invoice. (TEXT)
-23. shipping_address: The delivery address. (TEXT)
-24. billing_address: The billing address. (TEXT)
-"""
+    suffix = os.path.splitext(filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as spool:
+        spool.write(file_bytes)
+        spool.flush()
+        return _file_to_base64_image(spool.name, filename)
 
 
-def extract_invoice_fields(file_bytes: bytes, filename: str) -> Dict[str, str]:
-    """Call OpenAI vision to extract structured invoice fields from a file."""
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set")
+def encode_invoice_file(path: str) -> str:
+    """Read an invoice PDF/image from disk and return it base64-encoded."""
+    return _file_to_base64_image(path, os.path.basename(path))
+
+
+# Pre-OCR screening. Every vision call is paid for, so blank scans and photos
+# are rejected locally from cheap image statistics before any network request
+# is made, and pages that look like one already stored are flagged.
+
+_SCREEN_SIZE = (256, 256)
+# Luminance standard deviation below which a page is considered blank.
+BLANK_STDDEV_THRESHOLD = 4.0
+# Share of "ink" (dark) pixels below which a page is considered blank.
+BLANK_INK_RATIO = 0.002
+# Photos have little paper-white background and strongly saturated colour.
+PHOTO_MAX_WHITE_RATIO = 0.2
+PHOTO_MIN_SATURATION = 70.0
+# Side of the difference-hash grid (256-bit hash). Invoices from one vendor
+# share a template, so the hash must be fine enough to see the text differ.
+_HASH_SIZE = 16
+# dHash Hamming distance at or below which two pages may be the same scan.
+# Distinct invoices on one template are only a few bits apart, so a match is
+# only a suspicion: the page is still read, and dropped only when it carries
+# the invoice number stored for the matching page.
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "2"))
+# At or below this distance the page is taken to be the stored one and
+# skipped before OCR. 0 (an identical 256-bit hash) is what re-uploading the
+# same file or re-exporting the same PDF gives; -1 always reads the page.
+DUPLICATE_SKIP_DISTANCE = int(os.getenv("DUPLICATE_SKIP_DISTANCE", "0"))
+
+
+class SkippedInvoice(Exception):
+    """Raised when screening decides a file is not worth an OCR call."""
+
+    def __init__(self, filename: str, reason: str) -> None:
+        super().__init__(f"{filename}: {reason}")
+        self.filename = filename
+        self.reason = reason
+
+
+@dataclass
+class ScreeningResult:
+    phash: Optional[int]
+    skip_reason: Optional[str] = None
+    # The known hash this page is within DUPLICATE_MAX_DISTANCE of, and how far.
+    near_duplicate_of: Optional[int] = None
+    distance: Optional[int] = None
+
+
+def _dhash(gray: Image.Image) -> int:
+    """Difference hash (`_HASH_SIZE` squared bits) of a grayscale image."""
+    width = _HASH_SIZE + 1
+    small = gray.resize((width, _HASH_SIZE), Image.Resampling.LANCZOS)
+    # One byte per pixel in mode L, row-major.
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(_HASH_SIZE):
+        for col in range(_HASH_SIZE):
+            left = pixels[row * width + col]
+            right = pixels[row * width + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def screen_image(image_path: str, known_hashes: Iterable[int] = ()) -> ScreeningResult:
+    """
+    Classify a page image from local statistics alone.
+
+    Returns the page's perceptual hash, the closest of `known_hashes` it
+    nearly matches, and, when the page should not be sent for OCR, the
+    reason: unreadable, blank, or a photo rather than a document.
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft("RGB", _SCREEN_SIZE)
+            rgb = img.convert("RGB")
+    except (UnidentifiedImageError, OSError) as exc:
+        return ScreeningResult(phash=None, skip_reason=f"not a readable image ({exc})")
+    rgb.thumbnail(_SCREEN_SIZE)
+    gray = rgb.convert("L")
+
+    histogram = gray.histogram()
+    total = sum(histogram) or 1
+    ink_ratio = sum(histogram[:128]) / total
+    white_ratio = sum(histogram[225:]) / total
+    stddev = ImageStat.Stat(gray).stddev[0]
+    if stddev < BLANK_STDDEV_THRESHOLD or ink_ratio < BLANK_INK_RATIO:
+        return ScreeningResult(phash=None, skip_reason="blank page")
+
+    saturation = ImageStat.Stat(rgb.convert("HSV")).mean[1]
+    if white_ratio < PHOTO_MAX_WHITE_RATIO and saturation > PHOTO_MIN_SATURATION:
+        return ScreeningResult(phash=None, skip_reason="photo, not a document")
+
+    phash = _dhash(gray)
+    distance, nearest = min(
+        (((phash ^ known).bit_count(), known) for known in known_hashes), default=(None, None)
+    )
+    if distance is not None and distance <= DUPLICATE_MAX_DISTANCE:
+        return ScreeningResult(phash=phash, near_duplicate_of=nearest, distance=distance)
+    return ScreeningResult(phash=phash)
+
+
+def load_page_hashes() -> Dict[int, Optional[str]]:
+    """Perceptual hash -> invoice_number of every invoice page stored so far."""
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        rows = conn.execute("SELECT phash, invoice_number FROM invoice_page_hashes;").fetchall()
+    finally:
+        conn.close()
+    return {int(value, 16): number for value, number in rows}
+
+
+def record_page_hashes(entries: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+    """Remember `(phash, invoice_number, filename)` of stored (not quarantined) pages."""
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        conn.executemany(
+            "INSERT INTO invoice_page_hashes (phash, invoice_number, filename) VALUES (?, ?, ?);",
+            ((format(phash, "x"), number, name) for phash, number, name in entries),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def screen_and_encode(
+    path: str, filename: str, known_hashes: Dict[int, Optional[str]]
+) -> Tuple[str, int, Optional[str]]:
+    """
+    Rasterize once, screen the page and return `(base64_image, phash,
+    duplicate_of)`, where `duplicate_of` is the invoice number stored for a
+    near-identical page in `known_hashes` (see `is_duplicate_page`).
+
+    Raises SkippedInvoice when the page should not be sent for OCR, including
+    a page within DUPLICATE_SKIP_DISTANCE of a stored one.
+    """
+    with _rasterized(path, filename) as image_path:
+        result = screen_image(image_path, known_hashes)
+        if result.skip_reason:
+            raise SkippedInvoice(filename, result.skip_reason)
+        duplicate_of = None
+        if result.near_duplicate_of is not None:
+            duplicate_of = known_hashes[result.near_duplicate_of]
+            if result.distance <= DUPLICATE_SKIP_DISTANCE:
+                raise SkippedInvoice(filename, f"duplicate of stored invoice {duplicate_of}")
+        return _base64_file(image_path), result.phash, duplicate_of
+
+
+def is_duplicate_page(duplicate_of: Optional[str], invoice: Dict[str, Any]) -> bool:
+    """A near-identical page that also reads as the same invoice number."""
+    return duplicate_of is not None and invoice.get("invoice_number") == duplicate_of
 
-    base64_image = _file_bytes_to_base64_image(file_bytes, filename)
 
+def _stream_chat_completion(payload: Dict[str, Any]) -> Iterator[str]:
+    """POST a streaming chat completion and yield the content deltas."""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {OPENAI_API_KEY}",
     }
+    with requests.post(
+        OPENAI_URL,
+        headers=headers,
+        json={**payload, "stream": True},
+        timeout=90,
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        for raw_line in response.iter_lines(decode_unicode=True):
+            if not raw_line or not raw_line.startswith("data: "):
+                continue
+            data = raw_line[len("data: ") :]
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    yield delta
 
-    payload: Dict[str, Any] = {
+
+def build_extraction_payload(
+    base64_image: str, fields: List[InvoiceField] = INVOICE_FIELDS
+) -> Dict[str, Any]:
+    """Chat-completions request body asking the vision model for `fields`."""
+    return {
         "model": "gpt-4o",
+        "response_format": response_format(fields),
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": _PROMPT},
+                    {"type": "text", "text": build_prompt(fields)},
                     {
                         "type": "image_url",
                         "image_url": {
@@ -101,34 +314,98 @@ def extract_invoice_fields(file_bytes: bytes, filename: str) -> Dict[str, str]:
         ],
     }
 
-    response = requests.post(OPENAI_URL, headers=headers, json=payload, timeout=90)
-    response.raise_for_status()
-    data = response.json()
-    content = data["choices"][0]["message"]["content"]
-
-    invoice: Dict[str, str] = {}
-    for raw_line in content.splitlines():
-        line = raw_line.strip()
-        if ": " not in line:
-            continue
-        # Strip leading serial number, e.g. "1. invoice_number: 123"
-        try:
-            substring = line[line.find(" ") + 1 :]
-            key, value = substring.split(": ", 1)
-        except ValueError:
-            continue
-        invoice[key.strip()] = value.strip()
 
-    return invoice
+def _request_fields(base64_image: str, fields: List[InvoiceField]) -> InvoiceExtraction:
+    """Ask the vision model for `fields` and parse the streamed JSON answer."""
+    payload = build_extraction_payload(base64_image, fields)
+    parser = InvoiceStreamParser(fields)
+    for delta in _stream_chat_completion(payload):
+        parser.feed(delta)
+    return parser.close()
 
 
-def insert_invoice_into_db(invoice: Dict[str, str]) -> None:
-    """Insert a single invoice row into the local SQLite invoices table."""
-    conn = sqlite3.connect(INVOICE_DB_PATH)
-    cursor = conn.cursor()
+def _extract_from_base64(base64_image: str) -> InvoiceExtraction:
+    """
+    Call OpenAI vision to extract typed invoice fields from an encoded image.
+
+    Fields that come back absent or un-coercible, and required fields that
+    come back null, are re-requested once, on their own, instead of re-running
+    the whole extraction.
+    """
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+
+    extraction = _request_fields(base64_image, INVOICE_FIELDS)
+    extraction.require(REQUIRED_FIELDS)
+    if extraction.failed:
+        retry_fields = [f for f in INVOICE_FIELDS if f.name in extraction.failed]
+        extraction.merge(_request_fields(base64_image, retry_fields))
+    return extraction
+
+
+def extract_invoice(file_bytes: bytes, filename: str) -> InvoiceExtraction:
+    """Extract typed invoice fields from in-memory file bytes."""
+    return _extract_from_base64(_file_bytes_to_base64_image(file_bytes, filename))
+
+
+def extract_invoice_from_path(path: str, filename: str) -> InvoiceExtraction:
+    """Extract typed invoice fields from a file on disk."""
+    return _extract_from_base64(_file_to_base64_image(path, filename))
+
+
+def extract_invoice_fields(file_bytes: bytes, filename: str) -> Dict[str, Any]:
+    """Call OpenAI vision to extract structured invoice fields from a file."""
+    return extract_invoice(file_bytes, filename).fields
+
+
+_INSERT_COLUMNS = (
+    "invoice_number",
+    "invoice_date",
+    "due_date",
+    "seller_information",
+    "buyer_information",
+    "purchase_order_number",
+    "products_services",
+    "quantities",
+    "unit_prices",
+    "subtotal",
+    "service_charges",
+    "net_total",
+    "discount",
+    "tax",
+    "tax_rate",
+    "shipping_costs",
+    "grand_total",
+    "currency",
+    "payment_terms",
+    "payment_method",
+    "bank_information",
+    "invoice_notes",
+    "shipping_address",
+    "billing_address",
+    "vendor_id",
+    "grand_total_base",
+)
+
+# Stored as 0 when missing; validated as extracted, so a missing amount is
+# told apart from a zero one.
+_AMOUNT_COLUMNS = ("subtotal", "service_charges", "net_total", "tax", "shipping_costs", "grand_total")
+
+_INSERT_SQL = """
+    INSERT {{conflict}}INTO invoices ({columns}) VALUES ({placeholders});
+""".format(columns=", ".join(_INSERT_COLUMNS), placeholders=", ".join("?" * len(_INSERT_COLUMNS)))
+
+
+def _invoice_row(
+    invoice: Dict[str, Any], vendor_id: Optional[int], fx: FxConverter
+) -> Tuple[Any, ...]:
+    """Map an extracted invoice dict onto the `invoices` column order."""
 
     def _num(name: str) -> float:
-        val = (invoice.get(name) or "").strip()
+        val = invoice.get(name)
+        if isinstance(val, (int, float)):
+            return float(val)
+        val = (val or "").strip()
         if not val or val.upper() == "NULL":
             return 0.0
         try:
@@ -136,76 +413,207 @@ def insert_invoice_into_db(invoice: Dict[str, str]) -> None:
         except ValueError:
             return 0.0
 
-    cursor.execute(
-        """
-        INSERT INTO invoices (
-            invoice_number,
-            invoice_date,
-            due_date,
-            seller_information,
-            buyer_information,
-            purchase_order_number,
-            products_services,
-            quantities,
-            unit_prices,
-            subtotal,
-            service_charges,
-            net_total,
-            discount,
-            tax,
-            tax_rate,
-            shipping_costs,
-            grand_total,
-            currency,
-            payment_terms,
-            payment_method,
-            bank_information,
-            invoice_notes,
-            shipping_address,
-            billing_address
-        ) VALUES (
-            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-        );
-        """,
-        (
-            invoice.get("invoice_number"),
-            invoice.get("invoice_date"),
-            invoice.get("due_date"),
-            invoice.get("seller_information"),
-            invoice.get("buyer_information"),
-            invoice.get("purchase_order_number"),
-            invoice.get("products_services"),
-            invoice.get("quantities"),
-            invoice.get("unit_prices"),
-            _num("subtotal"),
-            _num("service_charges"),
-            _num("net_total"),
-            invoice.get("discount"),
-            _num("tax"),
-            invoice.get("tax_rate"),
-            _num("shipping_costs"),
-            _num("grand_total"),
-            invoice.get("currency"),
-            invoice.get("payment_terms"),
-            invoice.get("payment_method"),
-            invoice.get("bank_information"),
-            invoice.get("invoice_notes"),
-            invoice.get("shipping_address"),
-            invoice.get("billing_address"),
-        ),
+    return (
+        invoice.get("invoice_number"),
+        invoice.get("invoice_date"),
+        invoice.get("due_date"),
+        invoice.get("seller_information"),
+        invoice.get("buyer_information"),
+        invoice.get("purchase_order_number"),
+        invoice.get("products_services"),
+        invoice.get("quantities"),
+        invoice.get("unit_prices"),
+        _num("subtotal"),
+        _num("service_charges"),
+        _num("net_total"),
+        invoice.get("discount"),
+        _num("tax"),
+        invoice.get("tax_rate"),
+        _num("shipping_costs"),
+        _num("grand_total"),
+        invoice.get("currency"),
+        invoice.get("payment_terms"),
+        invoice.get("payment_method"),
+        invoice.get("bank_information"),
+        invoice.get("invoice_notes"),
+        invoice.get("shipping_address"),
+        invoice.get("billing_address"),
+        vendor_id,
+        fx.to_base(_num("grand_total"), invoice.get("currency"), invoice.get("invoice_date")),
     )
 
-    conn.commit()
-    conn.close()
+
+@dataclass
+class IngestResult:
+    written: int
+    # (invoice_number, reasons) of each invoice sent to quarantine.
+    quarantined: List[Tuple[Optional[str], List[str]]] = field(default_factory=list)
+    # Positions in the input of invoices skipped as already stored (with
+    # `ignore_duplicates`).
+    ignored: List[int] = field(default_factory=list)
 
 
-def process_invoice_file(file_bytes: bytes, filename: str) -> Dict[str, str]:
+def ingest_invoices(
+    invoices: Iterable[Dict[str, Any]],
+    ignore_duplicates: bool = False,
+    validate: bool = True,
+) -> IngestResult:
+    """
+    Bulk-insert invoices in a single transaction.
+
+    With `ignore_duplicates`, rows whose invoice_number already exists (in
+    the hot table, an archived year or earlier in the batch) are skipped
+    instead of aborting the whole batch, and listed in `ignored`. Each row's seller is
+    resolved to a canonical `vendor_id` in the same transaction, and its
+    `grand_total_base` is computed from the local FX rates. With `validate`,
+    invoices whose totals do not add up or that look like a re-sent copy of
+    another invoice are quarantined instead (see validation.py). Invoices
+    without an invoice_number are always quarantined.
+    """
+    invoices = list(invoices)
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        resolver = VendorResolver(conn)
+        fx = FxConverter(conn)
+        rows = [
+            _invoice_row(invoice, resolver.resolve(invoice.get("seller_information")), fx)
+            for invoice in invoices
+        ]
+        positions = list(range(len(rows)))
+        quarantined = []
+        if rows:
+            checked = [
+                {**dict(zip(_INSERT_COLUMNS, row)), **{name: invoice.get(name) for name in _AMOUNT_COLUMNS}}
+                for invoice, row in zip(invoices, rows)
+            ]
+            flags = validate_batch(conn, checked) if validate else required_flags(checked)
+            accepted = []
+            for position, reasons in enumerate(flags):
+                if reasons:
+                    quarantine(conn, invoices[position], reasons)
+                    quarantined.append((invoices[position].get("invoice_number"), reasons))
+                else:
+                    accepted.append(position)
+            positions = accepted
+        # invoice_number is UNIQUE in each file, not across the archives.
+        archived = archived_numbers(rows[p][0] for p in positions)
+        if archived and not ignore_duplicates:
+            raise sqlite3.IntegrityError(
+                f"UNIQUE constraint failed: invoices.invoice_number (archived: {', '.join(sorted(archived))})"
+            )
+        ignored = [p for p in positions if rows[p][0] in archived]
+        positions = [p for p in positions if rows[p][0] not in archived]
+        # rowcount, unlike total_changes, leaves out the FTS and change-feed
+        # trigger writes.
+        if ignore_duplicates:
+            # One statement per row, to tell which ones OR IGNORE dropped.
+            sql = _INSERT_SQL.format(conflict="OR IGNORE ")
+            written = 0
+            for p in positions:
+                if conn.execute(sql, rows[p]).rowcount:
+                    written += 1
+                else:
+                    ignored.append(p)
+        else:
+            written = conn.executemany(
+                _INSERT_SQL.format(conflict=""), [rows[p] for p in positions]
+            ).rowcount
+        conn.commit()
+        return IngestResult(written=written, quarantined=quarantined, ignored=sorted(ignored))
+    finally:
+        conn.close()
+
+
+def insert_invoices_into_db(
+    invoices: Iterable[Dict[str, Any]], ignore_duplicates: bool = False
+) -> int:
+    """Bulk-insert (and validate) invoices; return the rows written. See `ingest_invoices`."""
+    return ingest_invoices(invoices, ignore_duplicates).written
+
+
+def insert_invoice_into_db(invoice: Dict[str, Any]) -> List[str]:
+    """
+    Insert a single invoice row; returns the quarantine reasons, if any.
+
+    An invoice the database refuses (e.g. an invoice_number that is already
+    stored) is quarantined with the constraint error instead of raising.
+    """
+    try:
+        result = ingest_invoices([invoice])
+    except sqlite3.IntegrityError as exc:
+        reasons = [f"rejected:{exc}"]
+        conn = sqlite3.connect(INVOICE_DB_PATH)
+        try:
+            quarantine(conn, invoice, reasons)
+            conn.commit()
+        finally:
+            conn.close()
+        return reasons
+    return result.quarantined[0][1] if result.quarantined else []
+
+
+def release_quarantined(quarantine_id: int) -> bool:
+    """Insert a quarantined invoice as is, after review; False if not found."""
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        invoice = take_quarantined(conn, quarantine_id)
+        if invoice is None:
+            return False
+        if archived_numbers([invoice.get("invoice_number")]):
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: invoices.invoice_number (archived)")
+        row = _invoice_row(invoice, VendorResolver(conn).resolve(invoice.get("seller_information")), FxConverter(conn))
+        conn.execute(_INSERT_SQL.format(conflict=""), row)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def discard_quarantined(quarantine_id: int) -> bool:
+    """Drop a quarantined invoice for good; False if not found."""
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        found = take_quarantined(conn, quarantine_id) is not None
+        conn.commit()
+        return found
+    finally:
+        conn.close()
+
+
+def process_invoice_file(file_bytes: bytes, filename: str) -> InvoiceExtraction:
     """
     High-level helper:
     - Run OCR & field extraction on the given file bytes.
-    - Insert the invoice into the local SQLite DB.
-    - Return the extracted invoice dictionary.
+    - Insert the invoice into the local SQLite DB (or quarantine it).
+    - Return the extraction (fields plus missing/failed/confidence report).
+    """
+    extraction = extract_invoice(file_bytes, filename)
+    extraction.quarantined = insert_invoice_into_db(extraction.fields)
+    return extraction
+
+
+def process_invoice_path(
+    path: str, filename: str, known_hashes: Optional[Dict[int, Optional[str]]] = None
+) -> InvoiceExtraction:
+    """
+    Like `process_invoice_file`, for an invoice already spooled to disk.
+
+    The file is screened first (see `screen_image`); SkippedInvoice is raised
+    for blank pages, photos and exact duplicates of a stored page without any
+    OCR call, and for a near duplicate that also reads as the invoice stored
+    for it. Pass the same
+    `known_hashes` across a batch to catch duplicates within it; the page is
+    added to it (and to the database's page hashes) once its invoice is stored.
     """
-    invoice = extract_invoice_fields(file_bytes, filename)
-    insert_invoice_into_db(invoice)
-    return invoice
+    if known_hashes is None:
+        known_hashes = load_page_hashes()
+    base64_image, phash, duplicate_of = screen_and_encode(path, filename, known_hashes)
+    extraction = _extract_from_base64(base64_image)
+    if is_duplicate_page(duplicate_of, extraction.fields):
+        raise SkippedInvoice(filename, f"duplicate of stored invoice {duplicate_of}")
+    extraction.quarantined = insert_invoice_into_db(extraction.fields)
+    if not extraction.quarantined:
+        number = extraction.fields.get("invoice_number")
+        record_page_hashes([(phash, number, filename)])
+        known_hashes[phash] = number
+    return extraction
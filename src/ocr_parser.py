@@ -0,0 +1,384 @@
+"""
+Structured-output schema and streaming parser for invoice OCR responses.
+
+The vision model is asked to answer with a JSON object (enforced through the
+OpenAI `json_schema` response format) in which every invoice attribute is an
+object of the form `{"value": ..., "confidence": 0..1}`. `InvoiceStreamParser`
+consumes that object incrementally as the streamed deltas arrive, coerces each
+value to the type the `invoices` table expects and records which fields were
+missing (explicit `null`) or failed (absent, malformed or un-coercible) so the
+caller can re-ask for just those fields.
+"""
+
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+
+class InvoiceField(NamedTuple):
+    name: str
+    kind: str  # text | date | numeric | percent | text_list | integer_list | numeric_list
+    description: str
+
+
+INVOICE_FIELDS: List[InvoiceField] = [
+    InvoiceField("invoice_number", "text", "The unique identifier for this invoice."),
+    InvoiceField("invoice_date", "date", "The date the invoice was issued (YYYY-MM-DD)."),
+    InvoiceField("due_date", "date", "The date by which payment is expected (YYYY-MM-DD)."),
+    InvoiceField("seller_information", "text", "Full name, address, and contact details of the seller."),
+    InvoiceField("buyer_information", "text", "Full name, address, and contact details of the buyer."),
+    InvoiceField("purchase_order_number", "text", "The buyer's purchase order number, if available."),
+    InvoiceField("products_services", "text_list", "All items or services billed. Do not include services like shipping."),
+    InvoiceField("quantities", "integer_list", "Quantity of each item, in the same order as products_services."),
+    InvoiceField("unit_prices", "numeric_list", "Unit price of each item, in the same order as products_services."),
+    InvoiceField("subtotal", "numeric", "The sum of all line items before taxes and discounts."),
+    InvoiceField("service_charges", "numeric", "Any additional charges that may be applied, excluding shipping."),
+    InvoiceField("net_total", "numeric", "Sum of subtotal and service charges."),
+    InvoiceField("discount", "text", "Any discounts applied to the invoice."),
+    InvoiceField("tax", "numeric", "The total amount of tax charged."),
+    InvoiceField("tax_rate", "percent", "The rate at which tax is charged, as a fraction (20% = 0.2)."),
+    InvoiceField("shipping_costs", "numeric", "Any shipping or delivery charges."),
+    InvoiceField("grand_total", "numeric", "The final amount to be paid, including all taxes and fees."),
+    InvoiceField("currency", "text", "The ISO currency code of the invoice (INR, USD, SGD, AUD, etc)."),
+    InvoiceField("payment_terms", "text", 'The terms of payment (e.g., "Net 30", "Due on Receipt").'),
+    InvoiceField("payment_method", "text", "Accepted or preferred payment methods."),
+    InvoiceField("bank_information", "text", "Seller's bank details for payment, if provided."),
+    InvoiceField("invoice_notes", "text", "Any additional notes or terms on the invoice."),
+    InvoiceField("shipping_address", "text", "The delivery address."),
+    InvoiceField("billing_address", "text", "The billing address."),
+]
+
+FIELDS_BY_NAME: Dict[str, InvoiceField] = {f.name: f for f in INVOICE_FIELDS}
+
+# Fields an invoice cannot be stored without (`invoices.invoice_number` is
+# NOT NULL); a null answer for one is re-asked like an un-coercible value.
+REQUIRED_FIELDS = ("invoice_number",)
+
+LOW_CONFIDENCE_THRESHOLD = 0.5
+
+_JSON_TYPES = {
+    "text": {"type": ["string", "null"]},
+    "date": {"type": ["string", "null"]},
+    "numeric": {"type": ["number", "null"]},
+    "percent": {"type": ["number", "null"]},
+    "text_list": {"type": ["array", "null"], "items": {"type": "string"}},
+    "integer_list": {"type": ["array", "null"], "items": {"type": "number"}},
+    "numeric_list": {"type": ["array", "null"], "items": {"type": "number"}},
+}
+
+_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%m-%d-%Y",
+    "%d.%m.%Y",
+    "%m.%d.%Y",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+)
+
+# Day and month, in either order. When both could be a month the date is
+# rejected (and so re-asked) rather than guessed: 03/04/2024 is 3 April on an
+# INR invoice and March 4 on a USD one, and 03.04.2024 is no different.
+_NUMERIC_DATE = re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-]\d{4}$")
+
+_NUMERIC_NOISE = re.compile(r"[^\d.\-]")
+
+_INCOMPLETE = object()
+
+
+def response_format(fields: Iterable[InvoiceField] = INVOICE_FIELDS) -> Dict[str, Any]:
+    """Build the OpenAI `json_schema` response format for the given fields."""
+    properties: Dict[str, Any] = {}
+    for f in fields:
+        properties[f.name] = {
+            "type": "object",
+            "description": f.description,
+            "properties": {
+                "value": _JSON_TYPES[f.kind],
+                "confidence": {"type": "number"},
+            },
+            "required": ["value", "confidence"],
+            "additionalProperties": False,
+        }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "invoice",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def build_prompt(fields: Iterable[InvoiceField] = INVOICE_FIELDS) -> str:
+    """Render the extraction instructions for the given fields."""
+    lines = [
+        "Perform OCR on the given image and extract the following invoice attributes.",
+        "Answer with a JSON object in which every attribute is "
+        '`{"value": ..., "confidence": <0..1>}`. If an attribute is not present, '
+        "use a null value. Provide prices only as numbers, without currency or "
+        "thousands separators. Convert percentages to fractions (20% = 0.2).",
+        "",
+    ]
+    for i, f in enumerate(fields, start=1):
+        lines.append(f"{i}. {f.name}: {f.description}")
+    return "\n".join(lines) + "\n"
+
+
+def _is_null(value: Any) -> bool:
+    if value is None:
+        return True
+    return isinstance(value, str) and value.strip().upper() in ("", "NULL", "N/A")
+
+
+def _to_number(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError(f"expected a number, got {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    negative = text.startswith("(") and text.endswith(")")
+    cleaned = _NUMERIC_NOISE.sub("", text)
+    if not cleaned or cleaned in ("-", "."):
+        raise ValueError(f"expected a number, got {value!r}")
+    number = float(cleaned)
+    return -number if negative else number
+
+
+def _to_date(value: Any) -> str:
+    text = str(value).strip()
+    match = _NUMERIC_DATE.match(text)
+    if match:
+        first, second = int(match.group(1)), int(match.group(2))
+        if first != second and first <= 12 and second <= 12:
+            raise ValueError(f"ambiguous date {value!r} (day and month could be swapped)")
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {value!r}")
+
+
+def _to_percent(value: Any) -> float:
+    if isinstance(value, str) and value.strip().endswith("%"):
+        return _to_number(value.strip()[:-1]) / 100
+    return _to_number(value)
+
+
+def _to_list(value: Any) -> List[Any]:
+    if isinstance(value, list):
+        return value
+    return [part for part in str(value).split(",") if part.strip()]
+
+
+def _format_number(number: float) -> str:
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def coerce_value(f: InvoiceField, value: Any) -> Any:
+    """
+    Coerce a raw JSON value to the representation stored in `invoices`.
+
+    Returns None for missing values and raises ValueError when the value cannot
+    be interpreted as the field's type.
+    """
+    if _is_null(value):
+        return None
+    if f.kind == "date":
+        return _to_date(value)
+    if f.kind == "numeric":
+        return _to_number(value)
+    if f.kind == "percent":
+        return _to_percent(value)
+    if f.kind == "text_list":
+        return ",".join(str(item).replace(",", " ").strip() for item in _to_list(value))
+    if f.kind in ("integer_list", "numeric_list"):
+        numbers = [_to_number(item) for item in _to_list(value)]
+        if f.kind == "integer_list" and any(not n.is_integer() for n in numbers):
+            raise ValueError(f"expected whole quantities, got {value!r}")
+        return ",".join(_format_number(n) for n in numbers)
+    return str(value).strip()
+
+
+@dataclass
+class InvoiceExtraction:
+    """Typed invoice fields plus per-field confidence and failure reporting."""
+
+    fields: Dict[str, Any] = field(default_factory=dict)
+    confidence: Dict[str, Optional[float]] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+    # Ingestion validation reasons; set when the invoice was quarantined.
+    quarantined: List[str] = field(default_factory=list)
+
+    @property
+    def low_confidence(self) -> List[str]:
+        return [
+            name
+            for name, score in self.confidence.items()
+            if score is not None and score < LOW_CONFIDENCE_THRESHOLD
+        ]
+
+    def require(self, names: Iterable[str]) -> None:
+        """Treat `names` as failed when they came back null, so they are re-asked."""
+        for name in names:
+            if name in self.missing:
+                self.missing.remove(name)
+                self.failed[name] = "required field is null"
+
+    def merge(self, other: "InvoiceExtraction") -> None:
+        """Fold in a re-ask result; only fields that `other` resolved are taken."""
+        for name in list(self.failed):
+            if name in other.failed or name not in other.fields:
+                self.failed[name] = other.failed.get(name, self.failed[name])
+                continue
+            del self.failed[name]
+            self.fields[name] = other.fields[name]
+            self.confidence[name] = other.confidence.get(name)
+            if name in other.missing:
+                self.missing.append(name)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "missing": list(self.missing),
+            "failed": dict(self.failed),
+            "low_confidence": self.low_confidence,
+            "quarantined": list(self.quarantined),
+        }
+
+
+class InvoiceStreamParser:
+    """
+    Incremental parser for the streamed JSON object.
+
+    `feed` accepts arbitrary chunks of the response and returns the names of the
+    fields completed by that chunk; `close` returns the final extraction. Values
+    are decoded one top-level member at a time, so a truncated or corrupted tail
+    only loses the fields it contains.
+    """
+
+    def __init__(self, fields: Iterable[InvoiceField] = INVOICE_FIELDS) -> None:
+        self._fields = {f.name: f for f in fields}
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._state = "start"
+        self._key: Optional[str] = None
+        self._result = InvoiceExtraction()
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[str]:
+        self._buf += chunk
+        completed: List[str] = []
+        while self._state not in ("done", "error"):
+            self._buf = self._buf.lstrip()
+            if not self._buf:
+                break
+            if not self._step(completed):
+                break
+        return completed
+
+    def _step(self, completed: List[str]) -> bool:
+        """Consume one token from the buffer; False means more input is needed."""
+        head = self._buf[0]
+        if self._state == "start":
+            return self._expect("{", "key")
+        if self._state == "key":
+            if head == "}":
+                return self._expect("}", "done")
+            decoded = self._decode()
+            if decoded is _INCOMPLETE:
+                return False
+            if not isinstance(decoded, str):
+                self._state = "error"
+                return False
+            self._key = decoded
+            self._state = "colon"
+            return True
+        if self._state == "colon":
+            return self._expect(":", "value")
+        if self._state == "value":
+            decoded = self._decode()
+            if decoded is _INCOMPLETE:
+                return False
+            self._accept(self._key or "", decoded, completed)
+            self._state = "separator"
+            return True
+        if self._state == "separator":
+            if head == ",":
+                return self._expect(",", "key")
+            return self._expect("}", "done")
+        return False
+
+    def _expect(self, char: str, next_state: str) -> bool:
+        if self._buf[0] != char:
+            self._state = "error"
+            return False
+        self._buf = self._buf[1:]
+        self._state = next_state
+        return True
+
+    def _decode(self) -> Any:
+        try:
+            value, end = self._decoder.raw_decode(self._buf)
+        except json.JSONDecodeError:
+            return _INCOMPLETE
+        # A number running to the end of the buffer may still be growing.
+        if end == len(self._buf) and isinstance(value, (int, float)):
+            return _INCOMPLETE
+        self._buf = self._buf[end:]
+        return value
+
+    def _accept(self, name: str, raw: Any, completed: List[str]) -> None:
+        spec = self._fields.get(name)
+        if spec is None:
+            return
+        confidence: Optional[float] = None
+        value = raw
+        if isinstance(raw, dict) and "value" in raw:
+            value = raw.get("value")
+            try:
+                confidence = float(raw.get("confidence"))
+            except (TypeError, ValueError):
+                confidence = None
+        try:
+            coerced = coerce_value(spec, value)
+        except ValueError as exc:
+            self._result.failed[name] = str(exc)
+            self._result.fields[name] = None
+            return
+        self._result.fields[name] = coerced
+        self._result.confidence[name] = confidence
+        if coerced is None:
+            self._result.missing.append(name)
+        completed.append(name)
+
+    def close(self) -> InvoiceExtraction:
+        result = self._result
+        for name in self._fields:
+            if name not in result.fields:
+                result.fields[name] = None
+                result.failed[name] = "absent from response"
+        return result
+
+
+def parse_invoice_json(text: str, fields: Iterable[InvoiceField] = INVOICE_FIELDS) -> InvoiceExtraction:
+    """Parse a complete (non-streamed) response body."""
+    parser = InvoiceStreamParser(fields)
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,203 @@
+"""
+Opt-in sampling profiler for the web app.
+
+`SamplingProfiler` runs one daemon thread that, every PROFILE_INTERVAL_MS,
+reads every thread's current Python stack with `sys._current_frames()` and
+counts it as a collapsed stack (`thread;outer (file.py);...;leaf (file.py)`),
+the input format of flamegraph.pl, speedscope and inferno. Threads parked in
+an idle wait (the event loop's select, an empty worker-pool queue) are
+skipped, so the counts show where busy time goes: pdf2image, base64, JSON,
+the HTTP client's socket reads, sqlite3, LangChain. Nothing is traced and no
+code is instrumented; the cost is one stack walk per thread per sample, paid
+only while something is being profiled (see `stats()["overhead_ms"]`).
+
+Two things can be profiled, independently:
+
+- the whole process, switched on and off at runtime (`set_continuous`);
+- each in-flight request (ProfilingMiddleware), when PROFILE_SLOW_MS is set.
+  A request that takes longer keeps the samples taken during its lifetime,
+  up to the last PROFILE_KEEP_SLOW such requests. Samples cover all threads,
+  so concurrent requests show up in each other's captures.
+
+web_app mounts the middleware and the /api/debug/profile endpoints only when
+DEBUG_PROFILING is set.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from itertools import count
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+DEBUG_PROFILING = os.getenv("DEBUG_PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# 0 disables slow-request capture.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_KEEP_SLOW = int(os.getenv("PROFILE_KEEP_SLOW", "20"))
+PROFILE_MAX_DEPTH = 128
+
+# (file, function) leaves of threads that are waiting for work.
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+# Paths not worth capturing (and the profile endpoints themselves).
+_SKIPPED_PREFIXES = ("/api/debug/", "/static/")
+
+
+def _label(code: Any) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+def collapse(stacks: Counter) -> str:
+    """`stack count` lines, heaviest first."""
+    return "\n".join(f"{stack} {n}" for stack, n in stacks.most_common())
+
+
+class SamplingProfiler:
+    """Samples all threads' stacks while profiling is on; see module docstring."""
+
+    def __init__(
+        self,
+        interval_ms: float = PROFILE_INTERVAL_MS,
+        slow_ms: float = PROFILE_SLOW_MS,
+        keep_slow: int = PROFILE_KEEP_SLOW,
+    ) -> None:
+        self.interval = interval_ms / 1000
+        self.slow_ms = slow_ms
+        self._continuous = False
+        self._stacks: Counter = Counter()
+        self._requests: Dict[int, Counter] = {}
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=keep_slow)
+        self._tokens = count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self.samples = 0
+        self.overhead = 0.0
+
+    def _ensure_thread(self) -> None:
+        # Under the lock, so concurrent first requests start a single thread.
+        with self._lock:
+            # A thread started before a fork does not exist in the child.
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _loop(self) -> None:
+        own = threading.get_ident()
+        while True:
+            self._wake.clear()
+            if not (self._continuous or self._requests):
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            started = time.perf_counter()
+            stacks = self._sample(own)
+            with self._lock:
+                if self._continuous:
+                    self._stacks.update(stacks)
+                for counter in self._requests.values():
+                    counter.update(stacks)
+                self.samples += 1
+                self.overhead += time.perf_counter() - started
+
+    @staticmethod
+    def _sample(skip: int) -> List[str]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                labels.append(_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            stacks.append(";".join(reversed(labels)))
+        return stacks
+
+    def set_continuous(self, enabled: bool) -> None:
+        self._continuous = enabled
+        if enabled:
+            self._ensure_thread()
+
+    def profile(self, reset: bool = False) -> str:
+        """The whole-process profile as collapsed stacks."""
+        with self._lock:
+            text = collapse(self._stacks)
+            if reset:
+                self._stacks.clear()
+        return text
+
+    def request_started(self, path: str) -> Optional[int]:
+        """A token for `request_finished`, or None when not capturing `path`."""
+        if self.slow_ms <= 0 or path.startswith(_SKIPPED_PREFIXES):
+            return None
+        token = next(self._tokens)
+        with self._lock:
+            self._requests[token] = Counter()
+        self._ensure_thread()
+        return token
+
+    def request_finished(self, token: int, method: str, path: str, seconds: float) -> None:
+        with self._lock:
+            stacks = self._requests.pop(token, None)
+        if stacks and seconds * 1000 >= self.slow_ms:
+            self._slow.append(
+                {
+                    "method": method,
+                    "path": path,
+                    "ms": round(seconds * 1000, 1),
+                    "finished_at": time.time(),
+                    "samples": sum(stacks.values()),
+                    "stacks": collapse(stacks),
+                }
+            )
+
+    def slow_requests(self) -> List[Dict[str, Any]]:
+        """Captured slow requests, newest first."""
+        return list(reversed(self._slow))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "continuous": self._continuous,
+            "slow_ms": self.slow_ms,
+            "interval_ms": self.interval * 1000,
+            "in_flight": len(self._requests),
+            "samples": self.samples,
+            "overhead_ms": round(self.overhead * 1000, 1),
+            "slow_captured": len(self._slow),
+        }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware feeding each HTTP request's lifetime to a SamplingProfiler."""
+
+    def __init__(self, app: Callable, profiler: SamplingProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        token = self.profiler.request_started(scope["path"]) if scope["type"] == "http" else None
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_finished(
+                token, scope["method"], scope["path"], time.monotonic() - started
+            )
@@ -0,0 +1,144 @@
+"""
+Compact rendering of SQL results for the agent's prompt.
+
+The stock `sql_db_query` tool returns `str()` of every row, so one broad
+query can put thousands of rows (or long address and bank columns) into
+every later LLM call. `shape_rows` keeps the first RESULT_MAX_ROWS rows as a
+pipe-separated table within RESULT_MAX_CHARS and clips long cells. When rows
+are left out it appends count/min/max/sum per column computed over *all*
+rows, so the model can still answer totals and ranges from the cut result.
+
+Token counts are estimated at ~4 characters per token; they are only used to
+report how much prompt each result saved.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+RESULT_MAX_ROWS = int(os.getenv("AGENT_RESULT_MAX_ROWS", "20"))
+RESULT_MAX_CHARS = int(os.getenv("AGENT_RESULT_MAX_CHARS", "2000"))
+RESULT_MAX_CELL_CHARS = int(os.getenv("AGENT_RESULT_MAX_CELL_CHARS", "60"))
+
+# SQLDatabase.run clips string values to this many characters before str().
+_STOCK_MAX_STRING_LENGTH = 100
+
+# Currency amounts, rendered to the cent: grand_total, SUM(tax), spend, ...
+# Other floats (tax_rate, FX rates, averages of counts) keep 6 significant digits.
+_MONEY_COLUMN = re.compile(r"total|amount|price|cost|charge|discount|spend|tax(?!_?rate)", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _clip(value: Any, limit: int) -> Any:
+    if isinstance(value, str) and len(value) > limit:
+        return value[: limit - 1] + "…"
+    return value
+
+
+def _cell(value: Any, money: bool = False) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        return f"{value:.2f}".rstrip("0").rstrip(".") if money else f"{value:.6g}"
+    return str(_clip(value, RESULT_MAX_CELL_CHARS)).replace("\n", " ").replace("|", "/")
+
+
+@dataclass
+class ColumnSummary:
+    """Running count/min/max/sum for one result column."""
+
+    count: int = 0
+    minimum: Any = None
+    maximum: Any = None
+    total: Optional[float] = 0.0
+    money: bool = False
+
+    def add(self, value: Any) -> None:
+        if value is None:
+            return
+        self.count += 1
+        try:
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+        except TypeError:  # mixed types in one column; ranges are meaningless
+            self.minimum = self.maximum = None
+        if self.total is not None:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.total += value
+            else:
+                self.total = None
+
+    def render(self) -> str:
+        parts = [f"count={self.count}"]
+        if self.count and self.minimum is not None:
+            parts.append(f"min={_cell(self.minimum, self.money)}")
+            parts.append(f"max={_cell(self.maximum, self.money)}")
+        if self.count and self.total is not None:
+            parts.append(f"sum={_cell(self.total, self.money)}")
+        return " ".join(parts)
+
+
+@dataclass
+class ShapedResult:
+    """The text given to the model plus what the raw result would have cost."""
+
+    text: str
+    row_count: int
+    raw_tokens: int
+    shaped_tokens: int
+    summaries: Dict[str, ColumnSummary] = field(default_factory=dict)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.raw_tokens - self.shaped_tokens, 0)
+
+
+def shape_rows(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> ShapedResult:
+    """Render `rows` compactly; consumes the iterable once, keeping few rows."""
+    summaries = {name: ColumnSummary(money=bool(_MONEY_COLUMN.search(name))) for name in columns}
+    money = [summaries[name].money for name in columns]
+    kept: List[str] = []
+    kept_chars = 0
+    keeping = True
+    raw_chars = 0
+    row_count = 0
+
+    for row in rows:
+        row_count += 1
+        for name, value in zip(columns, row):
+            summaries[name].add(value)
+        # What the stock tool would have sent for this row, plus ", ".
+        raw_chars += len(repr(tuple(_clip(v, _STOCK_MAX_STRING_LENGTH) for v in row))) + 2
+        if keeping:
+            line = " | ".join(_cell(v, m) for v, m in zip(row, money))
+            kept_chars += len(line) + 1
+            keeping = len(kept) < RESULT_MAX_ROWS and kept_chars <= RESULT_MAX_CHARS
+            if keeping:
+                kept.append(line)
+
+    if row_count == 0:
+        text = "(no rows)"
+    else:
+        lines = [" | ".join(columns)] + kept
+        if len(kept) < row_count:
+            lines.append(f"(showing {len(kept)} of {row_count} rows)")
+            lines.append("column summary over all rows:")
+            lines.extend(f"- {name}: {summaries[name].render()}" for name in columns)
+        text = "\n".join(lines)
+
+    return ShapedResult(
+        text=text,
+        row_count=row_count,
+        raw_tokens=(raw_chars + 3) // 4,
+        shaped_tokens=estimate_tokens(text),
+        summaries=summaries,
+    )
@@ -0,0 +1,439 @@
+"""
+Columnar analytics over invoices.
+
+Invoice rows are pulled from SQLite in batches straight into NumPy column
+arrays (or read back from Parquet snapshots), and reports are computed with
+vectorized group-bys (`np.bincount`) instead of Python loops over rows:
+spend by month, by vendor, by category, and year-over-year deltas. All
+amounts are `grand_total_base`, i.e. in BASE_CURRENCY.
+
+Parquet support needs the optional `pyarrow` package.
+
+Usage:
+
+    python reporting.py report --year 2024
+    python reporting.py export snapshots/       # incremental Parquet snapshot
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from archive import attach_archives
+from changes import iter_changes, latest_seq
+from fx import BASE_CURRENCY
+from migrations import CHANGES_TABLE
+from seed_invoices import INVOICE_DB_PATH
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+
+BATCH_SIZE = 100_000
+MANIFEST_FILENAME = "_manifest.json"
+
+# First matching category wins; matched against products_services + seller.
+CATEGORY_KEYWORDS = {
+    "food": (
+        "pizza", "burger", "biryani", "food", "meal", "drink", "soda",
+        "coffee", "latte", "espresso", "restaurant", "eats", "zomato",
+    ),
+    "cloud": ("aws", "cloud", "ec2", "s3", "azure", "hosting", "compute", "storage"),
+    "technology": (
+        "laptop", "macbook", "keyboard", "mouse", "monitor", "usb", "dock",
+        "hub", "cable", "phone",
+    ),
+    "office": ("chair", "desk", "office", "stationery", "printer"),
+    "subscriptions": ("subscription", "spotify", "netflix", "365"),
+    "shipping": ("shipping", "delivery", "courier", "dhl", "fedex", "ups"),
+    "services": ("consulting", "design", "review", "service"),
+    "apparel": ("shoes", "socks", "shirt", "nike", "apparel"),
+}
+CATEGORIES = list(CATEGORY_KEYWORDS) + ["other"]
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+_COLUMNS_SQL = """
+    SELECT
+        invoices.id,
+        IFNULL(
+            CAST(substr(invoice_date, 1, 4) AS INTEGER) * 12
+            + CAST(substr(invoice_date, 6, 2) AS INTEGER) - 1,
+            -1
+        ) AS month_index,
+        IFNULL(vendor_id, -1),
+        grand_total_base,
+        IFNULL(products_services, '') || ' ' || IFNULL(seller_information, '')
+    FROM invoices
+    WHERE {where}
+    ORDER BY invoices.id;
+"""
+
+
+def categorize(text: str) -> str:
+    """Keyword category for an invoice's products/seller text."""
+    words = set(_WORD.findall(text.lower()))
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if words.intersection(keywords):
+            return category
+    return "other"
+
+
+def _category_codes(texts: List[str]) -> np.ndarray:
+    """Categorize a batch, classifying each distinct text only once."""
+    distinct: Dict[str, int] = {}
+    inverse = np.fromiter(
+        (distinct.setdefault(t, len(distinct)) for t in texts), dtype=np.int32, count=len(texts)
+    )
+    codes = np.array(
+        [CATEGORIES.index(categorize(t)) for t in distinct], dtype=np.int16
+    )
+    return codes[inverse] if len(texts) else np.zeros(0, dtype=np.int16)
+
+
+@dataclass
+class InvoiceColumns:
+    """Invoice data as parallel NumPy arrays, one entry per invoice."""
+
+    ids: np.ndarray  # int64
+    month_index: np.ndarray  # int32, year * 12 + month - 1; -1 when undated
+    vendor_id: np.ndarray  # int64, -1 when unknown
+    amount: np.ndarray  # float64 grand_total_base, NaN when unconverted
+    category: np.ndarray  # int16 index into CATEGORIES
+
+    @classmethod
+    def empty(cls) -> "InvoiceColumns":
+        return cls(
+            ids=np.zeros(0, dtype=np.int64),
+            month_index=np.zeros(0, dtype=np.int32),
+            vendor_id=np.zeros(0, dtype=np.int64),
+            amount=np.zeros(0, dtype=np.float64),
+            category=np.zeros(0, dtype=np.int16),
+        )
+
+    @classmethod
+    def concat(cls, parts: List["InvoiceColumns"]) -> "InvoiceColumns":
+        if not parts:
+            return cls.empty()
+        return cls(
+            ids=np.concatenate([p.ids for p in parts]),
+            month_index=np.concatenate([p.month_index for p in parts]),
+            vendor_id=np.concatenate([p.vendor_id for p in parts]),
+            amount=np.concatenate([p.amount for p in parts]),
+            category=np.concatenate([p.category for p in parts]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _batch_to_columns(rows: List[tuple]) -> InvoiceColumns:
+    ids, months, vendors, amounts, texts = zip(*rows)
+    return InvoiceColumns(
+        ids=np.asarray(ids, dtype=np.int64),
+        month_index=np.asarray(months, dtype=np.int32),
+        vendor_id=np.asarray(vendors, dtype=np.int64),
+        amount=np.asarray(amounts, dtype=np.float64),  # None becomes NaN
+        category=_category_codes(texts),
+    )
+
+
+def iter_column_batches(
+    conn: sqlite3.Connection, after_id: int = 0, batch_size: int = BATCH_SIZE
+) -> Iterator[InvoiceColumns]:
+    """Yield `InvoiceColumns` batches for invoices with id > `after_id`."""
+    return _fetch_batches(conn.execute(_COLUMNS_SQL.format(where="invoices.id > ?"), (after_id,)), batch_size)
+
+
+def iter_columns_by_id(
+    conn: sqlite3.Connection, invoice_ids: List[int], batch_size: int = BATCH_SIZE
+) -> Iterator[InvoiceColumns]:
+    """Yield `InvoiceColumns` batches for those of `invoice_ids` that exist."""
+    sql = _COLUMNS_SQL.format(where="invoices.id IN (SELECT value FROM json_each(?))")
+    for start in range(0, len(invoice_ids), batch_size):
+        chunk = invoice_ids[start:start + batch_size]
+        yield from _fetch_batches(conn.execute(sql, (json.dumps(chunk),)), batch_size)
+
+
+def _fetch_batches(cursor: sqlite3.Cursor, batch_size: int) -> Iterator[InvoiceColumns]:
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield _batch_to_columns(rows)
+
+
+def load_columns(conn: sqlite3.Connection, batch_size: int = BATCH_SIZE) -> InvoiceColumns:
+    """Every invoice as columns, fetched `batch_size` rows at a time."""
+    return InvoiceColumns.concat(list(iter_column_batches(conn, batch_size=batch_size)))
+
+
+def vendor_names(conn: sqlite3.Connection) -> Dict[int, str]:
+    return dict(conn.execute("SELECT id, display_name FROM vendors;").fetchall())
+
+
+def _sum_by(codes: np.ndarray, amount: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Vectorized GROUP BY code, SUM(amount) over rows selected by `mask`."""
+    selected = mask & (codes >= 0) & ~np.isnan(amount)
+    if not selected.any():
+        return np.zeros(0)
+    return np.bincount(codes[selected], weights=amount[selected])
+
+
+def spend_by_month(cols: InvoiceColumns, year: int) -> List[float]:
+    """Twelve monthly totals for `year`."""
+    first = year * 12
+    in_year = (cols.month_index >= first) & (cols.month_index < first + 12)
+    totals = _sum_by(cols.month_index - first, cols.amount, in_year)
+    out = np.zeros(12)
+    out[: len(totals)] = totals
+    return [round(float(v), 2) for v in out]
+
+
+def spend_by_vendor(
+    cols: InvoiceColumns, names: Dict[int, str], year: Optional[int] = None, top: int = 10
+) -> List[Dict[str, Any]]:
+    mask = np.ones(len(cols), dtype=bool) if year is None else (cols.month_index // 12 == year)
+    totals = _sum_by(cols.vendor_id, cols.amount, mask)
+    order = np.argsort(totals)[::-1][:top]
+    return [
+        {"vendor": names.get(int(v), str(v)), "total": round(float(totals[v]), 2)}
+        for v in order
+        if totals[v] > 0
+    ]
+
+
+def spend_by_category(cols: InvoiceColumns, year: Optional[int] = None) -> Dict[str, float]:
+    mask = np.ones(len(cols), dtype=bool) if year is None else (cols.month_index // 12 == year)
+    totals = _sum_by(cols.category.astype(np.int64), cols.amount, mask)
+    return {
+        CATEGORIES[i]: round(float(total), 2) for i, total in enumerate(totals) if total > 0
+    }
+
+
+def year_over_year(cols: InvoiceColumns) -> List[Dict[str, Any]]:
+    """Per-year totals with absolute and relative change from the prior year."""
+    dated = cols.month_index >= 0
+    years = np.where(dated, cols.month_index // 12, -1)
+    if not dated.any():
+        return []
+    first = int(years[dated].min())
+    totals = _sum_by(years - first, cols.amount, dated)
+    out = []
+    previous = None
+    for offset, total in enumerate(totals):
+        entry: Dict[str, Any] = {"year": first + offset, "total": round(float(total), 2)}
+        if previous is not None:
+            entry["delta"] = round(float(total - previous), 2)
+            entry["delta_pct"] = round(float((total - previous) / previous), 4) if previous else None
+        out.append(entry)
+        previous = total
+    return out
+
+
+def yearly_report(
+    conn: sqlite3.Connection, year: int, cols: Optional[InvoiceColumns] = None
+) -> Dict[str, Any]:
+    cols = cols if cols is not None else load_columns(conn)
+    return {
+        "year": year,
+        "currency": BASE_CURRENCY,
+        "by_month": spend_by_month(cols, year),
+        "by_vendor": spend_by_vendor(cols, vendor_names(conn), year),
+        "by_category": spend_by_category(cols, year),
+        "year_over_year": year_over_year(cols),
+    }
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Parquet snapshots need pyarrow: pip install pyarrow")
+
+
+def _to_table(cols: InvoiceColumns) -> "pa.Table":
+    return pa.table(
+        {
+            "id": cols.ids,
+            "month_index": cols.month_index,
+            "vendor_id": cols.vendor_id,
+            "amount": cols.amount,
+            "category": cols.category,
+        }
+    )
+
+
+def _from_table(table: "pa.Table") -> InvoiceColumns:
+    return InvoiceColumns(
+        ids=table.column("id").to_numpy(),
+        month_index=table.column("month_index").to_numpy(),
+        vendor_id=table.column("vendor_id").to_numpy(),
+        amount=table.column("amount").to_numpy(),
+        category=table.column("category").to_numpy(),
+    )
+
+
+def _part_names(manifest: Dict[str, Any]) -> List[str]:
+    # Snapshots written before the change feed listed bare file names.
+    return [part if isinstance(part, str) else part["name"] for part in manifest["parts"]]
+
+
+def _write_part(out_dir: str, seq: int, batches: Iterator[InvoiceColumns]) -> Optional[Dict[str, Any]]:
+    """Write `batches` to a new part file; its manifest entry, or None when empty."""
+    n = 0
+    path = os.path.join(out_dir, f"part-{seq:012d}-{n:04d}.parquet")
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(out_dir, f"part-{seq:012d}-{n:04d}.parquet")
+    writer = None
+    entry: Dict[str, Any] = {"name": os.path.basename(path), "rows": 0}
+    try:
+        for cols in batches:
+            if not len(cols):
+                continue
+            table = _to_table(cols)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            low, high = int(cols.ids.min()), int(cols.ids.max())
+            entry["rows"] += len(cols)
+            entry["min_id"] = min(low, entry.get("min_id", low))
+            entry["max_id"] = max(high, entry.get("max_id", high))
+    finally:
+        if writer is not None:
+            writer.close()
+    return entry if writer is not None else None
+
+
+def _feed_gap(conn: sqlite3.Connection, since_seq: int, seq: int) -> bool:
+    """
+    True when the changes after `since_seq` can no longer be read in full:
+    pruned from the log, or the database was restored to an earlier state.
+    """
+    if seq < since_seq:
+        return True
+    if seq == since_seq:
+        return False
+    (oldest,) = conn.execute(f"SELECT MIN(seq) FROM {CHANGES_TABLE};").fetchone()
+    return oldest is None or oldest > since_seq + 1
+
+
+def export_parquet(
+    out_dir: str, db_path: str = INVOICE_DB_PATH, batch_size: int = BATCH_SIZE
+) -> int:
+    """
+    Bring the Parquet snapshot in `out_dir` up to date with the hot table.
+
+    The manifest records the change-feed position (changes.py) the snapshot
+    reflects. A run reads the invoice ids changed since then (inserts, edits
+    such as FX recomputes and vendor merges, deletes, and archiving), drops
+    their rows from the part files that hold them (rewriting only those
+    parts), and writes the current version of the ones that still exist as a
+    new part. Without a usable position (first run, older manifest, pruned
+    log, restored database) the snapshot is rewritten from scratch. Parts are
+    replaced only after the new manifest is in place. Returns the number of
+    invoice rows read from the database and written.
+    """
+    _require_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILENAME)
+    manifest: Dict[str, Any] = {"seq": None, "parts": []}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+
+    conn = sqlite3.connect(db_path)
+    written = 0
+    try:
+        # One read transaction: the position and the rows are from the same state.
+        conn.execute("BEGIN;")
+        seq = latest_seq(conn)
+        since = manifest.get("seq")
+        if since is not None and seq == since:
+            return 0
+        parts: List[Dict[str, Any]] = []
+        if since is None or _feed_gap(conn, since, seq):
+            entry = _write_part(out_dir, seq, iter_column_batches(conn, 0, batch_size))
+        else:
+            changed = sorted({change.invoice_id for change in iter_changes(conn, since, until_seq=seq)})
+            entry = _write_part(out_dir, seq, iter_columns_by_id(conn, changed, batch_size))
+            stale = np.asarray(changed, dtype=np.int64)
+            for part in manifest["parts"]:
+                if part["max_id"] < stale[0] or part["min_id"] > stale[-1]:
+                    parts.append(part)
+                    continue
+                table = pq.read_table(os.path.join(out_dir, part["name"]))
+                keep = ~np.isin(table.column("id").to_numpy(), stale)
+                if keep.all():
+                    parts.append(part)
+                elif keep.any():
+                    parts.append(_write_part(out_dir, seq, iter([_from_table(table.filter(pa.array(keep)))])))
+        if entry is not None:
+            parts.append(entry)
+            written = entry["rows"]
+    finally:
+        conn.close()
+
+    old_names = set(_part_names(manifest))
+    manifest = {"seq": seq, "parts": parts}
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp_path, manifest_path)
+    for name in old_names - set(_part_names(manifest)):
+        try:
+            os.remove(os.path.join(out_dir, name))
+        except FileNotFoundError:
+            pass
+    return written
+
+
+def load_parquet_columns(snapshot_dir: str) -> InvoiceColumns:
+    """Read every part of a Parquet snapshot back into columns."""
+    _require_pyarrow()
+    with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    return InvoiceColumns.concat(
+        [_from_table(pq.read_table(os.path.join(snapshot_dir, name))) for name in _part_names(manifest)]
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Columnar invoice reports")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report = sub.add_parser("report", help="Print a yearly spend report as JSON.")
+    report.add_argument("--year", type=int, required=True)
+    report.add_argument("--snapshot", help="Read columns from a Parquet snapshot directory.")
+
+    export = sub.add_parser("export", help="Bring a Parquet snapshot up to date.")
+    export.add_argument("out_dir")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        written = export_parquet(args.out_dir)
+        print(f"Exported {written} new or changed invoices to {args.out_dir}")
+        return
+
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        if not args.snapshot:
+            # year_over_year spans every year, archived ones included.
+            attach_archives(conn)
+        cols = load_parquet_columns(args.snapshot) if args.snapshot else None
+        print(json.dumps(yearly_report(conn, args.year, cols), indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
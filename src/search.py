@@ -0,0 +1,108 @@
+"""
+Ranked full-text search over invoices using the `invoices_fts` FTS5 index.
+
+The index covers the hot table only. On a connection with archives attached
+(archive.py), archived years are matched with `like_filter` over the
+`archived_invoices` view instead: every word as a substring, unranked. Text
+lookups in intents.py use the same pair.
+"""
+
+import re
+import sqlite3
+from typing import Any, Dict, List, Sequence, Tuple
+
+from archive import ARCHIVED_VIEW
+from migrations import FTS_COLUMNS, FTS_TABLE
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free user text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so FTS syntax characters in the
+    input cannot produce a query error; terms are ANDed together.
+    """
+    terms = _TOKEN.findall(text.lower())
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def like_filter(text: str, columns: Sequence[str] = FTS_COLUMNS) -> Tuple[str, List[str]]:
+    """
+    The LIKE counterpart of `fts_query(text)` restricted to `columns`: a
+    predicate requiring every word somewhere in those columns, and its
+    parameters. ("0", []) when `text` has no words.
+    """
+    terms = _TOKEN.findall(text.lower())
+    if not terms:
+        return "0", []
+    haystack = " || ' ' || ".join(f"IFNULL({column}, '')" for column in columns)
+    predicate = " AND ".join(f"({haystack}) LIKE ? ESCAPE '\\'" for _ in terms)
+    # Words are \w+, so "_" is the only LIKE wildcard they can contain.
+    return predicate, ["%" + term.replace("_", r"\_") + "%" for term in terms]
+
+
+def archives_attached(conn: sqlite3.Connection) -> bool:
+    """Whether `conn` has the `archived_invoices` view (see archive.attach_archives)."""
+    row = conn.execute(
+        "SELECT 1 FROM temp.sqlite_master WHERE type = 'view' AND name = ?;", (ARCHIVED_VIEW,)
+    ).fetchone()
+    return row is not None
+
+
+def search_invoices(conn: sqlite3.Connection, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Return invoices matching `text`, best bm25 rank first, then (when
+    archives are attached) archived matches, newest first, with no snippet
+    or rank.
+    """
+    match = fts_query(text)
+    if not match:
+        return []
+    rows = conn.execute(
+        f"""
+        SELECT
+            invoices.id,
+            invoices.invoice_number,
+            invoices.invoice_date,
+            invoices.seller_information,
+            invoices.products_services,
+            invoices.grand_total,
+            invoices.currency,
+            snippet({FTS_TABLE}, -1, '[', ']', '…', 8) AS snippet,
+            {FTS_TABLE}.rank AS rank
+        FROM {FTS_TABLE}
+        JOIN invoices ON invoices.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY {FTS_TABLE}.rank
+        LIMIT ?;
+        """,
+        (match, limit),
+    ).fetchall()
+    if len(rows) < limit and archives_attached(conn):
+        predicate, params = like_filter(text)
+        rows += conn.execute(
+            f"""
+            SELECT id, invoice_number, invoice_date, seller_information, products_services,
+                   grand_total, currency, NULL AS snippet, NULL AS rank
+            FROM {ARCHIVED_VIEW}
+            WHERE {predicate}
+            ORDER BY invoice_date DESC
+            LIMIT ?;
+            """,
+            params + [limit - len(rows)],
+        ).fetchall()
+    columns = (
+        "id",
+        "invoice_number",
+        "invoice_date",
+        "seller_information",
+        "products_services",
+        "grand_total",
+        "currency",
+        "snippet",
+        "rank",
+    )
+    return [dict(zip(columns, row)) for row in rows]
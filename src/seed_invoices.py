@@ -1,6 +1,10 @@
 import sqlite3
 from typing import List, Tuple
 
+from fx import recompute_base_totals
+from migrations import apply_migrations
+from vendors import assign_missing_vendor_ids
+
 
 INVOICE_DB_PATH = "invoices.db"
 
@@ -477,13 +481,23 @@ def _sample_invoices(buyer_name: str = "Yohan") -> List[InvoiceRow]:
     return rows
 
 
+def ensure_invoice_db(db_path: str = INVOICE_DB_PATH) -> None:
+    """Create the invoices table if needed and apply pending migrations."""
+    conn = sqlite3.connect(db_path)
+    try:
+        _create_schema(conn.cursor())
+        apply_migrations(conn)
+    finally:
+        conn.close()
+
+
 def init_invoice_db(db_path: str = INVOICE_DB_PATH) -> None:
     """Create or reset the invoices table and seed it with rich example data."""
+    ensure_invoice_db(db_path)
+
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
-    _create_schema(cursor)
-
     # Reset contents so re-running this script keeps data deterministic.
     cursor.execute("DELETE FROM invoices;")
 
@@ -521,6 +535,8 @@ def init_invoice_db(db_path: str = INVOICE_DB_PATH) -> None:
         """,
         rows,
     )
+    assign_missing_vendor_ids(conn)
+    recompute_base_totals(conn)
 
     conn.commit()
     conn.close()
@@ -0,0 +1,190 @@
+const form = document.getElementById("query-form");
+const questionEl = document.getElementById("question");
+const answerEl = document.getElementById("answer");
+const statusEl = document.getElementById("status");
+const historyEl = document.getElementById("history");
+const clearHistoryBtn = document.getElementById("clear-history");
+const uploadInput = document.getElementById("upload-input");
+const uploadList = document.getElementById("upload-list");
+const simulateBtn = document.getElementById("simulate-segmentation");
+const kpiYtd = document.getElementById("kpi-ytd");
+const kpiTopVendor = document.getElementById("kpi-top-vendor");
+const kpiLastFood = document.getElementById("kpi-last-food");
+const kpiCurrencies = document.getElementById("kpi-currencies");
+// Server-side conversation id; follow-up questions reuse its context.
+let sessionId = null;
+
+// Load KPI metrics once on page load
+(async () => {
+  try {
+    const res = await fetch("/api/metrics");
+    if (!res.ok) return;
+    const data = await res.json();
+
+    if (kpiYtd && typeof data.ytd_spend === "number") {
+      kpiYtd.textContent = `$${data.ytd_spend.toLocaleString(undefined, {
+        minimumFractionDigits: 2,
+        maximumFractionDigits: 2,
+      })}`;
+    }
+
+    if (kpiTopVendor && data.top_vendor) {
+      kpiTopVendor.textContent = data.top_vendor;
+    }
+
+    if (kpiLastFood && data.last_food) {
+      kpiLastFood.textContent = `${data.last_food.date} · ${data.last_food.seller}`;
+    }
+
+    if (kpiCurrencies && data.currency_mix) {
+      kpiCurrencies.textContent = data.currency_mix;
+      if (data.unconverted_invoices) {
+        kpiCurrencies.textContent += ` · ${data.unconverted_invoices} not in totals (no FX rate for ${data.unconverted_currencies.join(", ")})`;
+      }
+    }
+  } catch {
+    // Fail silently for now; KPIs will stay as placeholders.
+  }
+})();
+
+form.addEventListener("submit", async (e) => {
+  e.preventDefault();
+  const question = questionEl.value.trim();
+  if (!question) return;
+
+  statusEl.textContent = "Thinking…";
+  answerEl.textContent = "";
+
+  try {
+    const res = await fetch("/api/query", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ question, session_id: sessionId }),
+    });
+
+    if (!res.ok) {
+      const err = await res.json().catch(() => ({}));
+      throw new Error(err.detail || "Request failed");
+    }
+
+    const data = await res.json();
+    sessionId = data.session_id || sessionId;
+    answerEl.textContent = data.answer || "(No answer returned)";
+
+    // Append to recent questions
+    const li = document.createElement("li");
+    li.textContent = question;
+    historyEl.prepend(li);
+  } catch (err) {
+    answerEl.textContent = "Error: " + err.message;
+  } finally {
+    statusEl.textContent = "";
+  }
+});
+
+if (clearHistoryBtn) {
+  clearHistoryBtn.addEventListener("click", () => {
+    historyEl.innerHTML = "";
+    sessionId = null;
+  });
+}
+
+if (uploadInput && uploadList) {
+  uploadInput.addEventListener("change", () => {
+    const files = Array.from(uploadInput.files || []);
+    if (!files.length) {
+      uploadList.textContent = "No documents staged yet.";
+      return;
+    }
+
+    uploadList.innerHTML = "";
+    const list = document.createElement("ul");
+    list.className = "space-y-1.5";
+
+    files.forEach((file) => {
+      const li = document.createElement("li");
+      li.className =
+        "flex items-center justify-between rounded-lg bg-white border border-slate-200 px-2 py-1.5";
+      const name = document.createElement("span");
+      name.className = "text-[11px] text-slate-700 truncate max-w-[14rem]";
+      name.textContent = file.name;
+
+      const status = document.createElement("span");
+      status.className = "text-[10px] uppercase tracking-wide text-amber-600";
+      status.textContent = "Pending segmentation";
+
+      li.appendChild(name);
+      li.appendChild(status);
+      list.appendChild(li);
+    });
+
+    uploadList.appendChild(list);
+  });
+}
+
+if (simulateBtn && uploadInput && uploadList) {
+  simulateBtn.addEventListener("click", async () => {
+    const files = Array.from(uploadInput.files || []);
+    if (!files.length) return;
+
+    const formData = new FormData();
+    files.forEach((file) => formData.append("files", file));
+
+    uploadList.textContent = "Uploading and segmenting…";
+
+    try {
+      const res = await fetch("/api/upload", {
+        method: "POST",
+        body: formData,
+      });
+
+      if (!res.ok) {
+        const err = await res.json().catch(() => ({}));
+        throw new Error(err.detail || "Upload failed");
+      }
+
+      const data = await res.json();
+      const invoices = data.invoices || [];
+
+      if (!invoices.length) {
+        uploadList.textContent = "No invoices were extracted.";
+        return;
+      }
+
+      const list = document.createElement("ul");
+      list.className = "space-y-1.5";
+
+      invoices.forEach((inv) => {
+        const li = document.createElement("li");
+        li.className =
+          "flex flex-col sm:flex-row sm:items-center sm:justify-between rounded-lg bg-white border border-slate-200 px-2 py-1.5";
+
+        const primary = document.createElement("div");
+        primary.className = "text-[11px] text-slate-800";
+        primary.textContent =
+          (inv.invoice_number || "(no invoice #)") +
+          " · " +
+          (inv.seller_information || "Unknown seller");
+
+        const secondary = document.createElement("div");
+        secondary.className = "text-[10px] text-slate-500 mt-0.5 sm:mt-0";
+        const total =
+          inv.grand_total != null
+            ? `${inv.currency || ""} ${inv.grand_total}`
+            : "";
+        secondary.textContent = [inv.invoice_date, total].filter(Boolean).join(" · ");
+
+        li.appendChild(primary);
+        li.appendChild(secondary);
+        list.appendChild(li);
+      });
+
+      uploadList.innerHTML = "";
+      uploadList.appendChild(list);
+    } catch (err) {
+      uploadList.textContent = "Error: " + err.message;
+    }
+  });
+}
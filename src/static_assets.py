@@ -0,0 +1,163 @@
+"""
+In-memory static asset layer for the dashboard.
+
+The template and everything under `static/` are read once at startup. Each
+static file gets a content-hash URL (`/static/dashboard.3f2a9c1d.js`), and
+references to `/static/<name>` in the template are rewritten to it, so those
+files can be cached for a year (`immutable`) while `index.html` itself is
+revalidated by ETag on every load. Every asset is precompressed with gzip and,
+when the optional `brotli` package is installed (the `brotli` extra),
+brotli; a request is served the smallest variant its Accept-Encoding
+allows, with no per-request work beyond a dict lookup.
+
+Set DASHBOARD_RELOAD=1 in development to pick up edits without a restart.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+DASHBOARD_RELOAD = os.getenv("DASHBOARD_RELOAD", "") == "1"
+
+# Below this, compression headers cost more than they save.
+MIN_COMPRESS_BYTES = 512
+
+INDEX_CACHE_CONTROL = "no-cache"
+VERSIONED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Preference order when a client accepts several encodings.
+_ENCODINGS = ("br", "gzip")
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    media_type: str
+    etag: str
+    # Content-Encoding ("identity", "gzip", "br") -> body.
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+
+def build_asset(body: bytes, media_type: str) -> StaticAsset:
+    """Hash and precompress `body`, keeping variants that are smaller."""
+    variants = {"identity": body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(body, quality=11)
+        for encoding, compressed in candidates.items():
+            if len(compressed) < len(body):
+                variants[encoding] = compressed
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return StaticAsset(media_type=media_type, etag=f'"{digest}"', variants=variants)
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            if q.startswith("q=") and float(q[2:] or 0) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+class StaticAssets:
+    """The dashboard template plus fingerprinted `static/` files."""
+
+    def __init__(self, template_path: Path, static_dir: Path, reload: bool = DASHBOARD_RELOAD) -> None:
+        self.template_path = template_path
+        self.static_dir = static_dir
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._mtimes: Dict[Path, float] = {}
+        self._index: Optional[StaticAsset] = None
+        self._versioned: Dict[str, StaticAsset] = {}
+        self.load()
+
+    def _sources(self) -> Dict[Path, float]:
+        paths = [self.template_path]
+        if self.static_dir.is_dir():
+            paths += sorted(p for p in self.static_dir.iterdir() if p.is_file())
+        return {p: p.stat().st_mtime for p in paths}
+
+    def load(self) -> None:
+        """(Re)read and precompress every asset."""
+        mtimes = self._sources()
+        versioned: Dict[str, StaticAsset] = {}
+        urls: Dict[str, str] = {}
+        for path in mtimes:
+            if path == self.template_path:
+                continue
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            asset = build_asset(path.read_bytes(), media_type)
+            fingerprint = asset.etag.strip('"')[:8]
+            versioned_name = f"{path.stem}.{fingerprint}{path.suffix}"
+            versioned[versioned_name] = asset
+            urls[f"/static/{path.name}"] = f"/static/{versioned_name}"
+
+        html = self.template_path.read_text(encoding="utf-8")
+        if urls:
+            pattern = re.compile("|".join(re.escape(url) for url in urls))
+            html = pattern.sub(lambda m: urls[m.group(0)], html)
+        index = build_asset(html.encode("utf-8"), "text/html; charset=utf-8")
+
+        with self._lock:
+            self._index, self._versioned, self._mtimes = index, versioned, mtimes
+
+    def _maybe_reload(self) -> None:
+        if self.reload and self._sources() != self._mtimes:
+            self.load()
+
+    def index(self) -> StaticAsset:
+        self._maybe_reload()
+        return self._index
+
+    def versioned(self, name: str) -> Optional[StaticAsset]:
+        self._maybe_reload()
+        return self._versioned.get(name)
+
+    @staticmethod
+    def _select(asset: StaticAsset, accept_encoding: str) -> Tuple[str, bytes]:
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in _ENCODINGS:
+            if encoding in asset.variants and (encoding in accepted or "*" in accepted):
+                return encoding, asset.variants[encoding]
+        return "identity", asset.variants["identity"]
+
+    def respond(self, asset: StaticAsset, request: Request, cache_control: str) -> Response:
+        """The best variant for `request`, or 304 when its ETag still matches."""
+        encoding, body = self._select(asset, request.headers.get("accept-encoding", ""))
+        # Strong ETags must differ between encodings of the same content.
+        etag = asset.etag if encoding == "identity" else f'{asset.etag[:-1]}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
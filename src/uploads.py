@@ -0,0 +1,140 @@
+"""
+Streaming multipart spooling for /api/upload.
+
+Declaring `files: list[UploadFile] = File(...)` makes Starlette read and
+spool the whole request body before the endpoint runs, so limits checked in
+the endpoint reject nothing early and every file is written to disk twice.
+`spool_files` parses the body itself as it arrives, with python-multipart's
+push parser, and writes each file part straight to its own spool file:
+
+- a declared Content-Length over MAX_UPLOAD_REQUEST_BYTES is a 413 before
+  any of the body is read;
+- a body (chunked, or lying about its length) that grows past it, or a file
+  past MAX_UPLOAD_FILE_BYTES, is a 413 as soon as the chunk that crosses the
+  limit arrives.
+
+Memory is one received chunk plus the parser's small header buffers.
+"""
+
+import os
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", 50 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", 200 * 1024 * 1024))
+
+
+class _Spooler:
+    """python-multipart callbacks writing `field` file parts under `directory`."""
+
+    def __init__(self, directory: str, field: str, max_file_bytes: int) -> None:
+        self.directory = directory
+        self.field = field
+        self.max_file_bytes = max_file_bytes
+        self.files: List[Tuple[str, Optional[str]]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._out: Optional[BinaryIO] = None
+        self._filename: Optional[str] = None
+        self._size = 0
+
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._size = 0
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _disposition, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name != self.field or b"filename" not in options:
+            return  # other form fields are ignored
+        self._filename = options[b"filename"].decode("utf-8", "replace")
+        path = os.path.join(self.directory, f"{len(self.files)}{Path(self._filename).suffix}")
+        self._out = open(path, "wb")
+        self.files.append((path, self._filename))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._out is None:
+            return
+        self._size += end - start
+        if self._size > self.max_file_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{self._filename} exceeds the {self.max_file_bytes} byte per-file limit",
+            )
+        self._out.write(data[start:end])
+
+    def on_part_end(self) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+
+async def spool_files(
+    headers: Mapping[str, str],
+    stream: AsyncIterator[bytes],
+    directory: str,
+    field: str = "files",
+    max_file_bytes: int = MAX_UPLOAD_FILE_BYTES,
+    max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES,
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Spool the `field` file parts of a multipart body into `directory`;
+    returns `(path, filename)` per file in upload order. See module docstring.
+    """
+    declared = headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > max_request_bytes:
+        raise HTTPException(
+            status_code=413, detail=f"Upload exceeds the {max_request_bytes} byte per-request limit"
+        )
+    content_type, options = parse_options_header(headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    spooler = _Spooler(directory, field, max_file_bytes)
+    parser = MultipartParser(options[b"boundary"], spooler.callbacks())
+    received = 0
+    try:
+        async for chunk in stream:
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise HTTPException(
+                    status_code=413, detail=f"Upload exceeds the {max_request_bytes} byte per-request limit"
+                )
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as exc:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {exc}")
+    finally:
+        spooler.close()
+    return spooler.files
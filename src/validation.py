@@ -0,0 +1,317 @@
+"""
+Ingestion checks for extracted invoices.
+
+`validate_batch` runs before a batch is inserted and returns, per invoice, the
+reasons it should be held back (an empty list means insert it):
+
+- `missing_invoice_number`: no invoice_number (the column is NOT NULL)
+- `net_total_mismatch`: net_total != subtotal + service_charges
+- `total_mismatch`: grand_total != net_total + tax + shipping_costs, nor
+  net_total + shipping_costs (prices that include tax)
+- `line_items_mismatch`: sum(quantities x unit_prices) != subtotal, or the
+  two lists have different lengths
+- `possible_duplicate:<invoice_number>`: same vendor, an invoice date within
+  DUPLICATE_WINDOW_DAYS and a total within DUPLICATE_AMOUNT_TOLERANCE of an
+  earlier invoice (in the database or earlier in the batch) under a different
+  number, e.g. a re-sent receipt or an OCR misread of the number
+
+A check is skipped when any amount it needs is missing: a receipt that only
+shows its grand total has nothing to add up. A discount is accepted whether
+or not it was already applied. The arithmetic
+is done on whole-batch NumPy arrays, and duplicates are found with sorted
+(vendor, day) keys and `searchsorted` over the batch plus the database's
+invoices of the batch's vendors near its dates, so checking a bulk upload costs a few array
+operations and one indexed range query rather than a query per invoice.
+
+Flagged invoices go to `invoice_quarantine` (see ocr.ingest_invoices) with
+their reasons and full fields, to be released or discarded by hand.
+"""
+
+import json
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from migrations import QUARANTINE_TABLE
+
+
+VALIDATION_ABS_TOLERANCE = float(os.getenv("VALIDATION_ABS_TOLERANCE", "0.05"))
+VALIDATION_REL_TOLERANCE = float(os.getenv("VALIDATION_REL_TOLERANCE", "0.005"))
+DUPLICATE_WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", "7"))
+DUPLICATE_AMOUNT_TOLERANCE = float(os.getenv("DUPLICATE_AMOUNT_TOLERANCE", "0.01"))
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+# (vendor, day) pairs are packed into one sortable int64 key.
+_DAY_BITS = 20
+
+
+def _amounts(invoices: Sequence[Dict[str, Any]], name: str) -> np.ndarray:
+    """Column `name` as float64; missing or unparseable values are NaN."""
+
+    def _value(invoice: Dict[str, Any]) -> float:
+        value = invoice.get(name)
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            return float(str(value).replace(",", "").strip())
+        except ValueError:
+            return np.nan
+
+    return np.fromiter((_value(i) for i in invoices), dtype=np.float64, count=len(invoices))
+
+
+def _discounts(invoices: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """The first amount mentioned in each free-text `discount`, else 0."""
+
+    def _value(text: Any) -> float:
+        match = _NUMBER.search(str(text or ""))
+        return abs(float(match.group())) if match else 0.0
+
+    return np.fromiter((_value(i.get("discount")) for i in invoices), dtype=np.float64, count=len(invoices))
+
+
+def _close(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    scale = np.maximum(np.abs(a), np.abs(b))
+    return np.abs(a - b) <= np.maximum(VALIDATION_ABS_TOLERANCE, VALIDATION_REL_TOLERANCE * scale)
+
+
+def _line_item_totals(invoices: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """
+    sum(quantity x unit price) per invoice; NaN when either list is missing,
+    -inf when their lengths differ.
+    """
+    counts = np.zeros(len(invoices), dtype=np.int64)
+    quantities: List[float] = []
+    prices: List[float] = []
+    status = np.zeros(len(invoices), dtype=np.float64)
+    for row, invoice in enumerate(invoices):
+        q = _NUMBER.findall(str(invoice.get("quantities") or ""))
+        p = _NUMBER.findall(str(invoice.get("unit_prices") or ""))
+        if not q or not p:
+            status[row] = np.nan
+        elif len(q) != len(p):
+            status[row] = -np.inf
+        else:
+            counts[row] = len(q)
+            quantities.extend(map(float, q))
+            prices.extend(map(float, p))
+    segments = np.repeat(np.arange(len(invoices)), counts)
+    totals = np.bincount(
+        segments, weights=np.asarray(quantities) * np.asarray(prices), minlength=len(invoices)
+    )
+    return np.where(status == 0, totals, status)
+
+
+def arithmetic_flags(invoices: Sequence[Dict[str, Any]]) -> List[List[str]]:
+    """Totals that do not add up, per invoice."""
+    subtotal = _amounts(invoices, "subtotal")
+    service = _amounts(invoices, "service_charges")
+    net = _amounts(invoices, "net_total")
+    tax = _amounts(invoices, "tax")
+    shipping = _amounts(invoices, "shipping_costs")
+    grand = _amounts(invoices, "grand_total")
+    discount = _discounts(invoices)
+
+    # NaN operands make a comparison False, so each check passes unless all
+    # of its operands are present.
+    gross = subtotal + service
+    net_ok = np.isnan(net + gross) | _close(net, gross) | _close(net, gross - discount)
+    base = np.where(np.isnan(net), gross, net)
+    charged = base + tax + shipping
+    total_ok = (
+        np.isnan(grand + charged)
+        | _close(grand, charged)
+        | _close(grand, charged - discount)
+        # Tax already included in the prices.
+        | _close(grand, base + shipping)
+        | _close(grand, base + shipping - discount)
+    )
+
+    items = _line_item_totals(invoices)
+    items_ok = np.isnan(items) | (
+        np.isfinite(items)
+        & (np.isnan(subtotal) | _close(items, subtotal) | _close(items - discount, subtotal))
+    )
+
+    flags: List[List[str]] = [[] for _ in invoices]
+    for reason, ok in (
+        ("net_total_mismatch", net_ok),
+        ("total_mismatch", total_ok),
+        ("line_items_mismatch", items_ok),
+    ):
+        for row in np.flatnonzero(~ok):
+            flags[row].append(reason)
+    return flags
+
+
+def _days(dates: Sequence[Optional[str]]) -> np.ndarray:
+    """Days since the epoch per ISO date; -1 when missing or invalid."""
+
+    def _day(value: Optional[str]) -> int:
+        try:
+            return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+        except ValueError:
+            return -1
+
+    return np.fromiter((_day(d) for d in dates), dtype=np.int64, count=len(dates))
+
+
+def _recent_invoices(
+    conn: sqlite3.Connection, vendors: np.ndarray, first_day: int, last_day: int
+) -> Dict[str, np.ndarray]:
+    """Vendor, day, amount and number of stored invoices of `vendors` dated in [first_day, last_day]."""
+    rows = conn.execute(
+        """
+        SELECT vendor_id,
+               CAST(julianday(invoice_date) - 2440587.5 AS INTEGER),
+               COALESCE(grand_total_base, grand_total),
+               invoice_number
+        FROM invoices
+        WHERE invoice_date >= ? AND invoice_date <= ?
+          AND vendor_id IN (SELECT value FROM json_each(?));
+        """,
+        (
+            str(np.datetime64(first_day, "D")),
+            str(np.datetime64(last_day, "D")),
+            json.dumps(np.unique(vendors).tolist()),
+        ),
+    ).fetchall()
+    vendor, day, amount, number = zip(*rows) if rows else ((), (), (), ())
+    return {
+        "vendor": np.array(vendor, dtype=np.int64),
+        "day": np.array([-1 if d is None else d for d in day], dtype=np.int64),
+        "amount": np.array([a or 0.0 for a in amount], dtype=np.float64),
+        "number": np.array(number, dtype=object),
+    }
+
+
+def duplicate_flags(conn: sqlite3.Connection, invoices: Sequence[Dict[str, Any]]) -> List[List[str]]:
+    """
+    Near-duplicates of stored or earlier-in-batch invoices, per invoice.
+
+    Each invoice needs `vendor_id`; `grand_total_base` is compared when set,
+    else `grand_total`.
+    """
+    flags: List[List[str]] = [[] for _ in invoices]
+    n = len(invoices)
+    vendor = np.fromiter(
+        (i.get("vendor_id") if i.get("vendor_id") is not None else -1 for i in invoices),
+        dtype=np.int64,
+        count=n,
+    )
+    day = _days([i.get("invoice_date") for i in invoices])
+    amount = np.fromiter(
+        (
+            i["grand_total_base"] if i.get("grand_total_base") is not None else (i.get("grand_total") or 0.0)
+            for i in invoices
+        ),
+        dtype=np.float64,
+        count=n,
+    )
+    usable = (vendor >= 0) & (day >= 0) & (amount > 0)
+    if not usable.any():
+        return flags
+
+    window = DUPLICATE_WINDOW_DAYS
+    recent = _recent_invoices(
+        conn, vendor[usable], int(day[usable].min()) - window, int(day[usable].max()) + window
+    )
+    keep = (recent["day"] >= 0) & (recent["amount"] > 0)
+
+    # Stored invoices come before the whole batch (order -1); batch rows are
+    # compared only with stored ones and with those before them.
+    batch_rows = np.flatnonzero(usable)
+    all_vendor = np.concatenate([recent["vendor"][keep], vendor[batch_rows]])
+    all_day = np.concatenate([recent["day"][keep], day[batch_rows]])
+    all_amount = np.concatenate([recent["amount"][keep], amount[batch_rows]])
+    all_number = np.concatenate(
+        [recent["number"][keep], np.array([invoices[r].get("invoice_number") for r in batch_rows], dtype=object)]
+    )
+    all_order = np.concatenate([np.full(int(keep.sum()), -1, dtype=np.int64), batch_rows])
+
+    keys = (all_vendor << _DAY_BITS) | all_day
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    own = np.arange(len(keys) - len(batch_rows), len(keys))
+    lo = np.searchsorted(sorted_keys, keys[own] - window, side="left")
+    hi = np.searchsorted(sorted_keys, keys[own] + window, side="right")
+    counts = hi - lo
+    query = np.repeat(own, counts)
+    starts = np.repeat(lo - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    candidate = order[np.arange(counts.sum()) + starts]
+
+    scale = np.maximum(all_amount[query], all_amount[candidate])
+    match = (
+        (all_order[candidate] < all_order[query])
+        & (np.abs(all_amount[query] - all_amount[candidate]) <= DUPLICATE_AMOUNT_TOLERANCE * scale)
+        & (all_number[candidate] != all_number[query])
+    )
+    for q, c in zip(query[match], candidate[match]):
+        row = int(all_order[q])
+        if not flags[row]:
+            flags[row].append(f"possible_duplicate:{all_number[c]}")
+    return flags
+
+
+def required_flags(invoices: Sequence[Dict[str, Any]]) -> List[List[str]]:
+    """Invoices that cannot be stored at all."""
+    return [
+        [] if str(invoice.get("invoice_number") or "").strip() else ["missing_invoice_number"]
+        for invoice in invoices
+    ]
+
+
+def validate_batch(conn: sqlite3.Connection, invoices: Sequence[Dict[str, Any]]) -> List[List[str]]:
+    """All reasons to quarantine each invoice of a batch; empty lists pass."""
+    return [
+        required + arithmetic + duplicate
+        for required, arithmetic, duplicate in zip(
+            required_flags(invoices), arithmetic_flags(invoices), duplicate_flags(conn, invoices)
+        )
+    ]
+
+
+def quarantine(conn: sqlite3.Connection, invoice: Dict[str, Any], reasons: List[str]) -> None:
+    """Hold `invoice` back with its reasons (not committed)."""
+    conn.execute(
+        f"INSERT INTO {QUARANTINE_TABLE} (invoice_number, reasons, invoice) VALUES (?, ?, ?);",
+        (invoice.get("invoice_number"), json.dumps(reasons), json.dumps(invoice, default=str)),
+    )
+
+
+def quarantined_invoices(conn: sqlite3.Connection, limit: int = 100) -> List[Dict[str, Any]]:
+    """The most recently quarantined invoices, newest first."""
+    rows = conn.execute(
+        f"""
+        SELECT id, invoice_number, reasons, invoice, quarantined_at
+        FROM {QUARANTINE_TABLE}
+        ORDER BY id DESC
+        LIMIT ?;
+        """,
+        (limit,),
+    ).fetchall()
+    return [
+        {
+            "id": row[0],
+            "invoice_number": row[1],
+            "reasons": json.loads(row[2]),
+            "invoice": json.loads(row[3]),
+            "quarantined_at": row[4],
+        }
+        for row in rows
+    ]
+
+
+def take_quarantined(conn: sqlite3.Connection, quarantine_id: int) -> Optional[Dict[str, Any]]:
+    """Remove one quarantined invoice and return its fields (not committed)."""
+    row = conn.execute(
+        f"SELECT invoice FROM {QUARANTINE_TABLE} WHERE id = ?;", (quarantine_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(f"DELETE FROM {QUARANTINE_TABLE} WHERE id = ?;", (quarantine_id,))
+    return json.loads(row[0])
@@ -0,0 +1,471 @@
+"""
+Local vector index over invoice text, for fuzzy lookups.
+
+Exact SQL (and even FTS) matching misses questions like "that coffee place in
+Philly" or "my cloud bills". This index embeds each invoice's text fields
+(the same columns as the FTS index) with an offline hashing vectorizer: word
+and character-trigram features hashed into VECTOR_INDEX_DIM signed buckets,
+sublinear term frequency, L2-normalized. Trigrams make "philly" close to
+"philadelphia" and "pizzas" close to "pizza" without any model download. Any
+object with `name`, `dim` and `embed(texts)` (for instance a local
+sentence-embedding model) can be passed instead of `HashingEmbedder`.
+
+Storage is two flat files under VECTOR_INDEX_DIR, opened as memory maps:
+
+    vectors.f16   float16 rows of `dim` values
+    ids.i64       the invoice id of each row; -1 marks a superseded row
+
+plus `meta.json` (embedder, dim, rows, change-feed position). New, updated
+and deleted invoices are applied incrementally from the change feed (see
+changes.py): changed invoices are re-embedded and appended, their old rows
+tombstoned, and the files rewritten only when tombstones pile up. Vectors
+are appended before their ids, so ids.i64 holds the committed row count:
+vector rows past it (a writer died in between) are truncated away, and a
+vectors file shorter than it means a rebuild. Worker
+processes sharing the directory take turns through its `lock` file and pick
+up each other's writes from meta.json before applying their own.
+
+Search is a brute-force, chunked matrix-vector product over the memory map.
+Past VECTOR_ANN_MIN_ROWS live rows, an inverted-file (IVF) structure is built
+in memory with a few rounds of k-means, and a query scans only the
+VECTOR_ANN_NPROBE nearest clusters plus rows appended since the build.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Protocol, Tuple
+
+import numpy as np
+
+from changes import ChangeConsumer, latest_seq, net_changes
+from coordination import file_lock
+from migrations import FTS_COLUMNS
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+VECTOR_INDEX_DIM = int(os.getenv("VECTOR_INDEX_DIM", "512"))
+VECTOR_ANN_MIN_ROWS = int(os.getenv("VECTOR_ANN_MIN_ROWS", "20000"))
+VECTOR_ANN_NPROBE = int(os.getenv("VECTOR_ANN_NPROBE", "8"))
+
+CONSUMER_NAME = "vector_index"
+
+# Rows scored per matrix product; bounds the float32 working set.
+_SEARCH_CHUNK_ROWS = 65536
+# Rewrite the files once this share of rows is superseded.
+_COMPACT_TOMBSTONE_SHARE = 0.25
+# Rebuild the IVF once this share of rows was appended after it.
+_ANN_STALE_SHARE = 0.2
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Question filler that would otherwise dominate short queries.
+_STOPWORDS = frozenset(
+    "a an and are at by for from i in is it me my of on or place that the this to was were what when where which "
+    "who with".split()
+)
+
+
+class Embedder(Protocol):
+    name: str
+    dim: int
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """float32 array of shape (len(texts), dim), rows L2-normalized."""
+        ...
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and character trigrams."""
+
+    def __init__(self, dim: int = VECTOR_INDEX_DIM, trigram_weight: float = 0.5) -> None:
+        self.dim = dim
+        self.trigram_weight = trigram_weight
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Dict[str, float]:
+        features: Dict[str, float] = {}
+        for word in _TOKEN.findall(text.lower()):
+            if word in _STOPWORDS:
+                continue
+            features[word] = features.get(word, 0.0) + 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                gram = "#" + padded[i:i + 3]
+                features[gram] = features.get(gram, 0.0) + self.trigram_weight
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * np.log1p(count)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def invoice_text(row: Tuple[Any, ...]) -> str:
+    """The text embedded for one invoice: its FTS columns, blank ones skipped."""
+    return "\n".join(str(value) for value in row if value)
+
+
+def _fetch_texts(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, str]:
+    texts = {}
+    columns = ", ".join(FTS_COLUMNS)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        for invoice_id, *values in conn.execute(
+            f"SELECT id, {columns} FROM invoices WHERE id IN ({placeholders});", chunk
+        ):
+            texts[invoice_id] = invoice_text(values)
+    return texts
+
+
+class _IVF:
+    """Inverted lists over k-means clusters of the rows present at build time."""
+
+    def __init__(self, vectors: np.ndarray, live: np.ndarray, iterations: int = 8, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        rows = np.flatnonzero(live)
+        self.built_rows = len(vectors)
+        nlist = max(1, int(np.sqrt(len(rows))))
+        sample = rows[rng.choice(len(rows), min(len(rows), 50 * nlist), replace=False)]
+        train = np.asarray(vectors[np.sort(sample)], dtype=np.float32)
+        centroids = train[rng.choice(len(train), nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = train[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        self.centroids = centroids
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _SEARCH_CHUNK_ROWS):
+            block = np.asarray(vectors[start:start + _SEARCH_CHUNK_ROWS], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+
+    def candidates(self, query: np.ndarray, nprobe: int, total_rows: int) -> np.ndarray:
+        nearest = np.argsort(self.centroids @ query)[::-1][:nprobe]
+        tail = np.arange(self.built_rows, total_rows)
+        return np.sort(np.concatenate([self.lists[c] for c in nearest] + [tail]))
+
+
+class VectorIndex:
+    """Memory-mapped invoice embeddings kept in step with the change feed."""
+
+    def __init__(
+        self,
+        directory: str = VECTOR_INDEX_DIR,
+        db_path: str = INVOICE_DB_PATH,
+        embedder: Optional[Embedder] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.db_path = db_path
+        self.embedder = embedder or HashingEmbedder()
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._rows_by_id: Dict[int, int] = {}
+        self._ivf: Optional[_IVF] = None
+        self.seq = 0
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / "vectors.f16"
+
+    @property
+    def _ids_path(self) -> Path:
+        return self.directory / "ids.i64"
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.directory / "meta.json"
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.directory / "lock"
+
+    @property
+    def rows(self) -> int:
+        return 0 if self._ids is None else len(self._ids)
+
+    @property
+    def live_rows(self) -> int:
+        return len(self._rows_by_id)
+
+    # -- storage -------------------------------------------------------------
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self) -> None:
+        meta = {"embedder": self.embedder.name, "dim": self.embedder.dim, "rows": self.rows, "seq": self.seq}
+        tmp = self._meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self._meta_path)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """
+        This index's lock plus the directory's lock file, so only one worker
+        process writes the files at a time. Re-entrant within a process.
+        """
+        with self._lock:
+            if self._file_lock_depth:
+                self._file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth -= 1
+                return
+            with file_lock(str(self._lock_path)):
+                self._file_lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth = 0
+
+    def _reload_if_changed(self) -> None:
+        """Pick up files another process wrote since this one last looked."""
+        meta = self._read_meta()
+        if meta is not None and (meta.get("seq"), meta.get("rows")) != (self.seq, self.rows):
+            self.seq = meta["seq"]
+            self._ivf = None
+            self._map()
+
+    def _rows_on_disk(self) -> int:
+        """Rows in ids.i64, which is written after vectors.f16 and so counts only complete rows."""
+        return self._ids_path.stat().st_size // 8 if self._ids_path.exists() else 0
+
+    def _vector_bytes(self, rows: int) -> int:
+        return rows * self.embedder.dim * np.dtype(np.float16).itemsize
+
+    def _map(self) -> None:
+        """(Re)open the memory maps after the files changed size."""
+        dim = self.embedder.dim
+        rows = self._rows_on_disk()
+        if rows == 0:
+            self._vectors = np.zeros((0, dim), dtype=np.float16)
+            self._ids = np.zeros(0, dtype=np.int64)
+        else:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode="r", shape=(rows, dim))
+            self._ids = np.memmap(self._ids_path, dtype=np.int64, mode="r+", shape=(rows,))
+        self._rows_by_id = {int(i): row for row, i in enumerate(self._ids) if i >= 0}
+
+    def _append(self, ids: List[int], vectors: np.ndarray) -> None:
+        with open(self._vectors_path, "ab") as f:
+            # Drop rows a writer that died before appending their ids left behind.
+            f.truncate(self._vector_bytes(self._rows_on_disk()))
+            f.write(vectors.astype(np.float16).tobytes())
+        with open(self._ids_path, "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+
+    def _tombstone(self, invoice_ids: List[int]) -> None:
+        rows = [self._rows_by_id.pop(i) for i in invoice_ids if i in self._rows_by_id]
+        if rows:
+            self._ids[rows] = -1
+            self._ids.flush()
+
+    def _embed_into(self, conn: sqlite3.Connection, invoice_ids: List[int], batch_size: int = 1000) -> None:
+        for start in range(0, len(invoice_ids), batch_size):
+            texts = _fetch_texts(conn, invoice_ids[start:start + batch_size])
+            if texts:
+                self._append(list(texts), self.embedder.embed(list(texts.values())))
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def open(self, conn: Optional[sqlite3.Connection] = None) -> "VectorIndex":
+        """Load the index, rebuilding it when missing or out of step, then sync."""
+        own = conn is None
+        if own:
+            ensure_invoice_db(self.db_path)
+        conn = conn or sqlite3.connect(self.db_path)
+        try:
+            with self._exclusive():
+                consumer = ChangeConsumer(conn, CONSUMER_NAME)
+                meta = self._read_meta()
+                on_disk = self._rows_on_disk()
+                vector_bytes = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+                if (
+                    meta is None
+                    or meta.get("embedder") != self.embedder.name
+                    or meta.get("dim") != self.embedder.dim
+                    or meta.get("rows") != on_disk
+                    or meta.get("seq") != consumer.position
+                    or vector_bytes < self._vector_bytes(on_disk)
+                ):
+                    self.rebuild(conn)
+                else:
+                    if vector_bytes > self._vector_bytes(on_disk):
+                        # A crash between the vectors and ids appends.
+                        os.truncate(self._vectors_path, self._vector_bytes(on_disk))
+                    self.seq = meta["seq"]
+                    self._map()
+                self.sync(conn)
+            conn.commit()
+        finally:
+            if own:
+                conn.close()
+        return self
+
+    def rebuild(self, conn: sqlite3.Connection) -> None:
+        """Embed every invoice from scratch and move the feed position to now."""
+        with self._exclusive():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._vectors = self._ids = None
+            for path in (self._vectors_path, self._ids_path):
+                path.unlink(missing_ok=True)
+            seq = latest_seq(conn)
+            ids = [row[0] for row in conn.execute("SELECT id FROM invoices ORDER BY id;")]
+            self._embed_into(conn, ids)
+            self.seq = seq
+            self._ivf = None
+            self._map()
+            self._write_meta()
+            ChangeConsumer(conn, CONSUMER_NAME).reset(seq)
+            conn.commit()
+
+    def sync(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Apply invoice changes since the last sync; returns how many."""
+        own = conn is None
+        conn = conn or sqlite3.connect(self.db_path)
+        try:
+            with self._lock:
+                if self._ids is None:
+                    self._map()
+                if latest_seq(conn) <= self.seq:
+                    return 0
+            with self._exclusive():
+                self._reload_if_changed()
+                consumer = ChangeConsumer(conn, CONSUMER_NAME)
+                applied = 0
+                for batch in consumer.batches():
+                    actions = net_changes(batch)
+                    self._tombstone(list(actions))
+                    self._embed_into(conn, [i for i, op in actions.items() if op == "upsert"])
+                    self.seq = batch[-1].seq
+                    self._map()
+                    self._write_meta()
+                    consumer.commit(self.seq)
+                    conn.commit()
+                    applied += len(actions)
+                if self.rows > 1000 and self.live_rows < self.rows * (1 - _COMPACT_TOMBSTONE_SHARE):
+                    self.compact()
+                return applied
+        finally:
+            if own:
+                conn.close()
+
+    def compact(self) -> None:
+        """Rewrite the files without superseded rows."""
+        with self._exclusive():
+            keep = np.flatnonzero(np.asarray(self._ids) >= 0)
+            vectors = np.asarray(self._vectors[keep])
+            ids = np.asarray(self._ids[keep])
+            self._vectors = self._ids = None
+            for path, data in ((self._vectors_path, vectors), (self._ids_path, ids)):
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(data.tobytes())
+                os.replace(tmp, path)
+            self._ivf = None
+            self._map()
+            self._write_meta()
+
+    # -- search --------------------------------------------------------------
+
+    def _ann(self) -> Optional[_IVF]:
+        if self.live_rows < VECTOR_ANN_MIN_ROWS:
+            return None
+        if self._ivf is None or self.rows - self._ivf.built_rows > self._ivf.built_rows * _ANN_STALE_SHARE:
+            self._ivf = _IVF(self._vectors, np.asarray(self._ids) >= 0)
+        return self._ivf
+
+    def nearest(self, query: str, k: int = 5, exact: bool = False) -> List[Tuple[int, float]]:
+        """(invoice_id, cosine similarity) of the `k` closest invoices."""
+        with self._lock:
+            if self._ids is None:
+                self._map()
+            if self.live_rows == 0 or k <= 0:
+                return []
+            q = self.embedder.embed([query])[0]
+            ivf = None if exact else self._ann()
+            rows = None if ivf is None else ivf.candidates(q, VECTOR_ANN_NPROBE, self.rows)
+            vectors, ids = self._vectors, self._ids
+            total = self.rows if rows is None else len(rows)
+            best_scores = np.empty(0, dtype=np.float32)
+            best_ids = np.empty(0, dtype=np.int64)
+            for start in range(0, total, _SEARCH_CHUNK_ROWS):
+                if rows is None:
+                    block = slice(start, start + _SEARCH_CHUNK_ROWS)
+                else:
+                    block = rows[start:start + _SEARCH_CHUNK_ROWS]
+                scores = np.asarray(vectors[block], dtype=np.float32) @ q
+                block_ids = np.asarray(ids[block])
+                scores[block_ids < 0] = -np.inf
+                best_scores = np.concatenate([best_scores, scores])
+                best_ids = np.concatenate([best_ids, block_ids])
+                if len(best_scores) > k:
+                    top = np.argpartition(-best_scores, k)[:k]
+                    best_scores, best_ids = best_scores[top], best_ids[top]
+            order = np.argsort(-best_scores)
+            return [
+                (int(best_ids[i]), round(float(best_scores[i]), 4))
+                for i in order
+                if np.isfinite(best_scores[i]) and best_scores[i] > 0
+            ]
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Sync, then the `k` closest invoices with their key fields."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.sync(conn)
+            hits = self.nearest(query, k)
+            if not hits:
+                return []
+            placeholders = ", ".join("?" * len(hits))
+            rows = {
+                row[0]: row
+                for row in conn.execute(
+                    f"""
+                    SELECT id, invoice_date, seller_information, products_services,
+                           grand_total, currency
+                    FROM invoices WHERE id IN ({placeholders});
+                    """,
+                    [invoice_id for invoice_id, _ in hits],
+                )
+            }
+        finally:
+            conn.close()
+        results = []
+        for invoice_id, score in hits:
+            if invoice_id not in rows:
+                continue
+            _, invoice_date, seller, products, total, currency = rows[invoice_id]
+            results.append(
+                {
+                    "invoice_id": invoice_id,
+                    "score": score,
+                    "invoice_date": invoice_date,
+                    "seller": (seller or "").split("\n")[0][:80],
+                    "products": (products or "")[:120],
+                    "grand_total": total,
+                    "currency": currency,
+                }
+            )
+        return results
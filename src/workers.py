@@ -0,0 +1,122 @@
+"""
+Preforking server for running web_app on several cores.
+
+`uvicorn web_app:app --workers N` starts N fresh interpreters, and each one
+builds its own LLM client, reflects every database schema, compiles the agent
+graph, precompresses the static assets and maps the vector index. This
+runner does all of that once, freezes the resulting objects out of the
+garbage collector's reach (so the children's collections do not dirty the
+shared pages), then forks the workers. They share the parent's memory
+copy-on-write and accept connections on one listening socket.
+
+After the fork each worker opens its own database connections (web_app's
+fork hook, plus the per-process connections in coordination.py and
+admission.py). The parent starts no threads, since they would not survive
+the fork: each worker starts its own backup scheduler from the app's
+lifespan, and a lock file lets one of them take each backup. What workers
+must agree on goes through shared files: cached metrics and template
+answers (coordination.py), vector index updates (vector_index.py), and rate
+limits, for which this runner defaults RATE_LIMIT_BACKEND to a SQLite file.
+
+A worker that exits is replaced; SIGINT or SIGTERM stops them all.
+
+    python workers.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Set
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+RATE_LIMITS_DB_PATH = os.getenv("RATE_LIMITS_DB_PATH", "rate_limits.db")
+
+
+def preload() -> Any:
+    """Import the app and build everything workers can share; returns the app."""
+    os.environ.setdefault("RATE_LIMIT_BACKEND", f"sqlite:{RATE_LIMITS_DB_PATH}")
+    import web_app
+
+    for name in web_app.registry.names:
+        web_app.registry.schema_summary(name)
+    gc.collect()
+    gc.freeze()
+    return web_app.app
+
+
+def _run_worker(app: Any, sock: socket.socket, host: str, port: int) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, host=host, port=port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(workers: int = WEB_WORKERS, host: str = "127.0.0.1", port: int = 8000) -> None:
+    app = preload()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children: Set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, host, port)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(max(1, workers)):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {len(children)} workers", file=sys.stderr)
+
+    while children:
+        try:
+            pid, _status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            # Do not spin if workers die right after starting.
+            time.sleep(1.0)
+            if not stopping:
+                spawn()
+    sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run web_app in preforked worker processes")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    serve(args.workers, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import admission
+from admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    AdmissionPolicy,
+    ConcurrencyPool,
+    InMemoryBackend,
+    SQLiteBackend,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", fake)
+    monkeypatch.setattr(admission.time, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBackend()
+    return SQLiteBackend(str(tmp_path / "limits.db"))
+
+
+def test_bucket_admits_burst_then_reports_wait(backend, clock):
+    for _ in range(3):
+        assert backend.take("client", 1.0, rate=0.5, burst=3.0) == 0
+    # Empty: one token at 0.5 tokens per second is two seconds away.
+    assert backend.take("client", 1.0, rate=0.5, burst=3.0) == pytest.approx(2.0)
+
+
+def test_bucket_refills_up_to_burst(backend, clock):
+    for _ in range(3):
+        backend.take("client", 1.0, rate=1.0, burst=3.0)
+    clock.now += 1.5
+    assert backend.take("client", 1.0, rate=1.0, burst=3.0) == 0
+    assert backend.take("client", 1.0, rate=1.0, burst=3.0) == pytest.approx(0.5)
+    clock.now += 3600
+    for _ in range(3):
+        assert backend.take("client", 1.0, rate=1.0, burst=3.0) == 0
+    assert backend.take("client", 1.0, rate=1.0, burst=3.0) > 0
+
+
+def test_buckets_are_per_key(backend, clock):
+    assert backend.take("a", 1.0, rate=0.1, burst=1.0) == 0
+    assert backend.take("a", 1.0, rate=0.1, burst=1.0) > 0
+    assert backend.take("b", 1.0, rate=0.1, burst=1.0) == 0
+
+
+def test_sqlite_buckets_are_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "limits.db")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    assert first.take("client", 1.0, rate=0.1, burst=1.0) == 0
+    assert second.take("client", 1.0, rate=0.1, burst=1.0) > 0
+
+
+def test_pool_queues_then_rejects():
+    async def scenario():
+        pool = ConcurrencyPool("test", concurrency=1, max_queue=1, queue_timeout=5.0)
+        assert await pool.acquire() is None
+        queued = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        assert pool.queued == 1
+        assert await pool.acquire() == "queue_full"
+        pool.release(0.1)
+        assert await queued is None
+        assert (pool.in_flight, pool.queued) == (1, 0)
+        return pool
+
+    pool = asyncio.run(scenario())
+    assert pool.stats.admitted == 2
+    assert pool.stats.queue_full == 1
+
+
+def test_pool_times_out_queued_requests():
+    async def scenario():
+        pool = ConcurrencyPool("test", concurrency=1, max_queue=4, queue_timeout=0.01)
+        await pool.acquire()
+        return pool, await pool.acquire()
+
+    pool, rejected = asyncio.run(scenario())
+    assert rejected == "queue_timeout"
+    assert pool.stats.queue_timeout == 1
+    assert pool.queued == 0
+
+
+def _policy(**overrides):
+    settings = dict(
+        pool="query",
+        paths=["/api/query"],
+        rate_per_min=60.0,
+        burst=2.0,
+        concurrency=4,
+        max_queue=0,
+        queue_timeout=0.0,
+    )
+    settings.update(overrides)
+    return AdmissionPolicy(**settings)
+
+
+def _client(controller):
+    app = FastAPI()
+
+    @app.get("/api/query")
+    async def query():
+        return {"ok": True}
+
+    @app.get("/api/other")
+    async def other():
+        return {"ok": True}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+    return TestClient(app)
+
+
+def test_empty_bucket_is_429_with_retry_after(clock):
+    controller = AdmissionController([_policy()], InMemoryBackend())
+    client = _client(controller)
+    assert client.get("/api/query").status_code == 200
+    assert client.get("/api/query").status_code == 200
+    response = client.get("/api/query")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert response.json()["detail"] == "Too many requests (rate_limited)"
+    assert controller.pools["query"].stats.rate_limited == 1
+    # Ungoverned paths are never limited.
+    assert client.get("/api/other").status_code == 200
+
+
+def test_full_pool_is_503_with_retry_after(clock):
+    controller = AdmissionController([_policy(concurrency=0)], InMemoryBackend())
+    response = _client(controller).get("/api/query")
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) >= 1
+    assert response.json()["detail"] == "Server busy (queue_full)"
+    assert controller.snapshot()["query"]["queue_full"] == 1
+
+
+def test_blocking_backend_runs_off_the_event_loop():
+    class RecordingBackend:
+        blocking = True
+
+        def __init__(self):
+            self.thread = None
+            self.in_loop = None
+
+        def take(self, key, cost, rate, burst):
+            self.thread = threading.current_thread()
+            try:
+                asyncio.get_running_loop()
+                self.in_loop = True
+            except RuntimeError:
+                self.in_loop = False
+            return 0.0
+
+    backend = RecordingBackend()
+    assert _client(AdmissionController([_policy()], backend)).get("/api/query").status_code == 200
+    assert backend.in_loop is False
+
+
+@pytest.mark.parametrize(
+    "forwarded, proxies, expected",
+    [
+        # The client can prepend anything; the proxy appends the real peer.
+        (b"6.6.6.6, 203.0.113.7", 1, "203.0.113.7"),
+        (b"203.0.113.7", 1, "203.0.113.7"),
+        (b"6.6.6.6, 203.0.113.7, 10.0.0.2", 2, "203.0.113.7"),
+        (b"203.0.113.7", 3, "203.0.113.7"),
+        (b"", 1, "127.0.0.1"),
+    ],
+)
+def test_client_key_uses_trusted_proxy_entry(forwarded, proxies, expected):
+    scope = {"client": ("127.0.0.1", 5000)}
+    headers = {b"x-forwarded-for": forwarded}
+    assert AdmissionMiddleware._client(scope, headers, "x-forwarded-for", proxies) == expected
+
+
+def test_client_key_ignores_header_when_not_configured():
+    scope = {"client": ("127.0.0.1", 5000)}
+    headers = {b"x-forwarded-for": b"6.6.6.6"}
+    assert AdmissionMiddleware._client(scope, headers, "", 1) == "127.0.0.1"
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from archive import archive_year, attach_archives
+from intents import try_fast_path
+from search import search_invoices
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+INVOICES = [
+    ("S-2023", "2023-03-01", "Spotify AB", "Premium subscription", 58.12),
+    ("S-2024", "2024-03-01", "Spotify AB", "Premium subscription", 60.00),
+    ("P-2024", "2024-06-01", "Pizza Place", "Margherita pizza", 15.00),
+    ("S-2025", "2025-03-01", "Spotify AB", "Premium subscription", 20.00),
+]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    conn.executemany(
+        """
+        INSERT INTO invoices (
+            invoice_number, invoice_date, seller_information, products_services,
+            grand_total, currency, grand_total_base
+        ) VALUES (?, ?, ?, ?, ?, 'USD', ?);
+        """,
+        [row + (row[-1],) for row in INVOICES],
+    )
+    conn.commit()
+    for year in (2023, 2024):
+        archive_year(conn, year)
+    attach_archives(conn)
+    yield conn
+    conn.close()
+
+
+def test_spend_question_counts_archived_years(conn):
+    hit = try_fast_path(conn, "how much did I spend on subscriptions in total")
+    assert hit["answer"] == "You spent 138.12 USD on subscriptions in total, across 3 invoices."
+
+
+def test_spend_question_in_an_archived_year(conn):
+    hit = try_fast_path(conn, "how much did I spend on spotify in 2024")
+    assert "60.00 USD" in hit["answer"]
+    assert "across 1 invoice." in hit["answer"]
+
+
+def test_last_purchase_found_in_archive(conn):
+    hit = try_fast_path(conn, "when was the last time I ate pizza")
+    assert hit["answer"].startswith("The last time was on 2024-06-01, from Pizza Place")
+
+
+def test_search_returns_hot_then_archived_matches(conn):
+    results = search_invoices(conn, "spotify")
+    assert [r["invoice_number"] for r in results] == ["S-2025", "S-2024", "S-2023"]
+    assert results[0]["snippet"] is not None
+    assert results[1]["rank"] is None
+
+
+def test_search_without_archives_attached_uses_the_index_only(conn):
+    plain = sqlite3.connect(INVOICE_DB_PATH)
+    try:
+        assert [r["invoice_number"] for r in search_invoices(plain, "spotify")] == ["S-2025"]
+    finally:
+        plain.close()
@@ -0,0 +1,128 @@
+import json
+import sqlite3
+
+import pytest
+from PIL import Image, ImageDraw
+
+from batch_import import LocalBatchClient, run_batch_import
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+def _invoice_page(path, seed: int) -> None:
+    """A page that passes pre-OCR screening; `seed` changes its layout."""
+    img = Image.new("RGB", (600, 800), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((40, 40, 560, 120), fill="black")
+    for line in range(20):
+        draw.text((40, 140 + 30 * line), f"Item {seed}-{line} ....... {seed * 7 + line}.00", fill="black")
+    draw.rectangle((40 + 60 * seed, 700, 200 + 60 * seed, 760), fill="black")
+    img.save(path)
+
+
+class Responder:
+    """Answers extraction requests by image, like the vision model would."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.images = {}
+        self.requests = []
+
+    def __call__(self, body):
+        _prompt, image = body["messages"][0]["content"]
+        name = self.images[image["image_url"]["url"]]
+        requested = list(body["response_format"]["json_schema"]["schema"]["properties"])
+        self.requests.append((name, requested))
+        answer = self.answers[name]
+        if callable(answer):
+            answer = answer(len([r for r in self.requests if r[0] == name]))
+        content = json.dumps(
+            {field: {"value": answer.get(field), "confidence": 0.9} for field in requested}
+        )
+        return {"choices": [{"message": {"content": content}}]}
+
+
+class InterruptedClient(LocalBatchClient):
+    """Submits normally, then dies while polling, like a killed process."""
+
+    def status(self, batch_id):
+        raise KeyboardInterrupt
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    directory = tmp_path / "scans"
+    directory.mkdir()
+    for seed, name in enumerate(["a.png", "b.png", "c.png"], start=1):
+        _invoice_page(directory / name, seed)
+    return directory
+
+
+def _register_images(responder, directory):
+    from ocr import encode_invoice_file
+
+    for path in directory.iterdir():
+        if path.suffix == ".png":
+            responder.images[f"data:image/jpeg;base64,{encode_invoice_file(str(path))}"] = path.name
+
+
+def test_resumed_batch_import(archive_dir, tmp_path):
+    answers = {
+        "a.png": {"invoice_number": "A-1", "invoice_date": "2024-05-01", "grand_total": 10, "subtotal": 10},
+        # The date is unreadable at first and only comes back when re-asked.
+        "b.png": lambda attempt: {
+            "invoice_number": "B-1",
+            "invoice_date": "someday" if attempt == 1 else "2024-05-02",
+            "grand_total": 20,
+            "subtotal": 20,
+        },
+        # Same invoice number as a.png: dropped as a duplicate.
+        "c.png": {"invoice_number": "A-1", "invoice_date": "2024-05-03", "grand_total": 30, "subtotal": 30},
+    }
+    responder = Responder(answers)
+    _register_images(responder, archive_dir)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    checkpoint = str(work_dir / "checkpoint.json")
+
+    with pytest.raises(KeyboardInterrupt):
+        run_batch_import(
+            str(archive_dir), InterruptedClient(str(work_dir), responder), checkpoint, poll_interval=0
+        )
+    state = json.load(open(checkpoint))
+    assert {entry["status"] for entry in state.values()} == {"submitted"}
+    first_round = len(responder.requests)
+    assert first_round == 3
+
+    submitted = []
+
+    class CountingClient(LocalBatchClient):
+        def submit(self, jsonl_path):
+            submitted.append(jsonl_path)
+            return super().submit(jsonl_path)
+
+    counts = run_batch_import(
+        str(archive_dir), CountingClient(str(work_dir), responder), checkpoint, poll_interval=0
+    )
+
+    assert counts == {"ingested": 2, "skipped": 1}
+    # The in-flight batch was collected, not resubmitted; only b.png's
+    # failed field went out again, on its own.
+    assert len(submitted) == 1
+    assert responder.requests[first_round:] == [("b.png", ["invoice_date"])]
+    state = json.load(open(checkpoint))
+    assert state["c.png"]["reason"] == "invoice A-1 already stored"
+
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    rows = conn.execute("SELECT invoice_number, invoice_date FROM invoices ORDER BY invoice_number;").fetchall()
+    hashes = conn.execute("SELECT invoice_number FROM invoice_page_hashes ORDER BY invoice_number;").fetchall()
+    conn.close()
+    assert rows == [("A-1", "2024-05-01"), ("B-1", "2024-05-02")]
+    assert hashes == [("A-1",), ("B-1",)]
+
+    # Nothing left to do on a third run.
+    assert run_batch_import(
+        str(archive_dir), CountingClient(str(work_dir), responder), checkpoint, poll_interval=0
+    ) == counts
+    assert len(submitted) == 1
@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from changes import Change, ChangeConsumer, iter_changes, latest_seq, net_changes, prune_changes
+from migrations import CONSUMERS_TABLE
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    conn.execute(f"DELETE FROM {CONSUMERS_TABLE};")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _insert(conn, number):
+    cursor = conn.execute("INSERT INTO invoices (invoice_number, grand_total) VALUES (?, 1);", (number,))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _run(*changes):
+    return [Change(seq, invoice_id, op, "") for seq, (invoice_id, op) in enumerate(changes, start=1)]
+
+
+def test_net_changes_collapses_each_invoice_to_one_action():
+    actions = net_changes(
+        _run(
+            (1, "insert"), (1, "update"),
+            (2, "update"), (2, "delete"),
+            (3, "insert"), (3, "update"), (3, "delete"),
+            (4, "delete"), (4, "insert"),
+        )
+    )
+    assert actions == {1: "upsert", 2: "delete", 4: "upsert"}
+
+
+def test_triggers_log_every_write_in_order(conn):
+    first = _insert(conn, "A")
+    second = _insert(conn, "B")
+    conn.execute("UPDATE invoices SET grand_total = 2 WHERE id = ?;", (first,))
+    conn.execute("DELETE FROM invoices WHERE id = ?;", (second,))
+    conn.commit()
+    changes = list(iter_changes(conn, batch_size=2))
+    assert [(c.invoice_id, c.op) for c in changes] == [
+        (first, "insert"), (second, "insert"), (first, "update"), (second, "delete")
+    ]
+    assert [c.seq for c in changes] == sorted(c.seq for c in changes)
+    assert net_changes(changes) == {first: "upsert"}
+
+
+def test_consumer_reads_only_uncommitted_changes(conn):
+    consumer = ChangeConsumer(conn, "rollup")
+    ids = [_insert(conn, number) for number in "ABC"]
+    assert consumer.lag() == 3
+    batches = list(consumer.batches(batch_size=2))
+    assert [[c.invoice_id for c in batch] for batch in batches] == [ids[:2], ids[2:]]
+
+    consumer.commit(batches[0][-1].seq)
+    assert [c.invoice_id for batch in consumer.batches() for c in batch] == ids[2:]
+    # Positions never move backwards on commit, only on reset.
+    consumer.commit(0)
+    assert consumer.lag() == 1
+    consumer.reset()
+    assert consumer.lag() == 3
+
+
+def test_prune_keeps_what_the_slowest_consumer_needs(conn):
+    fast, slow = ChangeConsumer(conn, "fast"), ChangeConsumer(conn, "slow")
+    ids = [_insert(conn, number) for number in "ABC"]
+    fast.commit(latest_seq(conn))
+    slow.commit(latest_seq(conn) - 1)
+    assert prune_changes(conn) == 2
+    assert [c.invoice_id for batch in slow.batches() for c in batch] == ids[2:]
+
+
+def test_pruning_everything_keeps_latest_seq(conn):
+    consumer = ChangeConsumer(conn, "rollup")
+    for number in "AB":
+        _insert(conn, number)
+    seq = latest_seq(conn)
+    consumer.commit(seq)
+    assert prune_changes(conn) == 2
+    conn.commit()
+    assert latest_seq(conn) == seq
+    assert consumer.lag() == 0
+    assert list(consumer.batches()) == []
+    _insert(conn, "C")
+    assert latest_seq(conn) == seq + 1
+    assert consumer.lag() == 1
@@ -0,0 +1,88 @@
+import importlib
+import sqlite3
+
+import pytest
+
+from fx import FxConverter, load_fx_rates, recompute_base_totals, unconverted_currencies
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+RATES = """currency,effective_date,usd_per_unit
+EUR,2024-01-01,1.10
+EUR,2024-06-01,1.20
+inr,2024-01-01,0.012
+"""
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    (tmp_path / "rates.csv").write_text(RATES)
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    assert load_fx_rates(conn, "rates.csv") == 3
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_latest_rate_effective_on_the_invoice_date(conn):
+    usd = FxConverter(conn, "USD")
+    assert usd.to_base(100, "EUR", "2024-03-01") == 110.0
+    assert usd.to_base(100, "eur", "2024-06-01") == 120.0
+    # Before the first rate, and undated: the earliest and the latest rate.
+    assert usd.to_base(100, "EUR", "2023-01-01") == 110.0
+    assert usd.to_base(100, "EUR", None) == 120.0
+
+
+def test_base_currency_and_missing_currency_are_not_converted(conn):
+    usd = FxConverter(conn, "USD")
+    assert usd.to_base(12.345, "USD", "2024-01-01") == 12.35
+    assert usd.to_base(5, None, "2024-01-01") == 5.0
+    assert usd.to_base(5, "NULL", "2024-01-01") == 5.0
+    assert usd.to_base(None, "EUR", "2024-01-01") is None
+
+
+def test_conversion_through_usd_to_another_base(conn):
+    eur = FxConverter(conn, "EUR")
+    assert eur.to_base(1000, "INR", "2024-02-01") == round(1000 * 0.012 / 1.10, 2)
+    assert eur.to_base(11, "USD", "2024-02-01") == 10.0
+
+
+def test_unknown_currency_has_no_base_total(conn):
+    assert FxConverter(conn, "USD").to_base(100, "XYZ", "2024-01-01") is None
+
+
+def test_recompute_and_report_unconverted(conn):
+    conn.executemany(
+        "INSERT INTO invoices (invoice_number, invoice_date, grand_total, currency) VALUES (?, ?, ?, ?);",
+        [
+            ("1", "2024-03-01", 100, "EUR"),
+            ("2", "2024-03-01", 100, "XYZ"),
+            ("3", "2024-03-02", 50, "XYZ"),
+            ("4", "2024-03-03", 10, "GBP"),
+            ("5", "2024-03-03", None, "GBP"),
+        ],
+    )
+    recompute_base_totals(conn, only_missing=False)
+    rows = dict(conn.execute("SELECT invoice_number, grand_total_base FROM invoices;").fetchall())
+    assert rows["1"] == 110.0 and rows["2"] is None
+    # A missing total is not a missing rate.
+    assert unconverted_currencies(conn) == {"XYZ": 2, "GBP": 1}
+
+
+def test_metrics_count_unconverted_invoices(conn, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    web_app = importlib.import_module("web_app")
+    conn.executemany(
+        """
+        INSERT INTO invoices (invoice_number, invoice_date, grand_total, currency, grand_total_base)
+        VALUES (?, '2024-03-01', ?, ?, ?);
+        """,
+        [("1", 100, "USD", 100.0), ("2", 70, "XYZ", None)],
+    )
+    conn.commit()
+    metrics = web_app._compute_metrics()
+    assert metrics["ytd_spend"] == 100.0
+    assert metrics["unconverted_invoices"] == 1
+    assert metrics["unconverted_currencies"] == ["XYZ"]
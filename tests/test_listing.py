@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+import listing
+from listing import decode_cursor, encode_cursor, export_invoices, list_invoices, parse_columns
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+# Ties on 2024-01-02, and two undated invoices (listed first).
+DATES = [None, "2024-01-02", "2024-01-01", "2024-01-02", None, "2024-01-02", "2024-01-03"]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    conn.executemany(
+        "INSERT INTO invoices (invoice_number, invoice_date, grand_total) VALUES (?, ?, 1);",
+        [(f"N-{i}", date) for i, date in enumerate(DATES)],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _expected(conn, descending=False):
+    rows = conn.execute("SELECT id, IFNULL(invoice_date, '') FROM invoices;").fetchall()
+    return [i for i, _ in sorted(rows, key=lambda r: (r[1], r[0]), reverse=descending)]
+
+
+def _walk(conn, limit, **kwargs):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page, cursor = list_invoices(conn, ["id", "invoice_date"], limit=limit, cursor=cursor, **kwargs)
+        ids += [row["id"] for row in page]
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("", 7)) == ("", 7)
+    assert decode_cursor(encode_cursor("2024-01-02", 12)) == ("2024-01-02", 12)
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", encode_cursor("x", 1)[:-4], "WzEsMl0="])
+def test_malformed_cursors_are_rejected(token):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, len(DATES), len(DATES) + 1])
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_cover_every_row_once_across_ties_and_null_dates(conn, limit, descending):
+    ids, pages = _walk(conn, limit, descending=descending)
+    assert ids == _expected(conn, descending)
+    assert pages == max(1, -(-len(DATES) // limit))
+
+
+def test_undated_invoices_come_first(conn):
+    page, _cursor = list_invoices(conn, ["id", "invoice_date"], limit=2)
+    assert [row["invoice_date"] for row in page] == [None, None]
+
+
+def test_rows_inserted_meanwhile_do_not_shift_pages(conn):
+    first, cursor = list_invoices(conn, ["id", "invoice_date"], limit=3)
+    conn.execute("INSERT INTO invoices (invoice_number, invoice_date, grand_total) VALUES ('early', NULL, 1);")
+    conn.commit()
+    rest, _cursor = list_invoices(conn, ["id", "invoice_date"], limit=100, cursor=cursor)
+    seen = [row["id"] for row in first + rest]
+    assert len(seen) == len(set(seen)) == len(DATES)
+
+
+def test_date_bounds(conn):
+    ids, _pages = _walk(conn, 2, since="2024-01-02", until="2024-01-02")
+    assert len(ids) == 3
+
+
+def test_parse_columns(conn):
+    assert parse_columns(conn, "grand_total, id,grand_total") == ["id", "grand_total"]
+    with pytest.raises(ValueError, match="nope"):
+        parse_columns(conn, "id,nope")
+
+
+def test_export_pages_match_the_listing(conn, monkeypatch):
+    monkeypatch.setattr(listing, "EXPORT_PAGE_ROWS", 2)
+    body = b"".join(export_invoices(["id", "invoice_date"], fmt="csv", db_path=INVOICE_DB_PATH))
+    lines = body.decode().splitlines()
+    assert lines[0] == "id,invoice_date"
+    assert [int(line.split(",")[0]) for line in lines[1:]] == _expected(conn)
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from ocr_parser import (
+    FIELDS_BY_NAME,
+    INVOICE_FIELDS,
+    InvoiceExtraction,
+    InvoiceStreamParser,
+    coerce_value,
+    parse_invoice_json,
+)
+
+
+def _answer(**values):
+    return json.dumps({name: {"value": value, "confidence": 0.9} for name, value in values.items()})
+
+
+def test_chunk_split_json_completes_fields_as_they_arrive():
+    body = _answer(invoice_number="INV-7", grand_total=1234.5, products_services=["Tea", "Cake"])
+    parser = InvoiceStreamParser(INVOICE_FIELDS)
+    completed = []
+    for i in range(0, len(body), 3):
+        completed += parser.feed(body[i:i + 3])
+    assert parser.done
+    assert completed == ["invoice_number", "grand_total", "products_services"]
+    result = parser.close()
+    assert result.fields["invoice_number"] == "INV-7"
+    assert result.fields["grand_total"] == 1234.5
+    assert result.fields["products_services"] == "Tea,Cake"
+    assert result.confidence["grand_total"] == 0.9
+
+
+def test_number_at_the_end_of_a_chunk_waits_for_more_digits():
+    parser = InvoiceStreamParser([FIELDS_BY_NAME["grand_total"]])
+    assert parser.feed('{"grand_total": 12') == []
+    assert parser.feed('34}') == ["grand_total"]
+    assert parser.close().fields["grand_total"] == 1234.0
+
+
+def test_nulls_are_missing_and_absent_fields_failed():
+    result = parse_invoice_json(_answer(invoice_number="INV-1", due_date=None, tax="N/A"))
+    assert result.fields["due_date"] is None
+    assert {"due_date", "tax"} <= set(result.missing)
+    assert result.failed["subtotal"] == "absent from response"
+    assert "invoice_number" not in result.failed
+
+
+def test_truncated_tail_only_loses_its_own_fields():
+    body = _answer(invoice_number="INV-1", grand_total=10)
+    result = parse_invoice_json(body[: body.index('"grand_total"') + 20])
+    assert result.fields["invoice_number"] == "INV-1"
+    assert result.failed["grand_total"] == "absent from response"
+
+
+@pytest.mark.parametrize("text", ["03/04/2024", "03-04-2024", "03.04.2024"])
+def test_ambiguous_numeric_dates_are_rejected(text):
+    with pytest.raises(ValueError, match="ambiguous"):
+        coerce_value(FIELDS_BY_NAME["invoice_date"], text)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("2024-04-03", "2024-04-03"),
+        ("13/04/2024", "2024-04-13"),
+        ("04/13/2024", "2024-04-13"),
+        ("13.04.2024", "2024-04-13"),
+        ("04.04.2024", "2024-04-04"),
+        ("3 April 2024", "2024-04-03"),
+    ],
+)
+def test_unambiguous_dates_are_normalised(text, expected):
+    assert coerce_value(FIELDS_BY_NAME["invoice_date"], text) == expected
+
+
+def test_ambiguous_date_fails_the_field():
+    result = parse_invoice_json(_answer(invoice_date="03.04.2024"))
+    assert result.fields["invoice_date"] is None
+    assert "ambiguous" in result.failed["invoice_date"]
+
+
+def test_numbers_and_lists_are_coerced():
+    assert coerce_value(FIELDS_BY_NAME["grand_total"], "$1,234.50") == 1234.5
+    assert coerce_value(FIELDS_BY_NAME["discount"], None) is None
+    assert coerce_value(FIELDS_BY_NAME["tax_rate"], "18%") == pytest.approx(0.18)
+    assert coerce_value(FIELDS_BY_NAME["quantities"], [1, 2.0]) == "1,2"
+    with pytest.raises(ValueError, match="whole quantities"):
+        coerce_value(FIELDS_BY_NAME["quantities"], [1.5])
+
+
+def test_require_turns_a_null_required_field_into_a_failure():
+    result = parse_invoice_json(_answer(invoice_number=None, due_date=None))
+    result.require(["invoice_number"])
+    assert "invoice_number" not in result.missing
+    assert result.failed["invoice_number"] == "required field is null"
+    assert "due_date" in result.missing
+
+
+def test_merge_takes_only_the_fields_the_re_ask_resolved():
+    first = InvoiceExtraction(
+        fields={"invoice_number": None, "invoice_date": None, "grand_total": None, "tax": 5.0},
+        confidence={"tax": 0.8},
+        failed={"invoice_number": "required field is null", "invoice_date": "ambiguous", "grand_total": "x"},
+    )
+    fields = [FIELDS_BY_NAME[name] for name in ("invoice_number", "invoice_date", "grand_total")]
+    again = parse_invoice_json(
+        json.dumps(
+            {
+                "invoice_number": {"value": "INV-9", "confidence": 0.7},
+                "invoice_date": {"value": "03/04/2024", "confidence": 0.6},
+                "grand_total": {"value": None, "confidence": 0.3},
+            }
+        ),
+        fields,
+    )
+
+    first.merge(again)
+
+    assert first.fields["invoice_number"] == "INV-9"
+    assert first.confidence["invoice_number"] == 0.7
+    assert "ambiguous" in first.failed["invoice_date"]
+    assert "grand_total" not in first.failed and "grand_total" in first.missing
+    assert first.fields["tax"] == 5.0
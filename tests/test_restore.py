@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from archive import archive_year, attach_archives
+from backup import backup_database, restore_backup
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+
+
+def _insert(conn, number, invoice_date):
+    conn.execute(
+        "INSERT INTO invoices (invoice_number, invoice_date, grand_total) VALUES (?, ?, 10);",
+        (number, invoice_date),
+    )
+    conn.commit()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    _insert(conn, "A-2023", "2023-05-01")
+    _insert(conn, "B-2025", "2025-05-01")
+    conn.close()
+    return INVOICE_DB_PATH
+
+
+def _numbers(db):
+    conn = sqlite3.connect(db)
+    try:
+        attach_archives(conn)
+        return sorted(number for (number,) in conn.execute("SELECT invoice_number FROM invoices;"))
+    finally:
+        conn.close()
+
+
+def test_restore_of_a_pre_archive_backup_does_not_duplicate_archived_rows(db):
+    before = backup_database(db).path
+    conn = sqlite3.connect(db)
+    archive_year(conn, 2023)
+    conn.close()
+
+    restore_backup(before, db, keep_current=False)
+
+    assert _numbers(db) == ["A-2023", "B-2025"]
+    conn = sqlite3.connect(db)
+    assert conn.execute("SELECT invoice_number FROM main.invoices;").fetchall() == [("B-2025",)]
+    conn.close()
+
+
+def test_restore_never_reuses_an_archived_id(db):
+    before = backup_database(db).path
+    conn = sqlite3.connect(db)
+    _insert(conn, "C-2024", "2024-05-01")
+    (archived_id,) = conn.execute("SELECT id FROM invoices WHERE invoice_number = 'C-2024';").fetchone()
+    archive_year(conn, 2024)
+    conn.close()
+
+    restore_backup(before, db, keep_current=False)
+
+    conn = sqlite3.connect(db)
+    _insert(conn, "D-2025", "2025-06-01")
+    (new_id,) = conn.execute("SELECT id FROM invoices WHERE invoice_number = 'D-2025';").fetchone()
+    conn.close()
+    assert new_id > archived_id
+    assert _numbers(db) == ["A-2023", "B-2025", "C-2024", "D-2025"]
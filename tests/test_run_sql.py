@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+
+import agent
+from agent import run_sql
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "t.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (n INTEGER, amount REAL);")
+    conn.executemany("INSERT INTO t VALUES (?, ?);", [(i, i * 1.5) for i in range(50)])
+    conn.commit()
+    conn.close()
+    return SQLDatabase.from_uri(f"sqlite:///{path}")
+
+
+def test_rows_are_fetched_while_the_connection_is_checked_out(db, monkeypatch):
+    seen = []
+    shape_rows = agent.shape_rows
+
+    def recording(columns, rows):
+        def rows_with_checkouts():
+            for row in rows:
+                seen.append(db._engine.pool.checkedout())
+                yield row
+
+        return shape_rows(columns, rows_with_checkouts())
+
+    monkeypatch.setattr(agent, "shape_rows", recording)
+    result = run_sql(db, "SELECT n, amount FROM t ORDER BY n;")
+    assert result.row_count == 50
+    assert seen and set(seen) == {1}
+    assert db._engine.pool.checkedout() == 0
+
+
+def test_errors_come_back_as_text(db):
+    result = run_sql(db, "SELECT missing FROM t;")
+    assert result.text.startswith("Error:")
+    assert "no such column" in result.text
+    assert db._engine.pool.checkedout() == 0
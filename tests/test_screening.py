@@ -0,0 +1,42 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from ocr import SkippedInvoice, screen_and_encode, screen_image
+
+
+@pytest.fixture
+def page(tmp_path):
+    path = tmp_path / "page.png"
+    img = Image.new("RGB", (600, 800), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((40, 40, 560, 120), fill="black")
+    for line in range(20):
+        draw.text((40, 140 + 30 * line), f"Item {line} ....... {line * 3}.00", fill="black")
+    img.save(path)
+    return str(path)
+
+
+def test_blank_page_is_skipped(tmp_path):
+    path = tmp_path / "blank.png"
+    Image.new("RGB", (600, 800), "white").save(path)
+    with pytest.raises(SkippedInvoice, match="blank page"):
+        screen_and_encode(str(path), "blank.png", {})
+
+
+def test_identical_page_is_skipped_before_ocr(page):
+    phash = screen_image(page).phash
+    with pytest.raises(SkippedInvoice, match="duplicate of stored invoice INV-1"):
+        screen_and_encode(page, "again.png", {phash: "INV-1"})
+
+
+def test_near_duplicate_is_read_and_flagged(page):
+    phash = screen_image(page).phash
+    base64_image, got, duplicate_of = screen_and_encode(page, "rescan.png", {phash ^ 0b101: "INV-1"})
+    assert base64_image and got == phash
+    assert duplicate_of == "INV-1"
+
+
+def test_unrelated_page_is_not_a_duplicate(page):
+    phash = screen_image(page).phash
+    _image, _phash, duplicate_of = screen_and_encode(page, "other.png", {~phash & (2**256 - 1): "INV-1"})
+    assert duplicate_of is None
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from uploads import spool_files
+
+BOUNDARY = "xyzzy"
+
+
+def _body(*parts):
+    out = b""
+    for field, filename, content in parts:
+        disposition = f'form-data; name="{field}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        out += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _headers(body, **extra):
+    return {
+        "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+        "content-length": str(len(body)),
+        **extra,
+    }
+
+
+class Stream:
+    """The request body in small chunks, recording how much was read."""
+
+    def __init__(self, body, chunk=7):
+        self.body = body
+        self.chunk = chunk
+        self.read = 0
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), self.chunk):
+            self.read = start + self.chunk
+            yield self.body[start:start + self.chunk]
+
+
+def _spool(tmp_path, headers, stream, **limits):
+    return asyncio.run(spool_files(headers, stream, str(tmp_path), **limits))
+
+
+def test_files_are_spooled_in_order(tmp_path):
+    body = _body(("files", "a.pdf", b"%PDF-a" * 50), ("note", None, b"ignored"), ("files", "b.png", b"png"))
+    spooled = _spool(tmp_path, _headers(body), Stream(body))
+    assert [name for _path, name in spooled] == ["a.pdf", "b.png"]
+    assert open(spooled[0][0], "rb").read() == b"%PDF-a" * 50
+    assert spooled[1][0].endswith("1.png")
+
+
+def test_declared_length_over_limit_is_rejected_before_reading(tmp_path):
+    body = _body(("files", "a.pdf", b"x" * 1000))
+    stream = Stream(body)
+    with pytest.raises(HTTPException) as exc:
+        _spool(tmp_path, _headers(body), stream, max_request_bytes=500)
+    assert exc.value.status_code == 413
+    assert stream.read == 0
+
+
+def test_undeclared_body_over_limit_stops_at_the_limit(tmp_path):
+    body = _body(("files", "a.pdf", b"x" * 1000))
+    headers = _headers(body)
+    del headers["content-length"]
+    stream = Stream(body)
+    with pytest.raises(HTTPException) as exc:
+        _spool(tmp_path, headers, stream, max_request_bytes=500)
+    assert exc.value.status_code == 413
+    assert stream.read < 510
+
+
+def test_file_over_limit_is_rejected(tmp_path):
+    body = _body(("files", "small.png", b"x" * 10), ("files", "big.png", b"x" * 300))
+    with pytest.raises(HTTPException) as exc:
+        _spool(tmp_path, _headers(body), Stream(body), max_file_bytes=100)
+    assert exc.value.status_code == 413
+    assert "big.png" in exc.value.detail
+
+
+def test_non_multipart_body_is_a_400(tmp_path):
+    with pytest.raises(HTTPException) as exc:
+        _spool(tmp_path, {"content-type": "application/json"}, Stream(b"{}"))
+    assert exc.value.status_code == 400
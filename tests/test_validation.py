@@ -0,0 +1,125 @@
+import sqlite3
+
+import pytest
+
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+from validation import arithmetic_flags, duplicate_flags, required_flags, validate_batch
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    conn.execute("INSERT INTO vendors (id, canonical_key, display_name) VALUES (1, 'acme', 'Acme'), (2, 'globex', 'Globex');")
+    conn.execute(
+        """
+        INSERT INTO invoices (invoice_number, invoice_date, vendor_id, grand_total, grand_total_base)
+        VALUES ('A-1', '2024-03-10', 1, 100.0, 100.0);
+        """
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _invoice(**fields):
+    return {"invoice_number": "X-1", **fields}
+
+
+def test_consistent_totals_pass():
+    invoices = [
+        _invoice(subtotal=100, service_charges=5, net_total=105, tax=10.5, shipping_costs=4.5, grand_total=120),
+        # Tax already included in the prices.
+        _invoice(subtotal=100, net_total=100, tax=18, grand_total=100),
+        # Discount applied to the grand total.
+        _invoice(subtotal=100, tax=10, grand_total=100, discount="10% (10.00)"),
+        _invoice(quantities="2,1", unit_prices="2.50,5", subtotal=10),
+    ]
+    assert arithmetic_flags(invoices) == [[], [], [], []]
+
+
+def test_totals_that_do_not_add_up_are_flagged():
+    flags = arithmetic_flags(
+        [
+            _invoice(subtotal=100, service_charges=5, net_total=110),
+            _invoice(subtotal=100, net_total=100, tax=10, shipping_costs=0, grand_total=125),
+            _invoice(quantities="2,1", unit_prices="2.50,5", subtotal=12),
+            _invoice(quantities="2,1", unit_prices="2.50", subtotal=5),
+        ]
+    )
+    assert flags == [["net_total_mismatch"], ["total_mismatch"], ["line_items_mismatch"], ["line_items_mismatch"]]
+
+
+def test_checks_with_missing_amounts_are_skipped():
+    assert arithmetic_flags([_invoice(grand_total=42), _invoice(subtotal="n/a", net_total=3)]) == [[], []]
+
+
+def test_tolerance_absorbs_rounding():
+    assert arithmetic_flags([_invoice(subtotal=33.33, tax=3.33, grand_total=36.67)]) == [[]]
+
+
+def test_missing_invoice_number():
+    assert required_flags([{"invoice_number": "  "}, {"invoice_number": "A"}]) == [["missing_invoice_number"], []]
+
+
+def test_stored_near_duplicate_is_flagged(conn):
+    flags = duplicate_flags(
+        conn,
+        [
+            # Same number as the stored invoice: a re-import, not a near-duplicate.
+            _invoice(invoice_number="A-1", vendor_id=1, invoice_date="2024-03-10", grand_total=100.0),
+            _invoice(invoice_number="A-1x", vendor_id=1, invoice_date="2024-03-14", grand_total=100.5),
+            _invoice(invoice_number="A-2", vendor_id=1, invoice_date="2024-03-25", grand_total=100.0),
+            _invoice(invoice_number="G-1", vendor_id=2, invoice_date="2024-03-10", grand_total=100.0),
+            _invoice(invoice_number="A-3", vendor_id=1, invoice_date="2024-03-11", grand_total=150.0),
+        ],
+    )
+    assert flags == [[], ["possible_duplicate:A-1"], [], [], []]
+
+
+def test_duplicate_within_the_batch_flags_the_later_one(conn):
+    flags = duplicate_flags(
+        conn,
+        [
+            _invoice(invoice_number="G-1", vendor_id=2, invoice_date="2024-05-02", grand_total=40.0),
+            _invoice(invoice_number="G-7", vendor_id=2, invoice_date="2024-05-01", grand_total=40.0),
+        ],
+    )
+    assert flags == [[], ["possible_duplicate:G-1"]]
+
+
+def test_base_amount_is_compared_when_set(conn):
+    flags = duplicate_flags(
+        conn,
+        [
+            _invoice(
+                invoice_number="A-9", vendor_id=1, invoice_date="2024-03-09", grand_total=9000, grand_total_base=100.0
+            )
+        ],
+    )
+    assert flags == [["possible_duplicate:A-1"]]
+
+
+def test_invoices_without_vendor_or_date_are_not_compared(conn):
+    flags = duplicate_flags(
+        conn,
+        [
+            _invoice(invoice_number="A-5", invoice_date="2024-03-10", grand_total=100.0),
+            _invoice(invoice_number="A-6", vendor_id=1, invoice_date="unknown", grand_total=100.0),
+        ],
+    )
+    assert flags == [[], []]
+
+
+def test_validate_batch_combines_reasons(conn):
+    reasons = validate_batch(
+        conn,
+        [
+            _invoice(
+                invoice_number=None, vendor_id=1, invoice_date="2024-03-10", grand_total=100.0,
+                subtotal=90, service_charges=0, tax=0, shipping_costs=0,
+            )
+        ],
+    )
+    assert reasons == [["missing_invoice_number", "total_mismatch", "possible_duplicate:A-1"]]
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from seed_invoices import INVOICE_DB_PATH, ensure_invoice_db
+from vendors import VendorResolver, assign_missing_vendor_ids, canonical_vendor_key
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_invoice_db()
+    conn = sqlite3.connect(INVOICE_DB_PATH)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "seller, key",
+    [
+        ("Amazon.com, Seattle, WA, USA", "amazon"),
+        ("Amazon.com Inc., Seattle WA", "amazon"),
+        ("Marks & Spencer PLC\n1 Baker St", "marks and spencer"),
+        ("Coffee Co. Ltd", "coffee"),
+        # A suffix alone is the name.
+        ("Co", "co"),
+        ("  ", None),
+        (None, None),
+    ],
+)
+def test_canonical_vendor_key(seller, key):
+    assert canonical_vendor_key(seller) == key
+
+
+def test_resolver_matches_exactly_then_fuzzily(conn):
+    resolver = VendorResolver(conn)
+    amazon = resolver.resolve("Amazon.com, Seattle, WA")
+    assert resolver.resolve("AMAZON.COM INC., Seattle") == amazon
+    # An OCR misread of one letter is still the same vendor.
+    assert resolver.resolve("Starbucks Coffee, Pune") == resolver.resolve("Starbucks Cofee, Mumbai")
+    assert resolver.resolve("Spotify AB") not in (None, amazon)
+    assert resolver.resolve("") is None
+    assert conn.execute("SELECT display_name FROM vendors WHERE id = ?;", (amazon,)).fetchone() == ("Amazon.com",)
+
+
+def test_resolver_reuses_stored_vendors(conn):
+    first = VendorResolver(conn).resolve("Uber BV, Amsterdam")
+    conn.commit()
+    assert VendorResolver(conn).resolve("UBER BV.") == first
+    (count,) = conn.execute("SELECT COUNT(*) FROM vendors;").fetchone()
+    assert count == 1
+
+
+def test_assign_missing_vendor_ids(conn):
+    conn.executemany(
+        "INSERT INTO invoices (invoice_number, seller_information, grand_total) VALUES (?, ?, 1);",
+        [("1", "Zomato Ltd, Delhi"), ("2", "Zomato Limited"), ("3", None), ("4", "Swiggy, Bangalore")],
+    )
+    assert assign_missing_vendor_ids(conn) == 3
+    rows = dict(conn.execute("SELECT invoice_number, vendor_id FROM invoices;").fetchall())
+    assert rows["1"] == rows["2"] != rows["4"]
+    assert rows["3"] is None
+    assert assign_missing_vendor_ids(conn) == 0